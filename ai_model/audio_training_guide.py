@@ -10,9 +10,33 @@ Key Steps:
 3. Model Setup
 4. Training Configuration
 5. Training and Evaluation
+
+Large datasets can be streamed instead (--streaming): shards are read and
+preprocessed lazily while the Trainer iterates, and the train/validation split
+is decided per example from a content hash, so nothing is materialized up
+front. --measure-memory reports the peak RSS of both ingestion modes.
+
+Our own recordings can be used with --local-loader: WAV/FLAC files under
+--data-dir are labelled by folder name (or a --manifest CSV), decoded and
+augmented on the fly (gain, noise, time shift, reverb) in DataLoader worker
+processes. --measure-throughput reports samples/sec with and without
+augmentation.
+
+Production clips kept by the backend's clip archive are added with
+--clip-archive pointing at the manifest written by
+``manage.py export_clip_archive``; they are read straight out of the archive
+segments.
+
+sweep_training.py tunes the hyperparameters of setup_training_args() with
+parallel trials over a dataset preprocessed once.
 """
 
+import argparse
+import hashlib
+import io
 import os
+import sys
+import time
 import numpy as np
 from datasets import load_dataset, Audio
 from transformers import (
@@ -40,24 +64,81 @@ if __name__ == "__main__":
     multiprocessing.freeze_support()
 
 
-def load_and_preprocess_audio_data():
+# Local shard files that load_dataset can read directly
+SHARD_BUILDERS = {".parquet": "parquet", ".arrow": "arrow"}
+
+# Fraction of the examples that goes to the validation set
+VALIDATION_SIZE = 0.2
+
+
+def find_local_shards(data_dir):
+    """
+    Return (builder, shard files) for a directory of parquet/arrow shards
+
+    Returns (None, []) when the directory holds plain audio files instead.
+    """
+    shards = {}
+    for root, _, files in os.walk(data_dir):
+        for name in files:
+            builder = SHARD_BUILDERS.get(os.path.splitext(name)[1].lower())
+            if builder is not None:
+                shards.setdefault(builder, []).append(os.path.join(root, name))
+
+    if not shards:
+        return None, []
+
+    # Shards of one format only, in a stable order
+    builder = max(shards, key=lambda name: len(shards[name]))
+    return builder, sorted(shards[builder])
+
+
+def load_and_preprocess_audio_data(data_dir=None, streaming=False):
     """
     Step 1: Load and preprocess audio data
+
+    By default the bark detection dataset is loaded from the hub. ``data_dir``
+    can point to a local directory of parquet/arrow shards, or of audio files
+    in one folder per label ("bark" and anything else). With ``streaming``
+    nothing is downloaded or decoded up front.
     """
     print("Loading audio dataset...")
 
-    # Load the bark detection dataset
-    dataset = load_dataset(
-        "rmarcosg/bark-detection", split="train", cache_dir="dogs_sounds"
-    )
+    builder = None
+    if data_dir is None:
+        # Load the bark detection dataset
+        dataset = load_dataset(
+            "rmarcosg/bark-detection",
+            split="train",
+            cache_dir="dogs_sounds",
+            streaming=streaming,
+        )
+    else:
+        builder, shards = find_local_shards(data_dir)
+        if builder is not None:
+            print(f"Reading {len(shards)} {builder} shards from {data_dir}")
+            dataset = load_dataset(
+                builder, data_files=shards, split="train", streaming=streaming
+            )
+        else:
+            dataset = load_dataset(
+                "audiofolder", data_dir=data_dir, split="train", streaming=streaming
+            )
 
-    print(f"Dataset loaded: {len(dataset)} samples")
+    if not streaming:
+        print(f"Dataset loaded: {len(dataset)} samples")
     print(f"Dataset features: {dataset.features}")
 
     # Cast audio column to proper format with resampling
     # Use decode=False to avoid torchcodec issues
     dataset = dataset.cast_column("audio", Audio(sampling_rate=16000, decode=False))
 
+    if data_dir is not None and builder is None:
+        # Folder labels are numbered alphabetically, bark must be 1
+        names = dataset.features["label"].names
+        dataset = dataset.map(
+            lambda example: {"label": int(names[example["label"]] == "bark")}
+        )
+
     return dataset
 
 
@@ -100,7 +181,7 @@ def load_audio_file(audio_path, target_sampling_rate=16000):
         return np.zeros(target_sampling_rate), target_sampling_rate
 
 
-def preprocess_batch(batch, feature_extractor):
+def preprocess_batch(batch, feature_extractor, padding=True):
     """
     Step 3: Preprocess audio batches
     Convert audio to model input format
@@ -109,7 +190,10 @@ def preprocess_batch(batch, feature_extractor):
 
     # Process each audio file
     for audio_info in batch["audio"]:
-        if isinstance(audio_info, dict) and "path" in audio_info:
+        if isinstance(audio_info, dict) and audio_info.get("bytes"):
+            # Audio embedded in a shard
+            audio_array, _ = load_audio_file(io.BytesIO(audio_info["bytes"]))
+        elif isinstance(audio_info, dict) and "path" in audio_info:
             # Load audio file manually
             audio_array, _ = load_audio_file(audio_info["path"])
         elif isinstance(audio_info, dict) and "array" in audio_info:
@@ -129,7 +213,7 @@ def preprocess_batch(batch, feature_extractor):
         audio_arrays,
         sampling_rate=target_sampling_rate,
         return_tensors="pt",
-        padding=True,
+        padding=padding,
         truncation=True,
         max_length=16000,  # 1 second at 16kHz
     )
@@ -170,6 +254,357 @@ def prepare_datasets(dataset, feature_extractor):
     return train_dataset, eval_dataset
 
 
+def in_validation_split(example, test_size=VALIDATION_SIZE):
+    """
+    Decide the split of one example from a hash of its audio
+
+    The decision does not depend on the order or number of examples, so the
+    split is the same on every pass over a stream and identical clips always
+    end up on the same side.
+    """
+    audio = example["audio"]
+    if isinstance(audio, dict):
+        content = audio.get("bytes") or (audio.get("path") or "").encode()
+    else:
+        content = str(audio).encode()
+
+    return hash_fraction(content) < test_size
+
+
+def hash_fraction(content):
+    """
+    Map bytes to a stable number in [0, 1)
+    """
+    digest = hashlib.blake2b(content, digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+def prepare_streaming_datasets(
+    dataset, feature_extractor, test_size=VALIDATION_SIZE, shuffle_buffer=500
+):
+    """
+    Step 4 (streaming): Lazily split and preprocess an iterable dataset
+
+    Examples are only decoded when the Trainer asks for them, one batch of a
+    shard at a time. Every example is padded to the model's one second input,
+    so batches from different shards can be collated together.
+    """
+    print("Preparing streaming datasets...")
+
+    columns = dataset.column_names or ["audio", "label"]
+
+    def preprocess(batch):
+        return preprocess_batch(batch, feature_extractor, padding="max_length")
+
+    train_dataset = dataset.filter(
+        lambda example: not in_validation_split(example, test_size)
+    )
+    train_dataset = train_dataset.shuffle(seed=42, buffer_size=shuffle_buffer)
+    train_dataset = train_dataset.map(
+        preprocess, batched=True, batch_size=16, remove_columns=columns
+    )
+
+    eval_dataset = dataset.filter(lambda example: in_validation_split(example, test_size))
+    eval_dataset = eval_dataset.map(
+        preprocess, batched=True, batch_size=16, remove_columns=columns
+    )
+
+    return train_dataset, eval_dataset
+
+
+# Audio files picked up by the local-directory loader
+LOCAL_AUDIO_EXTENSIONS = (".wav", ".flac")
+
+
+def index_local_audio(data_dir=None, manifest=None):
+    """
+    Step 1 (local): Index a directory of recordings as (path, label) pairs
+
+    Without a manifest every file under a folder named "bark" is a bark and
+    everything else is not. A manifest is a CSV with "path" and "label"
+    columns; paths are relative to the manifest and labels can be "bark"/1 or
+    anything else for no bark.
+    """
+    files = []
+
+    if manifest is not None:
+        root = os.path.dirname(os.path.abspath(manifest))
+        table = pd.read_csv(manifest)
+        for path, label in zip(table["path"], table["label"]):
+            is_bark = str(label).strip().lower() in ("1", "bark", "true")
+            files.append((os.path.join(root, path), int(is_bark)))
+    else:
+        for directory, _, names in os.walk(data_dir):
+            is_bark = os.path.basename(directory).lower() == "bark"
+            for name in sorted(names):
+                if name.lower().endswith(LOCAL_AUDIO_EXTENSIONS):
+                    files.append((os.path.join(directory, name), int(is_bark)))
+        root = data_dir
+
+    files.sort()
+    print(f"Indexed {len(files)} local recordings ({sum(label for _, label in files)} barks)")
+
+    return files, root
+
+
+def index_clip_archive(manifest):
+    """
+    Step 1 (archive): Index the clips of a backend clip archive manifest
+
+    Each clip is referenced as (segment, offset, length) inside the archive,
+    labels are read like those of a local manifest.
+    """
+    root = os.path.dirname(os.path.abspath(manifest))
+    table = pd.read_csv(manifest)
+    clips = []
+    for clip_id, segment, offset, length, label in zip(
+        table["clip_id"], table["segment"], table["offset"], table["length"], table["label"]
+    ):
+        is_bark = str(label).strip().lower() in ("1", "bark", "true")
+        source = (os.path.join(root, segment), int(offset), int(length))
+        clips.append((clip_id, source, int(is_bark)))
+
+    print(f"Indexed {len(clips)} archived clips ({sum(label for *_, label in clips)} barks)")
+
+    return clips
+
+
+def split_clip_archive(clips, test_size=VALIDATION_SIZE):
+    """
+    Deterministic train/validation split of archived clips by content hash
+    """
+    train_files, eval_files = [], []
+    for clip_id, source, label in clips:
+        if hash_fraction(clip_id.encode()) < test_size:
+            eval_files.append((source, label))
+        else:
+            train_files.append((source, label))
+
+    return train_files, eval_files
+
+
+def load_archived_clip(source):
+    """
+    Decode one clip out of a clip archive segment with a single range read
+    """
+    segment, offset, length = source
+    with open(segment, "rb") as f:
+        f.seek(offset)
+        audio, sampling_rate = sf.read(io.BytesIO(f.read(length)), dtype="float32")
+
+    return audio, sampling_rate
+
+
+def split_local_audio(files, root, test_size=VALIDATION_SIZE):
+    """
+    Deterministic train/validation split of indexed files by relative path
+    """
+    train_files, eval_files = [], []
+    for path, label in files:
+        relative = os.path.relpath(path, root).replace(os.sep, "/")
+        if hash_fraction(relative.encode()) < test_size:
+            eval_files.append((path, label))
+        else:
+            train_files.append((path, label))
+
+    return train_files, eval_files
+
+
+class AudioAugmenter:
+    """
+    Random gain, noise mixing, time shift and room reverb for one clip
+
+    Everything is whole-array NumPy work in float32, so it is cheap enough to
+    run per example inside the DataLoader workers. Noise comes from the clips
+    in ``noise_files`` when given, otherwise it is white noise.
+    """
+
+    def __init__(
+        self,
+        noise_files=(),
+        gain_db=(-6.0, 6.0),
+        snr_db=(5.0, 30.0),
+        noise_probability=0.5,
+        max_shift_seconds=0.2,
+        reverb_probability=0.3,
+        rt60_seconds=(0.1, 0.6),
+        sampling_rate=16000,
+    ):
+        self.noise_files = list(noise_files)
+        self.gain_db = gain_db
+        self.snr_db = snr_db
+        self.noise_probability = noise_probability
+        self.max_shift = int(max_shift_seconds * sampling_rate)
+        self.reverb_probability = reverb_probability
+        self.rt60_seconds = rt60_seconds
+        self.sampling_rate = sampling_rate
+
+        # Loaded lazily, once per worker process
+        self._noise_bank = None
+
+    def __call__(self, audio, rng):
+        # Time shift, filling with silence rather than wrapping around
+        shift = int(rng.integers(-self.max_shift, self.max_shift + 1))
+        if shift:
+            shifted = np.zeros_like(audio)
+            if shift > 0:
+                shifted[shift:] = audio[:-shift]
+            else:
+                shifted[:shift] = audio[-shift:]
+            audio = shifted
+
+        if rng.random() < self.reverb_probability:
+            audio = self.reverb(audio, rng)
+
+        if rng.random() < self.noise_probability:
+            audio = self.add_noise(audio, rng)
+
+        gain = np.float32(10 ** (rng.uniform(*self.gain_db) / 20))
+        audio = audio * gain
+
+        return audio
+
+    def reverb(self, audio, rng):
+        """
+        Convolve with a synthetic room impulse response
+        """
+        rt60 = rng.uniform(*self.rt60_seconds)
+        length = int(rt60 * self.sampling_rate)
+        # Exponentially decaying noise, -60 dB after rt60 seconds
+        envelope = np.exp(-6.9 * np.arange(length, dtype=np.float32) / length)
+        impulse = rng.standard_normal(length).astype(np.float32) * envelope
+        impulse[0] = 1.0
+        impulse /= np.sqrt(np.sum(impulse**2))
+
+        n_fft = 1 << (len(audio) + length - 1).bit_length()
+        wet = np.fft.irfft(np.fft.rfft(audio, n_fft) * np.fft.rfft(impulse, n_fft), n_fft)
+
+        return wet[: len(audio)].astype(np.float32)
+
+    def add_noise(self, audio, rng):
+        """
+        Mix in noise at a random signal-to-noise ratio
+        """
+        if self.noise_files:
+            if self._noise_bank is None:
+                self._noise_bank = [
+                    load_audio_file(path, self.sampling_rate)[0].astype(np.float32)
+                    for path in self.noise_files
+                ]
+            clip = self._noise_bank[rng.integers(len(self._noise_bank))]
+            offset = int(rng.integers(max(len(clip) - len(audio), 0) + 1))
+            noise = np.resize(clip[offset:], len(audio))
+        else:
+            noise = rng.standard_normal(len(audio)).astype(np.float32)
+
+        signal_power = np.mean(audio**2) + 1e-10
+        noise_power = np.mean(noise**2) + 1e-10
+        snr = 10 ** (rng.uniform(*self.snr_db) / 10)
+        scale = np.sqrt(signal_power / (noise_power * snr))
+
+        return audio + np.float32(scale) * noise
+
+
+class LocalAudioDataset(torch.utils.data.Dataset):
+    """
+    Step 4 (local): Decode, augment and preprocess recordings on access
+
+    Nothing is stored but the file list, so with dataloader workers the decode
+    and augmentation of the next batches run in parallel with training. Files
+    are paths, or (segment, offset, length) of clips in a clip archive.
+    """
+
+    def __init__(self, files, feature_extractor, augmenter=None, max_length=16000):
+        self.files = files
+        self.feature_extractor = feature_extractor
+        self.augmenter = augmenter
+        self.max_length = max_length
+
+        # Augmentation generator of the current process, see augmentation_rng
+        self._rng = None
+        self._rng_seed = None
+
+    def __len__(self):
+        return len(self.files)
+
+    def augmentation_rng(self):
+        """
+        Random generator for augmentations in this process
+
+        DataLoader seeds every worker with its own torch.initial_seed(), drawn
+        anew for each pass over the data, so workers never share a stream and
+        epochs differ. Without workers the seed stays the same and the one
+        generator simply keeps advancing from epoch to epoch.
+        """
+        seed = torch.initial_seed()
+        if self._rng is None or self._rng_seed != seed:
+            self._rng = np.random.default_rng(seed)
+            self._rng_seed = seed
+        return self._rng
+
+    def __getitem__(self, index):
+        path, label = self.files[index]
+        if isinstance(path, tuple):
+            audio, sampling_rate = load_archived_clip(path)
+        else:
+            audio, sampling_rate = load_audio_file(path)
+
+        # Fixed one second input, padded with silence
+        clip = np.zeros(self.max_length, dtype=np.float32)
+        audio = audio[: self.max_length]
+        clip[: len(audio)] = audio
+
+        if self.augmenter is not None:
+            clip = self.augmenter(clip, self.augmentation_rng())
+
+        inputs = self.feature_extractor(
+            clip, sampling_rate=sampling_rate, return_tensors="np"
+        )
+
+        return {"input_values": inputs.input_values[0], "labels": label}
+
+
+def prepare_local_datasets(
+    data_dir,
+    feature_extractor,
+    manifest=None,
+    augment=True,
+    noise_dir=None,
+    clip_archive=None,
+):
+    """
+    Step 4 (local): Build train/validation datasets over local recordings
+
+    Clips of a clip archive manifest are added to the recordings (or used on
+    their own without --data-dir and --manifest). Only the training set is
+    augmented.
+    """
+    train_files, eval_files = [], []
+    if data_dir is not None or manifest is not None:
+        files, root = index_local_audio(data_dir, manifest)
+        train_files, eval_files = split_local_audio(files, root)
+
+    if clip_archive is not None:
+        archive_train, archive_eval = split_clip_archive(index_clip_archive(clip_archive))
+        train_files += archive_train
+        eval_files += archive_eval
+
+    augmenter = None
+    if augment:
+        noise_files = []
+        if noise_dir is not None:
+            noise_files = [path for path, _ in index_local_audio(noise_dir)[0]]
+        augmenter = AudioAugmenter(noise_files)
+
+    train_dataset = LocalAudioDataset(train_files, feature_extractor, augmenter)
+    eval_dataset = LocalAudioDataset(eval_files, feature_extractor)
+
+    print(f"Training samples: {len(train_dataset)}")
+    print(f"Validation samples: {len(eval_dataset)}")
+
+    return train_dataset, eval_dataset
+
+
 def setup_model():
     """
     Step 5: Set up the audio classification model
@@ -185,34 +620,56 @@ def setup_model():
     return model
 
 
-def setup_training_args():
+def setup_training_args(
+    max_steps=-1,
+    num_workers=0,
+    learning_rate=3e-5,
+    warmup_steps=500,
+    num_train_epochs=3,
+    batch_size=8,
+    output_dir=None,
+    eval_steps=None,
+):
     """
     Step 6: Configure training arguments
+
+    Streaming datasets have no length, so training is then bounded by
+    ``max_steps`` and evaluation and checkpoints happen every 100 steps.
+    With ``eval_steps`` they happen every that many steps instead of after
+    every epoch. The hyperparameters can be overridden, see sweep_training.py.
     """
+    strategy = "steps" if max_steps > 0 or eval_steps else "epoch"
+
+    extra = {}
+    if output_dir is not None:
+        extra["output_dir"] = output_dir
+
     training_args = TrainingArguments(
         #output_dir="./bark_model",
+        **extra,
         # Training configuration
-        num_train_epochs=3,
-        per_device_train_batch_size=8,
-        per_device_eval_batch_size=8,
-        learning_rate=3e-5,
+        num_train_epochs=num_train_epochs,
+        max_steps=max_steps,
+        per_device_train_batch_size=batch_size,
+        per_device_eval_batch_size=batch_size,
+        learning_rate=learning_rate,
         weight_decay=0.01,
-        warmup_steps=500,
+        warmup_steps=warmup_steps,
         # Evaluation configuration
-        eval_strategy="epoch",
-        eval_steps=100,
-        save_strategy="epoch",
+        eval_strategy=strategy,
+        eval_steps=eval_steps or 100,
+        save_strategy=strategy,
+        save_steps=eval_steps or 100,
         load_best_model_at_end=True,
         metric_for_best_model="eval_accuracy",
         greater_is_better=True,
         # Logging configuration
-        logging_dir="./logs",
         logging_steps=50,
-        report_to=None,  # Disable wandb/tensorboard if not needed
+        report_to="none",  # Disable wandb/tensorboard if not needed
         # Save configuration
         save_total_limit=2,  # Keep only 2 best checkpoints
         # Other settings - Fix for Windows multiprocessing
-        dataloader_num_workers=0,  # Set to 0 for Windows compatibility
+        dataloader_num_workers=num_workers,  # Keep 0 on Windows
         remove_unused_columns=False,
         push_to_hub=False,  # Set to True if you want to push to HF Hub
     )
@@ -261,32 +718,218 @@ def train_model(model, train_dataset, eval_dataset, training_args):
     return trainer
 
 
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB (None where unsupported)
+    """
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+def measure_ingestion(data_dir, streaming):
+    """
+    Run one ingestion mode to completion and return (examples, seconds, peak MB)
+    """
+    start = time.perf_counter()
+
+    dataset = load_and_preprocess_audio_data(data_dir, streaming=streaming)
+    feature_extractor = setup_feature_extractor()
+
+    if streaming:
+        train_dataset, eval_dataset = prepare_streaming_datasets(
+            dataset, feature_extractor
+        )
+        examples = sum(1 for _ in train_dataset) + sum(1 for _ in eval_dataset)
+    else:
+        train_dataset, eval_dataset = prepare_datasets(dataset, feature_extractor)
+        examples = len(train_dataset) + len(eval_dataset)
+
+    return examples, time.perf_counter() - start, peak_rss_mb()
+
+
+def report_ingestion_memory(data_dir=None):
+    """
+    Compare the peak RSS of materialized and streaming ingestion
+
+    Each mode runs in a fresh process, so neither inherits the other's peak.
+    """
+    context = multiprocessing.get_context("spawn")
+
+    rows = []
+    for streaming in (False, True):
+        with context.Pool(1) as pool:
+            rows.append(
+                (streaming, *pool.apply(measure_ingestion, (data_dir, streaming)))
+            )
+
+    print(f"\n{'mode':<14}{'examples':>10}{'seconds':>10}{'peak RSS MB':>14}")
+    for streaming, examples, seconds, peak in rows:
+        peak = "n/a" if peak is None else f"{peak:.0f}"
+        mode = "streaming" if streaming else "materialized"
+        print(f"{mode:<14}{examples:>10}{seconds:>10.1f}{peak:>14}")
+
+
+def measure_loader_throughput(dataset, num_workers, batch_size=8, batches=50):
+    """
+    Samples per second delivered by a DataLoader over the dataset
+    """
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers
+    )
+
+    samples = 0
+    start = time.perf_counter()
+    for index, batch in enumerate(loader):
+        samples += len(batch["labels"])
+        if index + 1 == batches:
+            break
+
+    return samples / (time.perf_counter() - start)
+
+
+def report_augmentation_throughput(
+    data_dir, manifest=None, noise_dir=None, num_workers=0, clip_archive=None
+):
+    """
+    Compare loader throughput with and without on-the-fly augmentation
+    """
+    feature_extractor = setup_feature_extractor()
+
+    print(f"\n{'augmentation':<14}{'workers':>8}{'samples/sec':>14}")
+    for augment in (False, True):
+        train_dataset, _ = prepare_local_datasets(
+            data_dir,
+            feature_extractor,
+            manifest,
+            augment=augment,
+            noise_dir=noise_dir,
+            clip_archive=clip_archive,
+        )
+        rate = measure_loader_throughput(train_dataset, num_workers)
+        print(f"{'on' if augment else 'off':<14}{num_workers:>8}{rate:>14.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the bark classifier")
+    parser.add_argument(
+        "--data-dir",
+        help="Local directory of parquet/arrow shards or of audio label folders",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Read and preprocess shards lazily instead of materializing them",
+    )
+    parser.add_argument(
+        "--max-steps",
+        type=int,
+        default=3000,
+        help="Training steps when streaming (the stream has no length)",
+    )
+    parser.add_argument(
+        "--local-loader",
+        action="store_true",
+        help="Load WAV/FLAC files under --data-dir with on-the-fly augmentation",
+    )
+    parser.add_argument("--manifest", help="CSV with path,label columns")
+    parser.add_argument("--noise-dir", help="Background noise clips to mix in")
+    parser.add_argument(
+        "--clip-archive",
+        help="Manifest of the backend clip archive (export_clip_archive) to train on",
+    )
+    parser.add_argument(
+        "--no-augment", action="store_true", help="Disable augmentation"
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=0 if os.name == "nt" else min(4, os.cpu_count() or 1),
+        help="DataLoader worker processes for the local loader",
+    )
+    parser.add_argument(
+        "--measure-throughput",
+        action="store_true",
+        help="Only report local loader samples/sec with and without augmentation",
+    )
+    parser.add_argument(
+        "--measure-memory",
+        action="store_true",
+        help="Only report peak RSS of materialized and streaming ingestion",
+    )
+    return parser.parse_args()
+
+
 def main():
     """
     Main training pipeline
     """
+    args = parse_args()
+
+    if args.measure_memory:
+        report_ingestion_memory(args.data_dir)
+        return
+
+    if args.measure_throughput:
+        report_augmentation_throughput(
+            args.data_dir,
+            args.manifest,
+            args.noise_dir,
+            args.num_workers,
+            clip_archive=args.clip_archive,
+        )
+        return
+
     print("=== Audio Classification Model Training ===")
 
     # Step 1: Load and preprocess data
-    dataset = load_and_preprocess_audio_data()
+    if not args.local_loader:
+        dataset = load_and_preprocess_audio_data(
+            args.data_dir, streaming=args.streaming
+        )
 
     # Step 2: Setup feature extractor
     feature_extractor = setup_feature_extractor()
 
     # Step 3: Prepare datasets
-    train_dataset, eval_dataset = prepare_datasets(dataset, feature_extractor)
-    train_df = train_dataset.to_pandas()
-
-    print(train_df)
-    eval_df = eval_dataset.to_pandas()
-
-    print(eval_df)
+    if args.local_loader:
+        train_dataset, eval_dataset = prepare_local_datasets(
+            args.data_dir,
+            feature_extractor,
+            manifest=args.manifest,
+            augment=not args.no_augment,
+            noise_dir=args.noise_dir,
+            clip_archive=args.clip_archive,
+        )
+    elif args.streaming:
+        train_dataset, eval_dataset = prepare_streaming_datasets(
+            dataset, feature_extractor
+        )
+    else:
+        train_dataset, eval_dataset = prepare_datasets(dataset, feature_extractor)
+        train_df = train_dataset.to_pandas()
+
+        print(train_df)
+        eval_df = eval_dataset.to_pandas()
+
+        print(eval_df)
 
     # Step 4: Setup model
     model = setup_model()
 
     # Step 5: Setup training arguments
-    training_args = setup_training_args()
+    training_args = setup_training_args(
+        max_steps=args.max_steps if args.streaming else -1,
+        num_workers=args.num_workers if args.local_loader else 0,
+    )
 
     # Step 6: Train the model
     trainer = train_model(model, train_dataset, eval_dataset, training_args)
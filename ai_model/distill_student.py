@@ -0,0 +1,261 @@
+"""
+Distilling the bark classifier into a small log-mel CNN
+
+This script builds on audio_training_guide.py. The trained wav2vec2 model in
+./final_bark_model acts as the teacher: its temperature-softened predictions
+on the training set are the targets for a ~60k parameter CNN student, mixed
+with the hard labels.
+
+Key Steps:
+1. Data Loading and Preprocessing (same as the training guide)
+2. Teacher Soft Labels
+3. Student Training with a distillation loss
+4. Side-by-side evaluation: accuracy and CPU latency of both models
+5. TorchScript export for serving
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import AutoModelForAudioClassification
+
+from audio_training_guide import (
+    load_and_preprocess_audio_data,
+    prepare_datasets,
+    setup_feature_extractor,
+)
+from student_model import BarkStudentCNN, count_parameters
+
+torch.manual_seed(42)
+
+
+def to_arrays(dataset, max_length=16000):
+    """
+    Step 1: Stack a preprocessed dataset into (input_values, labels) arrays
+
+    Batches are padded to their own longest clip during preprocessing, so
+    every row is brought to the same length here.
+    """
+    inputs = np.zeros((len(dataset), max_length), dtype=np.float32)
+    for row, values in enumerate(dataset["input_values"]):
+        values = values[:max_length]
+        inputs[row, : len(values)] = values
+    labels = np.asarray(dataset["labels"], dtype=np.int64)
+    return inputs, labels
+
+
+def compute_teacher_logits(teacher, inputs, batch_size=16):
+    """
+    Step 2: Run the teacher once over the training set
+    """
+    print("Computing teacher soft labels...")
+
+    logits = []
+    with torch.no_grad():
+        for start in range(0, len(inputs), batch_size):
+            batch = torch.from_numpy(inputs[start : start + batch_size])
+            logits.append(teacher(input_values=batch).logits.numpy())
+
+    return np.concatenate(logits)
+
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature, alpha):
+    """
+    Soft-target KL divergence blended with the hard-label cross entropy
+    """
+    soft = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=-1),
+        F.softmax(teacher_logits / temperature, dim=-1),
+        reduction="batchmean",
+    ) * (temperature**2)
+    hard = F.cross_entropy(student_logits, labels)
+
+    return alpha * soft + (1 - alpha) * hard
+
+
+def train_student(
+    train_inputs,
+    train_labels,
+    teacher_logits,
+    epochs=20,
+    batch_size=64,
+    learning_rate=1e-3,
+    temperature=4.0,
+    alpha=0.7,
+):
+    """
+    Step 3: Train the student against the teacher's soft labels
+    """
+    print("Training student...")
+
+    student = BarkStudentCNN()
+    print(f"Student parameters: {count_parameters(student):,}")
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate, weight_decay=0.01)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+    inputs = torch.from_numpy(train_inputs)
+    labels = torch.from_numpy(train_labels)
+    targets = torch.from_numpy(teacher_logits)
+
+    for epoch in range(epochs):
+        student.train()
+        order = torch.randperm(len(inputs))
+        total_loss = 0.0
+        for start in range(0, len(order), batch_size):
+            index = order[start : start + batch_size]
+            loss = distillation_loss(
+                student(inputs[index]), targets[index], labels[index], temperature, alpha
+            )
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(index)
+        scheduler.step()
+        print(f"Epoch {epoch + 1}/{epochs}: loss {total_loss / len(order):.4f}")
+
+    student.eval()
+    return student
+
+
+def evaluate(predict, inputs, labels, batch_size=32, latency_clips=100):
+    """
+    Step 4: Accuracy on the evaluation set and single-clip CPU latency
+    """
+    predictions = []
+    with torch.no_grad():
+        for start in range(0, len(inputs), batch_size):
+            logits = predict(torch.from_numpy(inputs[start : start + batch_size]))
+            predictions.append(logits.argmax(dim=-1).numpy())
+    accuracy = float((np.concatenate(predictions) == labels).mean())
+
+    timings = []
+    with torch.no_grad():
+        for clip in inputs[:latency_clips]:
+            clip = torch.from_numpy(clip).unsqueeze(0)
+            start = time.perf_counter()
+            predict(clip)
+            timings.append(time.perf_counter() - start)
+
+    return {
+        "accuracy": accuracy,
+        "latency_p50_ms": 1000 * float(np.percentile(timings, 50)),
+        "latency_p95_ms": 1000 * float(np.percentile(timings, 95)),
+    }
+
+
+def evaluate_cascade(student, teacher, inputs, labels, low, high):
+    """
+    Accuracy of the student in front of the teacher, and how often it escalates
+    """
+    with torch.no_grad():
+        batch = torch.from_numpy(inputs)
+        bark = F.softmax(student(batch), dim=-1)[:, 1].numpy()
+    uncertain = (bark > low) & (bark < high)
+    predictions = (bark >= 0.5).astype(np.int64)
+
+    if uncertain.any():
+        teacher_logits = compute_teacher_logits(teacher, inputs[uncertain])
+        predictions[uncertain] = teacher_logits.argmax(axis=-1)
+
+    return {
+        "accuracy": float((predictions == labels).mean()),
+        "escalated": float(uncertain.mean()),
+    }
+
+
+def export_student(student, output_dir, config):
+    """
+    Step 5: Save the student as TorchScript together with its metadata
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    torch.jit.script(student).save(os.path.join(output_dir, "student.pt"))
+    with open(os.path.join(output_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Student saved to {output_dir}")
+
+
+def main():
+    """
+    Main distillation pipeline
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--teacher", default="./final_bark_model")
+    parser.add_argument("--output-dir", default="./final_student_model")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.7)
+    parser.add_argument("--cascade-low", type=float, default=0.1)
+    parser.add_argument("--cascade-high", type=float, default=0.9)
+    args = parser.parse_args()
+
+    print("=== Student Model Distillation ===")
+
+    # Step 1: Load and preprocess data exactly like the teacher's training
+    dataset = load_and_preprocess_audio_data()
+    feature_extractor = setup_feature_extractor()
+    train_dataset, eval_dataset = prepare_datasets(dataset, feature_extractor)
+    train_inputs, train_labels = to_arrays(train_dataset)
+    eval_inputs, eval_labels = to_arrays(eval_dataset)
+
+    # Step 2: Teacher soft labels
+    teacher = AutoModelForAudioClassification.from_pretrained(args.teacher)
+    teacher.eval()
+    teacher_logits = compute_teacher_logits(teacher, train_inputs)
+
+    # Step 3: Train the student
+    student = train_student(
+        train_inputs,
+        train_labels,
+        teacher_logits,
+        epochs=args.epochs,
+        temperature=args.temperature,
+        alpha=args.alpha,
+    )
+
+    # Step 4: Compare both models on the evaluation set
+    teacher_metrics = evaluate(
+        lambda batch: teacher(input_values=batch).logits, eval_inputs, eval_labels
+    )
+    student_metrics = evaluate(student, eval_inputs, eval_labels)
+    cascade_metrics = evaluate_cascade(
+        student, teacher, eval_inputs, eval_labels, args.cascade_low, args.cascade_high
+    )
+
+    print(f"\n{'model':<10}{'params':>14}{'accuracy':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, model, metrics in [
+        ("teacher", teacher, teacher_metrics),
+        ("student", student, student_metrics),
+    ]:
+        print(
+            f"{name:<10}{count_parameters(model):>14,}{metrics['accuracy']:>10.3f}"
+            f"{metrics['latency_p50_ms']:>10.2f}{metrics['latency_p95_ms']:>10.2f}"
+        )
+    print(
+        f"cascade accuracy {cascade_metrics['accuracy']:.3f}, "
+        f"{100 * cascade_metrics['escalated']:.1f}% of clips escalated to the teacher"
+    )
+
+    # Step 5: Export for serving
+    export_student(
+        student,
+        args.output_dir,
+        {
+            "sampling_rate": 16000,
+            "temperature": args.temperature,
+            "alpha": args.alpha,
+            "teacher": teacher_metrics,
+            "student": student_metrics,
+            "cascade": dict(
+                cascade_metrics, low=args.cascade_low, high=args.cascade_high
+            ),
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Early-exit classifier heads on intermediate wav2vec2 layers
+
+A small head reads the mean-pooled output of some of the transformer layers
+of the fine-tuned bark classifier. At inference the encoder is run one layer
+at a time and a clip leaves as soon as the head after a layer is confident
+enough; only the remaining clips go on to the next layer, and clips that no
+head is sure about get the full model's answer.
+
+The heads are exported with TorchScript, so the backend can serve them without
+this module.
+"""
+
+from typing import List
+
+import torch
+from torch import nn
+
+
+class ExitHead(nn.Module):
+    """
+    Mean pooling over time followed by a one hidden layer MLP
+    """
+
+    def __init__(self, hidden_size, projection_size=256, num_labels=2):
+        super().__init__()
+        self.mlp = nn.Sequential(
+            nn.Linear(hidden_size, projection_size),
+            nn.ReLU(),
+            nn.Linear(projection_size, num_labels),
+        )
+
+    def forward(self, hidden_states):
+        return self.mlp(hidden_states.mean(dim=1))
+
+
+class EarlyExitHeads(nn.Module):
+    """
+    One ExitHead per exit layer, ``exit_layers`` are 1-based layer numbers
+    """
+
+    def __init__(self, exit_layers, hidden_size, projection_size=256, num_labels=2):
+        super().__init__()
+        self.exit_layers: List[int] = list(exit_layers)
+        self.heads = nn.ModuleList(
+            ExitHead(hidden_size, projection_size, num_labels) for _ in exit_layers
+        )
+
+    def forward(self, hidden_states, exit_index: int):
+        for index, head in enumerate(self.heads):
+            if index == exit_index:
+                return head(hidden_states)
+        raise ValueError("No head for this exit")
+
+
+def count_parameters(model):
+    return sum(parameter.numel() for parameter in model.parameters())
+
+
+def embed(model, input_values):
+    """
+    Hidden states that enter the first transformer layer
+
+    Follows Wav2Vec2Model.forward for unpadded inputs in eval mode.
+    """
+    wav2vec2 = model.wav2vec2
+    encoder = wav2vec2.encoder
+
+    features = wav2vec2.feature_extractor(input_values).transpose(1, 2)
+    hidden_states, _ = wav2vec2.feature_projection(features)
+    hidden_states = hidden_states + encoder.pos_conv_embed(hidden_states)
+    if not model.config.do_stable_layer_norm:
+        hidden_states = encoder.layer_norm(hidden_states)
+    return hidden_states
+
+
+def run_layer(model, number, hidden_states):
+    """
+    Apply transformer layer ``number`` (1-based)
+    """
+    encoder = model.wav2vec2.encoder
+    outputs = encoder.layers[number - 1](hidden_states)
+    hidden_states = outputs[0] if isinstance(outputs, tuple) else outputs
+    if model.config.do_stable_layer_norm and number == len(encoder.layers):
+        hidden_states = encoder.layer_norm(hidden_states)
+    return hidden_states
+
+
+def encoder_layers(model, input_values):
+    """
+    Yield (layer number, hidden states) after every transformer layer
+    """
+    hidden_states = embed(model, input_values)
+    for number in range(1, len(model.wav2vec2.encoder.layers) + 1):
+        hidden_states = run_layer(model, number, hidden_states)
+        yield number, hidden_states
+
+
+def final_logits(model, hidden_states):
+    """
+    The fine-tuned model's own head on the last layer's output
+    """
+    return model.classifier(model.projector(hidden_states).mean(dim=1))
+
+
+def early_exit_logits(model, heads, input_values, threshold):
+    """
+    Classify a batch, every clip leaving at the first confident exit
+
+    Only the clips that did not leave go through the next layers. Returns
+    (logits, exit layer of every clip).
+    """
+    batch_size = input_values.shape[0]
+    num_layers = len(model.wav2vec2.encoder.layers)
+    exit_indexes = {layer: index for index, layer in enumerate(heads.exit_layers)}
+
+    logits = torch.zeros(batch_size, model.config.num_labels)
+    exits = torch.full((batch_size,), num_layers, dtype=torch.long)
+    remaining = torch.arange(batch_size)
+
+    hidden_states = embed(model, input_values)
+    for number in range(1, num_layers + 1):
+        hidden_states = run_layer(model, number, hidden_states)
+        if number == num_layers:
+            logits[remaining] = final_logits(model, hidden_states)
+            break
+        if number not in exit_indexes:
+            continue
+
+        head_logits = heads(hidden_states, exit_indexes[number])
+        confidence = torch.softmax(head_logits, dim=-1).max(dim=-1).values
+        confident = confidence >= threshold
+        logits[remaining[confident]] = head_logits[confident]
+        exits[remaining[confident]] = number
+        remaining = remaining[~confident]
+        hidden_states = hidden_states[~confident]
+        if len(remaining) == 0:
+            break
+
+    return logits, exits
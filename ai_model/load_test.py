@@ -0,0 +1,349 @@
+"""
+Load test for the analyze endpoints
+
+Sends a corpus of audio clips to a locally started backend and reports
+throughput, error rate and latency percentiles with a latency histogram for
+every endpoint.
+
+Targets:
+- django: main/ai/analyze/ (authenticated through main/token/)
+- django-async: main/ai/analyze/async/
+- flask: /read-file of ai_endpoint.py
+
+Modes:
+- closed: a fixed number of clients, each sends its next request as soon
+  as the previous one is answered (--concurrency)
+- open: requests arrive at a fixed average rate whether or not earlier ones
+  were answered (--rate). Latency is measured from the scheduled arrival, so
+  time spent waiting for a free client counts, as it would for a real user.
+
+Example:
+    python load_test.py --target django flask --mode open --rate 20 \\
+        --corpus ./clips --username test --password test
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg", ".opus", ".webm")
+
+TARGET_PATHS = {
+    "django": "main/ai/analyze/",
+    "django-async": "main/ai/analyze/async/",
+    "flask": "read-file",
+}
+
+# Answers that mean the server shed the request instead of failing it
+SHED_STATUSES = (429, 503)
+
+# Histogram bucket edges in milliseconds
+HISTOGRAM_EDGES_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def load_corpus(paths):
+    """
+    Read every clip into memory so disk reads do not show up in the latencies
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(
+                    os.path.join(root, name)
+                    for name in sorted(names)
+                    if name.lower().endswith(AUDIO_EXTENSIONS)
+                )
+        else:
+            files.append(path)
+
+    corpus = []
+    for file in files:
+        with open(file, "rb") as f:
+            corpus.append((os.path.basename(file), f.read()))
+
+    if not corpus:
+        raise SystemExit("No audio clips found in the corpus")
+
+    print(f"Loaded {len(corpus)} clips ({sum(len(data) for _, data in corpus) / 2**20:.1f} MB)")
+    return corpus
+
+
+class TokenProvider:
+    """
+    Access token from main/token/, fetched again when the server rejects it
+    """
+
+    def __init__(self, base_url, username, password):
+        self.url = base_url.rstrip("/") + "/main/token/"
+        self.username = username
+        self.password = password
+        self._token = None
+        self._lock = threading.Lock()
+
+    def get(self, refresh=False):
+        with self._lock:
+            if self._token is None or refresh:
+                response = requests.post(
+                    self.url,
+                    data={"username": self.username, "password": self.password},
+                    timeout=10,
+                )
+                response.raise_for_status()
+                self._token = response.json()["access"]
+            return self._token
+
+
+class Target:
+    """
+    One endpoint under test
+    """
+
+    def __init__(self, name, url, tokens=None):
+        self.name = name
+        self.url = url
+        self.tokens = tokens
+        self._sessions = threading.local()
+
+    def session(self):
+        # requests.Session is not thread-safe, keep one per client thread
+        if not hasattr(self._sessions, "session"):
+            self._sessions.session = requests.Session()
+        return self._sessions.session
+
+    def send(self, clip, timeout):
+        """
+        Post one clip and return the status code (None on a transport error)
+        """
+        name, data = clip
+        for attempt in range(2):
+            headers = {}
+            if self.tokens is not None:
+                headers["Authorization"] = f"Bearer {self.tokens.get(refresh=attempt > 0)}"
+            try:
+                response = self.session().post(
+                    self.url, files={"file": (name, data)}, headers=headers, timeout=timeout
+                )
+            except requests.RequestException:
+                return None
+            # Expired token, authenticate again once
+            if response.status_code != 401 or self.tokens is None:
+                break
+
+        return response.status_code
+
+
+class Recorder:
+    """
+    Thread-safe collection of (target, status, latency) samples
+    """
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def record(self, target, status, latency):
+        with self._lock:
+            self.samples.append((target, status, latency))
+
+
+def run_closed_loop(targets, corpus, concurrency, duration, timeout, recorder):
+    """
+    Each client sends its next request as soon as the previous one returns
+    """
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        rng = random.Random(index)
+        while time.perf_counter() < deadline:
+            target = targets[rng.randrange(len(targets))]
+            start = time.perf_counter()
+            status = target.send(corpus[rng.randrange(len(corpus))], timeout)
+            recorder.record(target.name, status, time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open_loop(targets, corpus, rate, duration, timeout, max_in_flight, recorder):
+    """
+    Requests arrive as a Poisson process at ``rate`` per second
+    """
+    rng = random.Random(0)
+
+    def request(target, clip, scheduled):
+        status = target.send(clip, timeout)
+        # Measured from the arrival, including any wait for a free client
+        recorder.record(target.name, status, time.perf_counter() - scheduled)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        start = time.perf_counter()
+        arrival = start
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival - start >= duration:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            target = targets[rng.randrange(len(targets))]
+            clip = corpus[rng.randrange(len(corpus))]
+            executor.submit(request, target, clip, arrival)
+
+
+def histogram_counts(latencies_ms):
+    return np.histogram(latencies_ms, bins=[0] + HISTOGRAM_EDGES_MS + [np.inf])[0]
+
+
+def histogram(latencies_ms):
+    """
+    Text histogram of latencies over fixed buckets
+    """
+    edges = HISTOGRAM_EDGES_MS + [np.inf]
+    counts = histogram_counts(latencies_ms)
+    widest = max(counts.max(), 1)
+
+    lines = []
+    lower = 0
+    for edge, count in zip(edges, counts):
+        label = f"{lower:g}-{edge:g}ms" if np.isfinite(edge) else f">{lower:g}ms"
+        bar = "#" * int(round(40 * count / widest))
+        lines.append(f"  {label:>14} {count:>7} {bar}")
+        lower = edge
+    return "\n".join(lines)
+
+
+def summarize(recorder, duration):
+    """
+    Per-target throughput, error rate and latency percentiles
+    """
+    summary = {}
+    for name in sorted({target for target, _, _ in recorder.samples}):
+        samples = [(status, latency) for target, status, latency in recorder.samples if target == name]
+        statuses = [status for status, _ in samples]
+        latencies_ms = 1000 * np.asarray([latency for _, latency in samples])
+        ok = sum(1 for status in statuses if status is not None and 200 <= status < 300)
+        shed = sum(1 for status in statuses if status in SHED_STATUSES)
+        errors = len(statuses) - ok - shed
+
+        summary[name] = {
+            "requests": len(samples),
+            "throughput_rps": ok / duration,
+            "error_rate": errors / len(samples),
+            "shed_rate": shed / len(samples),
+            "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+            "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+            "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+            "latency_max_ms": float(latencies_ms.max()),
+            "histogram_ms": dict(
+                zip(
+                    [str(edge) for edge in HISTOGRAM_EDGES_MS] + ["inf"],
+                    histogram_counts(latencies_ms).tolist(),
+                )
+            ),
+        }
+
+        print(f"\n{name}")
+        print(
+            f"  requests {len(samples)}, {ok / duration:.1f} ok/s, "
+            f"errors {100 * errors / len(samples):.1f}%, shed {100 * shed / len(samples):.1f}%"
+        )
+        print(
+            f"  p50 {summary[name]['latency_p50_ms']:.0f}ms  "
+            f"p95 {summary[name]['latency_p95_ms']:.0f}ms  "
+            f"p99 {summary[name]['latency_p99_ms']:.0f}ms  "
+            f"max {summary[name]['latency_max_ms']:.0f}ms"
+        )
+        print(histogram(latencies_ms))
+
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the analyze endpoints")
+    parser.add_argument(
+        "--target",
+        nargs="+",
+        choices=sorted(TARGET_PATHS),
+        default=["django"],
+        help="Endpoints to drive, requests are spread evenly between them",
+    )
+    parser.add_argument("--django-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--flask-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--username", default=os.environ.get("BARK_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("BARK_PASSWORD"))
+    parser.add_argument(
+        "--corpus",
+        nargs="+",
+        default=["20221106_210143.wav"],
+        help="Audio files or directories of clips to send",
+    )
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients in closed-loop mode")
+    parser.add_argument("--rate", type=float, default=10.0, help="Requests/sec in open-loop mode")
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=256,
+        help="Concurrent connections available to the open-loop generator",
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="Also write the summary to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    corpus = load_corpus(args.corpus)
+
+    tokens = None
+    if any(name.startswith("django") for name in args.target):
+        if not args.username or not args.password:
+            raise SystemExit("--username and --password are needed for the Django endpoints")
+        tokens = TokenProvider(args.django_url, args.username, args.password)
+        tokens.get()
+
+    targets = []
+    for name in args.target:
+        if name == "flask":
+            targets.append(Target(name, f"{args.flask_url.rstrip('/')}/{TARGET_PATHS[name]}"))
+        else:
+            targets.append(
+                Target(name, f"{args.django_url.rstrip('/')}/{TARGET_PATHS[name]}", tokens)
+            )
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    if args.mode == "closed":
+        print(f"Closed loop: {args.concurrency} clients for {args.duration:.0f}s")
+        run_closed_loop(targets, corpus, args.concurrency, args.duration, args.timeout, recorder)
+    else:
+        print(f"Open loop: {args.rate:.1f} req/s for {args.duration:.0f}s")
+        run_open_loop(
+            targets, corpus, args.rate, args.duration, args.timeout, args.max_in_flight, recorder
+        )
+    # Includes the time the last requests took to drain
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(recorder, elapsed)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {"mode": args.mode, "duration": elapsed, "targets": summary}, f, indent=2
+            )
+
+
+if __name__ == "__main__":
+    main()
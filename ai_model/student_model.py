@@ -0,0 +1,76 @@
+"""
+Small log-mel CNN used as a distilled student of the wav2vec2 bark classifier
+
+The model takes the same normalized 16 kHz input_values as the teacher and
+computes its log-mel spectrogram internally, so it can be exported with
+TorchScript and served without any extra preprocessing code.
+"""
+
+import librosa
+import torch
+from torch import nn
+
+
+class LogMelFrontend(nn.Module):
+    """
+    Waveform -> log-mel spectrogram
+    """
+
+    def __init__(self, sample_rate=16000, n_fft=400, hop_length=160, n_mels=64):
+        super().__init__()
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.register_buffer("window", torch.hann_window(n_fft))
+        mel_basis = librosa.filters.mel(sr=sample_rate, n_fft=n_fft, n_mels=n_mels)
+        self.register_buffer("mel_basis", torch.from_numpy(mel_basis).float())
+
+    def forward(self, waveform):
+        spectrum = torch.stft(
+            waveform,
+            n_fft=self.n_fft,
+            hop_length=self.hop_length,
+            window=self.window,
+            center=True,
+            return_complex=True,
+        )
+        power = spectrum.real.pow(2) + spectrum.imag.pow(2)
+        mel = torch.matmul(self.mel_basis, power)
+        return torch.log(mel + 1e-6)
+
+
+def conv_block(in_channels, out_channels):
+    return nn.Sequential(
+        nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1, bias=False),
+        nn.BatchNorm2d(out_channels),
+        nn.ReLU(inplace=True),
+        nn.MaxPool2d(2),
+    )
+
+
+class BarkStudentCNN(nn.Module):
+    """
+    Four conv blocks over the log-mel spectrogram, global pooling, linear head
+    """
+
+    def __init__(self, n_mels=64, channels=(16, 32, 64, 64), num_labels=2):
+        super().__init__()
+        self.frontend = LogMelFrontend(n_mels=n_mels)
+        self.input_norm = nn.BatchNorm2d(1)
+
+        blocks = []
+        in_channels = 1
+        for out_channels in channels:
+            blocks.append(conv_block(in_channels, out_channels))
+            in_channels = out_channels
+        self.features = nn.Sequential(*blocks)
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.classifier = nn.Linear(in_channels, num_labels)
+
+    def forward(self, input_values):
+        features = self.frontend(input_values).unsqueeze(1)
+        features = self.features(self.input_norm(features))
+        return self.classifier(self.pool(features).flatten(1))
+
+
+def count_parameters(model):
+    return sum(parameter.numel() for parameter in model.parameters())
@@ -0,0 +1,534 @@
+"""
+Parallel hyperparameter sweep for the bark classifier
+
+This script builds on audio_training_guide.py. Instead of editing
+setup_training_args() and rerunning the whole guide for every setting, the
+dataset is decoded and preprocessed once into an on-disk cache of .npy arrays
+and every trial trains on memory-mapped views of it, so concurrent trials
+share one copy in the page cache.
+
+Key Steps:
+1. Preprocessed-data cache, keyed by the data source and the size and
+   modification time of its files (reused if present)
+2. Trial grid over learning rate, warmup steps, epochs and batch size
+3. Trials run concurrently in a process pool sized to the available cores;
+   a trial stops when its accuracy stops improving (patience) or when it
+   falls clearly below the median of the other trials at the same evaluation
+4. Ranked results table (results.csv / results.json) with metrics, wall-clock
+   time and training throughput of every trial
+
+The cached training set is not augmented, trials compare hyperparameters on
+identical inputs.
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+from transformers import EarlyStoppingCallback, Trainer, TrainerCallback
+
+from audio_training_guide import (
+    index_clip_archive,
+    index_local_audio,
+    load_and_preprocess_audio_data,
+    prepare_datasets,
+    prepare_local_datasets,
+    setup_feature_extractor,
+    setup_model,
+    setup_training_args,
+)
+from distill_student import to_arrays
+
+CACHE_FILES = ("train_inputs", "train_labels", "eval_inputs", "eval_labels")
+
+# Keyword arguments of setup_training_args() that are swept
+TRIAL_PARAMETERS = ("learning_rate", "warmup_steps", "num_train_epochs", "batch_size")
+
+RESULT_FIELDS = (
+    "rank",
+    "trial",
+    "learning_rate",
+    "warmup_steps",
+    "num_train_epochs",
+    "batch_size",
+    "status",
+    "accuracy",
+    "f1",
+    "eval_loss",
+    "epochs_run",
+    "wall_seconds",
+    "train_samples_per_second",
+)
+
+
+def source_files(args):
+    """
+    Files the preprocessed data is read from
+    """
+    paths = set()
+    if args.data_dir is not None:
+        for directory, _, names in os.walk(args.data_dir):
+            paths.update(os.path.join(directory, name) for name in names)
+    if args.manifest is not None:
+        paths.add(args.manifest)
+        files, _ = index_local_audio(manifest=args.manifest)
+        paths.update(path for path, _ in files)
+    if args.clip_archive is not None:
+        paths.add(args.clip_archive)
+        clips = index_clip_archive(args.clip_archive)
+        paths.update(segment for _, (segment, _, _), _ in clips)
+    return sorted(os.path.abspath(path) for path in paths)
+
+
+def cache_key(args):
+    """
+    Identify the preprocessed data by where it came from and its files
+
+    Files are compared by size and modification time, so recordings that are
+    added, removed or rewritten under the same paths get a fresh cache.
+    """
+    files = []
+    for path in source_files(args):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append([path, stat.st_size, stat.st_mtime_ns])
+    source = {
+        "data_dir": args.data_dir,
+        "local_loader": args.local_loader,
+        "manifest": args.manifest,
+        "clip_archive": args.clip_archive,
+        "files": files,
+    }
+    return hashlib.sha1(json.dumps(source, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def stack_dataset(dataset, max_length=16000):
+    """
+    Stack a LocalAudioDataset into (input_values, labels) arrays
+    """
+    inputs = np.zeros((len(dataset), max_length), dtype=np.float32)
+    labels = np.zeros(len(dataset), dtype=np.int64)
+    for row in range(len(dataset)):
+        example = dataset[row]
+        values = example["input_values"][:max_length]
+        inputs[row, : len(values)] = values
+        labels[row] = example["labels"]
+    return inputs, labels
+
+
+def build_cache(args, cache_dir):
+    """
+    Step 1: Decode and preprocess the dataset once into cache_dir
+    """
+    if all(
+        os.path.exists(os.path.join(cache_dir, f"{name}.npy")) for name in CACHE_FILES
+    ):
+        print(f"Reusing preprocessed data in {cache_dir}")
+        return
+
+    print(f"Preprocessing data into {cache_dir}...")
+    start = time.perf_counter()
+    feature_extractor = setup_feature_extractor()
+    if args.local_loader or args.clip_archive:
+        train_dataset, eval_dataset = prepare_local_datasets(
+            args.data_dir if args.local_loader else None,
+            feature_extractor,
+            manifest=args.manifest,
+            augment=False,
+            clip_archive=args.clip_archive,
+        )
+        arrays = stack_dataset(train_dataset) + stack_dataset(eval_dataset)
+    else:
+        dataset = load_and_preprocess_audio_data(args.data_dir)
+        train_dataset, eval_dataset = prepare_datasets(dataset, feature_extractor)
+        arrays = to_arrays(train_dataset) + to_arrays(eval_dataset)
+
+    # Written under a temporary name, an interrupted build is never reused
+    partial = f"{cache_dir}.partial"
+    os.makedirs(partial, exist_ok=True)
+    for name, array in zip(CACHE_FILES, arrays):
+        np.save(os.path.join(partial, f"{name}.npy"), array)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(partial, cache_dir)
+    print(
+        f"Cached {len(arrays[1])} training and {len(arrays[3])} validation clips "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+class CachedDataset(torch.utils.data.Dataset):
+    """
+    Memory-mapped rows of the preprocessed-data cache
+    """
+
+    def __init__(self, cache_dir, split):
+        self.inputs = np.load(
+            os.path.join(cache_dir, f"{split}_inputs.npy"), mmap_mode="r"
+        )
+        self.labels = np.load(os.path.join(cache_dir, f"{split}_labels.npy"))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        return {
+            "input_values": torch.from_numpy(np.array(self.inputs[index])),
+            "labels": int(self.labels[index]),
+        }
+
+
+def compute_sweep_metrics(pred):
+    """
+    Accuracy and F1 of the bark class
+    """
+    preds = np.argmax(pred.predictions, axis=-1)
+    labels = pred.label_ids
+    true_positives = int(((preds == 1) & (labels == 1)).sum())
+    precision = true_positives / max(int((preds == 1).sum()), 1)
+    recall = true_positives / max(int((labels == 1).sum()), 1)
+    return {
+        "accuracy": float((preds == labels).mean()),
+        "f1": 2 * precision * recall / max(precision + recall, 1e-12),
+    }
+
+
+class MedianPruningCallback(TrainerCallback):
+    """
+    Stop a trial whose accuracy falls below the median of the other trials
+
+    Every trial appends its validation accuracy after each evaluation to a
+    progress file of its own; the n-th evaluation of a trial is compared with
+    the n-th evaluation of the trials that got that far.
+    """
+
+    def __init__(self, progress_dir, trial, min_evaluations=1, margin=0.0):
+        self.progress_dir = progress_dir
+        self.path = os.path.join(progress_dir, f"{trial}.json")
+        self.min_evaluations = min_evaluations
+        self.margin = margin
+        self.history = []
+        self.pruned = False
+
+    def others(self):
+        histories = []
+        for name in os.listdir(self.progress_dir):
+            path = os.path.join(self.progress_dir, name)
+            if not name.endswith(".json") or path == self.path:
+                continue
+            try:
+                with open(path) as f:
+                    histories.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return histories
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        if not metrics or "eval_accuracy" not in metrics:
+            return
+        self.history.append(metrics["eval_accuracy"])
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.history, f)
+        os.replace(temporary, self.path)
+
+        evaluation = len(self.history)
+        if evaluation < self.min_evaluations:
+            return
+        peers = [
+            history[evaluation - 1]
+            for history in self.others()
+            if len(history) >= evaluation
+        ]
+        if len(peers) >= 2 and self.history[-1] < np.median(peers) - self.margin:
+            self.pruned = True
+            control.should_training_stop = True
+
+
+def run_trial(
+    trial,
+    config,
+    cache_dir,
+    sweep_dir,
+    threads,
+    patience,
+    margin,
+    keep,
+    evals_per_epoch,
+):
+    """
+    Step 3: Train and evaluate one configuration, in a pool worker
+
+    A trial is evaluated evals_per_epoch times an epoch, so early stopping
+    and pruning can act within the few epochs a trial runs.
+    """
+    torch.set_num_threads(threads)
+    torch.manual_seed(42)
+    start = time.perf_counter()
+    output_dir = os.path.join(sweep_dir, "trials", trial)
+
+    row = dict(config, trial=trial)
+    try:
+        train_dataset = CachedDataset(cache_dir, "train")
+        eval_dataset = CachedDataset(cache_dir, "eval")
+
+        steps_per_epoch = math.ceil(len(train_dataset) / config["batch_size"])
+        training_args = setup_training_args(
+            output_dir=output_dir,
+            eval_steps=max(1, steps_per_epoch // evals_per_epoch),
+            **config,
+        )
+        pruning = MedianPruningCallback(
+            os.path.join(sweep_dir, "progress"), trial, margin=margin
+        )
+        trainer = Trainer(
+            model=setup_model(),
+            args=training_args,
+            train_dataset=train_dataset,
+            eval_dataset=eval_dataset,
+            compute_metrics=compute_sweep_metrics,
+            callbacks=[
+                EarlyStoppingCallback(early_stopping_patience=patience),
+                pruning,
+            ],
+        )
+        train_output = trainer.train()
+        # The final evaluation (of the best checkpoint) is not a training step
+        trainer.remove_callback(pruning)
+        metrics = trainer.evaluate()
+
+        row.update(
+            status="pruned" if pruning.pruned else "done",
+            accuracy=metrics["eval_accuracy"],
+            f1=metrics["eval_f1"],
+            eval_loss=metrics["eval_loss"],
+            epochs_run=trainer.state.epoch,
+            train_samples_per_second=train_output.metrics["train_samples_per_second"],
+        )
+    except Exception as e:
+        print(f"Trial {trial} failed: {e}")
+        row.update(status="failed")
+    finally:
+        if not keep:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    row["wall_seconds"] = time.perf_counter() - start
+    return row
+
+
+def trial_grid(args):
+    """
+    Step 2: Every combination of the swept values
+    """
+    configs = [
+        {
+            "learning_rate": learning_rate,
+            "warmup_steps": warmup_steps,
+            "num_train_epochs": epochs,
+            "batch_size": batch_size,
+        }
+        for learning_rate, warmup_steps, epochs, batch_size in itertools.product(
+            args.learning_rates, args.warmup_steps, args.epochs, args.batch_sizes
+        )
+    ]
+    if args.max_trials and len(configs) > args.max_trials:
+        rng = np.random.default_rng(42)
+        picked = rng.choice(len(configs), size=args.max_trials, replace=False)
+        configs = [configs[index] for index in sorted(picked)]
+    return configs
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on Windows and macOS
+        return os.cpu_count() or 1
+
+
+def rank_results(rows):
+    """
+    Step 4: Completed trials by accuracy and F1, then pruned, then failed
+    """
+    order = {"done": 0, "pruned": 1, "failed": 2}
+    rows = sorted(
+        rows,
+        key=lambda row: (
+            order[row["status"]],
+            -row.get("accuracy", 0.0),
+            -row.get("f1", 0.0),
+        ),
+    )
+    for rank, row in enumerate(rows, 1):
+        row["rank"] = rank
+    return rows
+
+
+def write_results(rows, sweep_dir):
+    with open(os.path.join(sweep_dir, "results.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, restval="")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: row.get(key, "") for key in RESULT_FIELDS})
+    with open(os.path.join(sweep_dir, "results.json"), "w") as f:
+        json.dump(rows, f, indent=2)
+
+
+def print_results(rows):
+    print(
+        f"\n{'rank':>4}  {'trial':<10}{'lr':>9}{'warmup':>8}{'epochs':>7}{'batch':>6}"
+        f"  {'status':<7}{'accuracy':>9}{'f1':>7}{'loss':>8}{'wall s':>8}"
+        f"{'samples/s':>11}"
+    )
+    for row in rows:
+        if row["status"] == "failed":
+            metrics = f"{'':>9}{'':>7}{'':>8}"
+            throughput = ""
+        else:
+            metrics = (
+                f"{row['accuracy']:>9.3f}{row['f1']:>7.3f}{row['eval_loss']:>8.4f}"
+            )
+            throughput = f"{row['train_samples_per_second']:.1f}"
+        print(
+            f"{row['rank']:>4}  {row['trial']:<10}{row['learning_rate']:>9.1e}"
+            f"{row['warmup_steps']:>8}{row['num_train_epochs']:>7}"
+            f"{row['batch_size']:>6}  {row['status']:<7}{metrics}"
+            f"{row['wall_seconds']:>8.1f}{throughput:>11}"
+        )
+
+
+def main():
+    """
+    Main sweep pipeline
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--data-dir",
+        help="Local directory of parquet/arrow shards or of audio label folders",
+    )
+    parser.add_argument(
+        "--local-loader",
+        action="store_true",
+        help="Read WAV/FLAC files under --data-dir (no augmentation in the cache)",
+    )
+    parser.add_argument("--manifest", help="CSV with path,label columns")
+    parser.add_argument(
+        "--clip-archive",
+        help="Manifest of the backend clip archive (export_clip_archive) to train on",
+    )
+    parser.add_argument("--cache-dir", default="./sweep_cache")
+    parser.add_argument("--output-dir", default="./sweep")
+    parser.add_argument(
+        "--learning-rates", type=float, nargs="+", default=[1e-5, 3e-5, 1e-4]
+    )
+    parser.add_argument("--warmup-steps", type=int, nargs="+", default=[0, 500])
+    parser.add_argument("--epochs", type=int, nargs="+", default=[3])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16])
+    parser.add_argument(
+        "--max-trials",
+        type=int,
+        help="Sample this many configurations of the grid instead of all",
+    )
+    parser.add_argument(
+        "--threads-per-trial",
+        type=int,
+        default=2,
+        help="Torch threads of every trial; the pool gets cores / threads workers",
+    )
+    parser.add_argument("--workers", type=int, help="Override the pool size")
+    parser.add_argument(
+        "--patience",
+        type=int,
+        default=2,
+        help="Evaluations without improvement before a trial stops",
+    )
+    parser.add_argument(
+        "--evals-per-epoch",
+        type=int,
+        default=4,
+        help="Evaluations (and checkpoints) of every trial per epoch",
+    )
+    parser.add_argument(
+        "--prune-margin",
+        type=float,
+        default=0.02,
+        help="Accuracy below the other trials' median at which a trial is stopped",
+    )
+    parser.add_argument(
+        "--keep-checkpoints",
+        action="store_true",
+        help="Keep every trial's checkpoints instead of deleting them",
+    )
+    args = parser.parse_args()
+
+    print("=== Hyperparameter Sweep ===")
+
+    # Step 1: Preprocess once
+    cache_dir = os.path.join(args.cache_dir, cache_key(args))
+    build_cache(args, cache_dir)
+
+    # Step 2: Trials
+    configs = trial_grid(args)
+    sweep_dir = os.path.join(args.output_dir, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.join(sweep_dir, "progress"), exist_ok=True)
+    workers = args.workers or max(1, available_cores() // args.threads_per_trial)
+    workers = min(workers, len(configs))
+    print(
+        f"Running {len(configs)} trials on {workers} workers with "
+        f"{args.threads_per_trial} threads each"
+    )
+
+    # Step 3: Run them concurrently
+    start = time.perf_counter()
+    rows = []
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(
+                run_trial,
+                f"trial_{index:03d}",
+                config,
+                cache_dir,
+                sweep_dir,
+                args.threads_per_trial,
+                args.patience,
+                args.prune_margin,
+                args.keep_checkpoints,
+                args.evals_per_epoch,
+            )
+            for index, config in enumerate(configs)
+        ]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            print(f"{row['trial']} {row['status']} after {row['wall_seconds']:.0f}s")
+
+    # Step 4: Ranked results
+    rows = rank_results(rows)
+    write_results(rows, sweep_dir)
+    print_results(rows)
+    print(
+        f"\n{len(rows)} trials in {time.perf_counter() - start:.0f}s, "
+        f"results in {sweep_dir}"
+    )
+    best = rows[0]
+    if best["status"] != "failed":
+        print(
+            "Best setup_training_args: "
+            + ", ".join(f"{key}={best[key]}" for key in TRIAL_PARAMETERS)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Tests of the sweep's trial grid, ranking and median pruning
+
+Run from this directory with: python -m unittest test_sweep_training
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from transformers import TrainerControl
+
+from sweep_training import MedianPruningCallback, rank_results, trial_grid
+
+
+def grid_args(max_trials=0):
+    return argparse.Namespace(
+        learning_rates=[1e-5, 3e-5],
+        warmup_steps=[0],
+        epochs=[2, 4],
+        batch_sizes=[8, 16],
+        max_trials=max_trials,
+    )
+
+
+class TrialGridTests(unittest.TestCase):
+    def test_every_combination(self):
+        configs = trial_grid(grid_args())
+        self.assertEqual(len(configs), 8)
+        self.assertEqual(
+            configs[0],
+            {
+                "learning_rate": 1e-5,
+                "warmup_steps": 0,
+                "num_train_epochs": 2,
+                "batch_size": 8,
+            },
+        )
+        self.assertEqual(
+            len({tuple(config.values()) for config in configs}), len(configs)
+        )
+
+    def test_max_trials_picks_a_stable_subset(self):
+        configs = trial_grid(grid_args())
+        picked = trial_grid(grid_args(max_trials=3))
+
+        self.assertEqual(len(picked), 3)
+        self.assertEqual(picked, trial_grid(grid_args(max_trials=3)))
+        # Picked configurations keep their order in the full grid
+        positions = [configs.index(config) for config in picked]
+        self.assertEqual(positions, sorted(set(positions)))
+
+    def test_max_trials_above_grid_size(self):
+        self.assertEqual(trial_grid(grid_args(max_trials=20)), trial_grid(grid_args()))
+
+
+class RankResultsTests(unittest.TestCase):
+    def test_order(self):
+        rows = [
+            {"trial": "failed", "status": "failed"},
+            {"trial": "pruned", "status": "pruned", "accuracy": 0.99, "f1": 0.99},
+            {"trial": "low", "status": "done", "accuracy": 0.8, "f1": 0.9},
+            {"trial": "best", "status": "done", "accuracy": 0.9, "f1": 0.7},
+            {"trial": "tie", "status": "done", "accuracy": 0.9, "f1": 0.8},
+        ]
+
+        ranked = rank_results(rows)
+        self.assertEqual(
+            [row["trial"] for row in ranked], ["tie", "best", "low", "pruned", "failed"]
+        )
+        self.assertEqual([row["rank"] for row in ranked], [1, 2, 3, 4, 5])
+
+
+class MedianPruningCallbackTests(unittest.TestCase):
+    def setUp(self):
+        self.progress_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.progress_dir, ignore_errors=True)
+
+    def write_history(self, trial, history):
+        with open(os.path.join(self.progress_dir, f"{trial}.json"), "w") as f:
+            json.dump(history, f)
+
+    def evaluate(self, callback, accuracies):
+        """
+        Report accuracies in turn, returning the control of the last evaluation
+        """
+        for accuracy in accuracies:
+            control = TrainerControl()
+            metrics = {"eval_accuracy": accuracy}
+            callback.on_evaluate(None, None, control, metrics=metrics)
+        return control
+
+    def test_trial_below_median_is_pruned(self):
+        self.write_history("a", [0.8, 0.9])
+        self.write_history("b", [0.7, 0.85])
+        self.write_history("c", [0.6, 0.8])
+        callback = MedianPruningCallback(self.progress_dir, "trial")
+
+        control = self.evaluate(callback, [0.75])
+        self.assertFalse(callback.pruned)
+        self.assertFalse(control.should_training_stop)
+
+        # The second evaluation is compared with the others' second
+        control = self.evaluate(callback, [0.84])
+        self.assertTrue(callback.pruned)
+        self.assertTrue(control.should_training_stop)
+        with open(callback.path) as f:
+            self.assertEqual(json.load(f), [0.75, 0.84])
+
+    def test_margin(self):
+        self.write_history("a", [0.8])
+        self.write_history("b", [0.9])
+        callback = MedianPruningCallback(self.progress_dir, "trial", margin=0.1)
+
+        self.evaluate(callback, [0.76])
+        self.assertFalse(callback.pruned)
+
+    def test_min_evaluations(self):
+        self.write_history("a", [0.9, 0.9, 0.9])
+        self.write_history("b", [0.9, 0.9, 0.9])
+        callback = MedianPruningCallback(self.progress_dir, "trial", min_evaluations=3)
+
+        self.evaluate(callback, [0.1, 0.1])
+        self.assertFalse(callback.pruned)
+        self.evaluate(callback, [0.1])
+        self.assertTrue(callback.pruned)
+
+    def test_needs_two_peers_that_got_as_far(self):
+        self.write_history("a", [0.9, 0.9])
+        self.write_history("short", [0.9])
+        with open(os.path.join(self.progress_dir, "broken.json"), "w") as f:
+            f.write("[0.9,")
+        callback = MedianPruningCallback(self.progress_dir, "trial")
+
+        self.evaluate(callback, [0.9, 0.1])
+        self.assertFalse(callback.pruned)
+
+    def test_evaluation_without_accuracy_is_ignored(self):
+        callback = MedianPruningCallback(self.progress_dir, "trial")
+
+        callback.on_evaluate(None, None, TrainerControl(), metrics={"eval_loss": 0.3})
+        self.assertEqual(callback.history, [])
+        self.assertFalse(os.path.exists(callback.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
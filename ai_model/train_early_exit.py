@@ -0,0 +1,295 @@
+"""
+Training early-exit heads for the bark classifier
+
+This script builds on audio_training_guide.py. The fine-tuned wav2vec2 model
+in ./final_bark_model is frozen and a small classifier head is trained on the
+output of some of its intermediate transformer layers. At serving time a clip
+stops at the first layer whose head is confident enough, so loud obvious barks
+and near-silence do not pay for all 12 layers.
+
+Key Steps:
+1. Data Loading and Preprocessing (same as the training guide)
+2. Pooled hidden states of the exit layers, computed once
+3. Head Training with the frozen backbone
+4. Held-out evaluation: exit-layer distribution, accuracy and CPU latency
+   for every confidence threshold, next to the full model
+5. TorchScript export for serving (AI_SERVING_BACKEND=early_exit)
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import AutoModelForAudioClassification
+
+from audio_training_guide import (
+    load_and_preprocess_audio_data,
+    prepare_datasets,
+    setup_feature_extractor,
+)
+from distill_student import to_arrays
+from early_exit import (
+    EarlyExitHeads,
+    count_parameters,
+    early_exit_logits,
+    encoder_layers,
+    final_logits,
+)
+
+torch.manual_seed(42)
+
+
+def pooled_hidden_states(model, inputs, exit_layers, batch_size=16):
+    """
+    Step 2: Mean-pooled output of every exit layer and the full model's logits
+
+    Returns ({layer: (clips, hidden_size) array}, final logits). The heads pool
+    over time before anything else, so they can be trained on these alone.
+    """
+    print("Computing pooled hidden states of the exit layers...")
+
+    pooled = {layer: [] for layer in exit_layers}
+    logits = []
+    with torch.no_grad():
+        for start in range(0, len(inputs), batch_size):
+            batch = torch.from_numpy(inputs[start : start + batch_size])
+            for number, hidden_states in encoder_layers(model, batch):
+                if number in pooled:
+                    pooled[number].append(hidden_states.mean(dim=1).numpy())
+            logits.append(final_logits(model, hidden_states).numpy())
+
+    return (
+        {layer: np.concatenate(states) for layer, states in pooled.items()},
+        np.concatenate(logits),
+    )
+
+
+def train_heads(
+    pooled, labels, hidden_size, epochs=30, batch_size=64, learning_rate=1e-3
+):
+    """
+    Step 3: Train one head per exit layer on the frozen backbone's features
+    """
+    print("Training early-exit heads...")
+
+    exit_layers = sorted(pooled)
+    heads = EarlyExitHeads(exit_layers, hidden_size)
+    print(f"Head parameters: {count_parameters(heads):,}")
+
+    labels = torch.from_numpy(labels)
+    for layer, head in zip(exit_layers, heads.heads):
+        features = torch.from_numpy(pooled[layer])
+        optimizer = torch.optim.AdamW(head.parameters(), lr=learning_rate, weight_decay=0.01)
+
+        head.train()
+        for epoch in range(epochs):
+            order = torch.randperm(len(features))
+            total_loss = 0.0
+            for start in range(0, len(order), batch_size):
+                index = order[start : start + batch_size]
+                loss = F.cross_entropy(head.mlp(features[index]), labels[index])
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                total_loss += loss.item() * len(index)
+        head.eval()
+        print(f"Layer {layer}: final loss {total_loss / len(order):.4f}")
+
+    heads.eval()
+    return heads
+
+
+def exit_predictions(heads, pooled, final, threshold):
+    """
+    Exit layer and prediction of every clip for a confidence threshold
+
+    Computed from the pooled states, the same decisions early_exit_logits
+    makes layer by layer.
+    """
+    clips = len(final)
+    predictions = final.argmax(axis=-1)
+    exits = np.full(clips, 0)
+    remaining = np.ones(clips, dtype=bool)
+
+    with torch.no_grad():
+        for index, layer in enumerate(heads.exit_layers):
+            probabilities = F.softmax(
+                heads.heads[index].mlp(torch.from_numpy(pooled[layer])), dim=-1
+            ).numpy()
+            leaving = remaining & (probabilities.max(axis=-1) >= threshold)
+            predictions[leaving] = probabilities[leaving].argmax(axis=-1)
+            exits[leaving] = layer
+            remaining &= ~leaving
+
+    return predictions, exits, remaining
+
+
+def evaluate_thresholds(
+    model, heads, inputs, labels, pooled, final, thresholds, latency_clips=100
+):
+    """
+    Step 4: Accuracy, exit-layer distribution and single-clip CPU latency
+
+    Returns one row per threshold; threshold None is the full model.
+    """
+    num_layers = len(model.wav2vec2.encoder.layers)
+
+    def latency(predict):
+        timings = []
+        with torch.no_grad():
+            for clip in inputs[:latency_clips]:
+                clip = torch.from_numpy(clip).unsqueeze(0)
+                start = time.perf_counter()
+                predict(clip)
+                timings.append(time.perf_counter() - start)
+        return 1000 * float(np.mean(timings)), 1000 * float(np.percentile(timings, 95))
+
+    mean_ms, p95_ms = latency(lambda clip: model(input_values=clip).logits)
+    rows = [
+        {
+            "threshold": None,
+            "accuracy": float((final.argmax(axis=-1) == labels).mean()),
+            "mean_layers": float(num_layers),
+            "exits": {str(num_layers): len(labels)},
+            "latency_mean_ms": mean_ms,
+            "latency_p95_ms": p95_ms,
+        }
+    ]
+
+    for threshold in thresholds:
+        predictions, exits, remaining = exit_predictions(heads, pooled, final, threshold)
+        exits[remaining] = num_layers
+        layers, counts = np.unique(exits, return_counts=True)
+        mean_ms, p95_ms = latency(
+            lambda clip: early_exit_logits(model, heads, clip, threshold)
+        )
+        rows.append(
+            {
+                "threshold": threshold,
+                "accuracy": float((predictions == labels).mean()),
+                "mean_layers": float(exits.mean()),
+                "exits": {str(layer): int(count) for layer, count in zip(layers, counts)},
+                "latency_mean_ms": mean_ms,
+                "latency_p95_ms": p95_ms,
+            }
+        )
+
+    return rows
+
+
+def choose_threshold(rows, max_accuracy_drop):
+    """
+    Lowest threshold whose accuracy stays within max_accuracy_drop of the
+    full model
+    """
+    full_accuracy = rows[0]["accuracy"]
+    for row in sorted(rows[1:], key=lambda row: row["threshold"]):
+        if row["accuracy"] >= full_accuracy - max_accuracy_drop:
+            return row["threshold"]
+    return None
+
+
+def export_heads(heads, output_dir, config):
+    """
+    Step 5: Save the heads as TorchScript together with the evaluation
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    torch.jit.script(heads).save(os.path.join(output_dir, "early_exit_heads.pt"))
+    with open(os.path.join(output_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Early-exit heads saved to {output_dir}")
+
+
+def main():
+    """
+    Main early-exit training pipeline
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--model", default="./final_bark_model")
+    parser.add_argument("--output-dir", default="./final_early_exit")
+    parser.add_argument(
+        "--exit-layers", type=int, nargs="+", default=[2, 4, 6, 8, 10]
+    )
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument(
+        "--thresholds",
+        type=float,
+        nargs="+",
+        default=[0.8, 0.9, 0.95, 0.98, 0.99],
+    )
+    parser.add_argument(
+        "--max-accuracy-drop",
+        type=float,
+        default=0.005,
+        help="Accuracy the recommended threshold may lose against the full model",
+    )
+    args = parser.parse_args()
+
+    print("=== Early-Exit Head Training ===")
+
+    # Step 1: Load and preprocess data exactly like the model's training
+    dataset = load_and_preprocess_audio_data()
+    feature_extractor = setup_feature_extractor()
+    train_dataset, eval_dataset = prepare_datasets(dataset, feature_extractor)
+    train_inputs, train_labels = to_arrays(train_dataset)
+    eval_inputs, eval_labels = to_arrays(eval_dataset)
+
+    model = AutoModelForAudioClassification.from_pretrained(args.model)
+    model.eval()
+    if model.config.use_weighted_layer_sum:
+        raise SystemExit("Early exit needs a model that classifies its last layer")
+    num_layers = len(model.wav2vec2.encoder.layers)
+    exit_layers = sorted(layer for layer in set(args.exit_layers) if 0 < layer < num_layers)
+
+    # Step 2: Features of the frozen backbone
+    train_pooled, _ = pooled_hidden_states(model, train_inputs, exit_layers)
+    eval_pooled, eval_final = pooled_hidden_states(model, eval_inputs, exit_layers)
+
+    # Step 3: Train the heads
+    heads = train_heads(
+        train_pooled, train_labels, model.config.hidden_size, epochs=args.epochs
+    )
+
+    # Step 4: Accuracy/latency trade-off on the evaluation set
+    rows = evaluate_thresholds(
+        model, heads, eval_inputs, eval_labels, eval_pooled, eval_final, args.thresholds
+    )
+
+    exit_columns = exit_layers + [num_layers]
+    print(
+        f"\n{'threshold':>10}{'accuracy':>10}{'layers':>8}{'mean ms':>9}{'p95 ms':>8}  "
+        + "".join(f"{f'L{layer}':>6}" for layer in exit_columns)
+    )
+    for row in rows:
+        threshold = "full" if row["threshold"] is None else f"{row['threshold']:.2f}"
+        shares = [
+            row["exits"].get(str(layer), 0) / len(eval_labels) for layer in exit_columns
+        ]
+        print(
+            f"{threshold:>10}{row['accuracy']:>10.3f}{row['mean_layers']:>8.1f}"
+            f"{row['latency_mean_ms']:>9.1f}{row['latency_p95_ms']:>8.1f}  "
+            + "".join(f"{100 * share:>5.0f}%" for share in shares)
+        )
+
+    threshold = choose_threshold(rows, args.max_accuracy_drop)
+    print(f"\nRecommended AI_EARLY_EXIT_THRESHOLD: {threshold}")
+
+    # Step 5: Export for serving
+    export_heads(
+        heads,
+        args.output_dir,
+        {
+            "model": args.model,
+            "exit_layers": exit_layers,
+            "recommended_threshold": threshold,
+            "evaluation": rows,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+import socket
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,6 +40,9 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
+# Seconds an authenticated user is served from the local cache on the
+# analysis endpoints before it is looked up in the database again
+AUTH_USER_CACHE_TTL = 30
 
 # Application definition
 
@@ -104,6 +110,15 @@ DATABASES = {
     }
 }
 
+# Local stand-in database, e.g. for tests: BARK_APP_DATABASE=sqlite
+if os.environ.get("BARK_APP_DATABASE") == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -146,6 +161,102 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 # AI Model files
 AI_MODEL_ROOT = os.path.join(BASE_DIR.parent, "model")
 
+# Audio upload limits, enforced while the upload is being decoded
+AUDIO_UPLOAD_MAX_BYTES = 50 * 1024 * 1024
+AUDIO_MAX_DURATION_SECONDS = 10 * 60
+
+# Limits for recordings uploaded to /ai/segment/. A recording is decoded in full
+# to 16 kHz float32 before it is segmented, about 230 MB per hour, so the
+# duration limit also bounds the memory of one upload: about 690 MB for three
+# hours, briefly up to half as much again while the buffer of a format that
+# does not declare its length grows. 400 MB hold three hours of 16 kHz 16-bit
+# mono WAV.
+AUDIO_SEGMENT_MAX_BYTES = 400 * 1024 * 1024
+AUDIO_SEGMENT_MAX_DURATION_SECONDS = 3 * 60 * 60
+
+# Write-behind detection event log: flush after this many events or seconds
+EVENT_LOG_BATCH_SIZE = 100
+EVENT_LOG_FLUSH_INTERVAL = 2.0
+EVENT_LOG_MAX_BUFFER = 10000
+
+# Worker threads that run clip inference for both analyze views, every request
+# admitted through the admission controller configured below
+AI_INFERENCE_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+# Admission control: requests beyond these limits are answered with 429/503
+# and a Retry-After hint instead of being queued
+AI_MAX_QUEUED_REQUESTS = 16
+AI_MAX_CONCURRENT_PER_USER = 4
+AI_MAX_ESTIMATED_WAIT = 5.0
+
+# Admission control of recording segmentation, which runs on its own workers
+# and keeps its own service time estimate (seconds per recording)
+AI_SEGMENT_WORKERS = 1
+AI_SEGMENT_MAX_QUEUED_REQUESTS = 4
+AI_SEGMENT_MAX_CONCURRENT_PER_USER = 1
+AI_SEGMENT_MAX_ESTIMATED_WAIT = 60.0
+AI_SEGMENT_INITIAL_SERVICE_TIME = 5.0
+
+# Clips quieter than this (dBFS) are answered as no_bark without inference
+AI_SILENCE_GATE_DBFS = -50.0
+AI_RESULT_CACHE_SIZE = 1024
+
+# Distilled CNN exported by ai_model/distill_student.py
+AI_STUDENT_MODEL_PATH = os.path.join(BASE_DIR.parent, "student_model", "student.pt")
+
+# Intermediate-layer heads exported by ai_model/train_early_exit.py
+AI_EARLY_EXIT_HEADS_PATH = os.path.join(
+    BASE_DIR.parent, "early_exit", "early_exit_heads.pt"
+)
+
+# "teacher" (wav2vec2), "student" (distilled CNN), "cascade" (student first,
+# clips with a bark probability inside the band go to the teacher) or
+# "early_exit" (wav2vec2 stops at the first head this confident, see the
+# recommended threshold in the heads' config.json)
+AI_SERVING_BACKEND = os.environ.get("AI_SERVING_BACKEND", "teacher")
+AI_CASCADE_UNCERTAIN_BAND = (0.1, 0.9)
+AI_EARLY_EXIT_THRESHOLD = 0.95
+
+# Per-user float16 embedding index of detected barks, for similar-bark search
+# and clustering. A bark at least this similar to a cluster's first bark joins
+# that cluster; one at least AI_EMBEDDING_DUPLICATE_THRESHOLD similar to a
+# stored bark of the cluster is treated as the same clip and not stored again.
+AI_EMBEDDING_INDEX_DIR = os.path.join(BASE_DIR, "embedding_index")
+AI_EMBEDDING_CLUSTER_THRESHOLD = 0.85
+AI_EMBEDDING_DUPLICATE_THRESHOLD = 0.995
+
+# Analyze requests profiled on demand by staff (X-Profile: 1 or ?profile=1)
+AI_PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+AI_PROFILE_MAX_STORED = 200
+AI_PROFILE_TOP_FUNCTIONS = 25
+
+# Optional archive of clips classified as barks or with a bark probability
+# inside the band, for replay, relabeling and retraining. Clips are stored once
+# per content hash, compressed ("flac" or "opus"), in append-only segments.
+# Opus clips are about 6x smaller than FLAC but take about 60x longer to
+# encode (see the benchmark_clip_archive command).
+AI_CLIP_ARCHIVE_ENABLED = os.environ.get("AI_CLIP_ARCHIVE_ENABLED", "0") == "1"
+AI_CLIP_ARCHIVE_DIR = os.path.join(BASE_DIR, "clip_archive")
+AI_CLIP_ARCHIVE_FORMAT = "flac"
+AI_CLIP_ARCHIVE_SEGMENT_BYTES = 256 * 1024 * 1024
+AI_CLIP_ARCHIVE_UNCERTAIN_BAND = (0.3, 0.7)
+
+# Clips of one user (and X-Device-ID) arriving within this many seconds of the
+# first are merged, overlapping audio dropped, and scored once; 0 disables
+# coalescing. A clip that would take a group's merged audio past
+# AI_COALESCE_MAX_SECONDS opens a new group (all windows of a group are scored
+# in one batch). Every clip waits up to the window before it is scored.
+AI_COALESCE_WINDOW = float(os.environ.get("AI_COALESCE_WINDOW", "0"))
+AI_COALESCE_MAX_SECONDS = 10.0
+
+# Per-user copies of the classifier's final layer, fine-tuned on each user's
+# labeled clips by the train_user_heads command and applied to the user's
+# requests on top of the shared backbone (teacher and cascade backends). Loaded
+# heads are kept in an LRU cache of at most AI_USER_HEAD_CACHE_BYTES.
+AI_USER_HEADS_ENABLED = os.environ.get("AI_USER_HEADS_ENABLED", "0") == "1"
+AI_USER_HEAD_DIR = os.path.join(BASE_DIR, "user_heads")
+AI_USER_HEAD_CACHE_BYTES = 64 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -168,3 +279,14 @@ CHANNEL_LAYERS = {
         # },
     },
 }
+# Fan messages out to every worker process on this host over Unix datagram
+# sockets. Windows has neither those nor the selector event loop the layer
+# reads them with (its ProactorEventLoop has no add_reader), so there messages
+# only reach the consumers of the process that sent them.
+if hasattr(socket, "AF_UNIX") and sys.platform != "win32":
+    CHANNEL_LAYERS["default"] = {
+        "BACKEND": "main.channel_layers.LocalSocketChannelLayer",
+        "CONFIG": {
+            "socket_dir": os.path.join(tempfile.gettempdir(), "bark_app_channels"),
+        },
+    }
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import DetectionEvent
+
+
+@admin.register(DetectionEvent)
+class DetectionEventAdmin(admin.ModelAdmin):
+    list_display = ["user", "prediction", "confidence", "filename", "created_at"]
+    list_filter = ["prediction"]
+    date_hierarchy = "created_at"
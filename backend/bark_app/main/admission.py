@@ -0,0 +1,144 @@
+"""
+Admission control for the inference path
+
+Every inference request has to be admitted before it is queued on the
+inference executor. Requests are refused straight away, with a Retry-After
+hint, when the user already has too many analyses in flight, when the queue
+is full or when the estimated wait would exceed the limit. Under a burst the
+requests that are admitted keep a bounded latency instead of every request
+timing out together.
+"""
+
+import math
+import threading
+import time
+from collections import Counter
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is shed instead of being queued
+    """
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Per-user and global concurrency limits in front of an executor
+
+    The expected wait of a new request is estimated from the number of
+    requests ahead of it and a moving average of the measured service time.
+    """
+
+    def __init__(
+        self,
+        executor,
+        workers,
+        max_queued,
+        max_per_user,
+        max_estimated_wait,
+        initial_service_time=0.5,
+        smoothing=0.2,
+    ):
+        self.executor = executor
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.max_estimated_wait = max_estimated_wait
+        self.smoothing = smoothing
+        self.service_time = initial_service_time
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._per_user = Counter()
+
+        self.admitted = 0
+        self.shed_user_limit = 0
+        self.shed_overload = 0
+
+    def estimated_wait(self, ahead=None):
+        """
+        Seconds a newly queued request is expected to wait before it runs
+        """
+        if ahead is None:
+            ahead = self._in_flight
+        rounds = math.floor(ahead / self.workers)
+        return rounds * self.service_time
+
+    def submit(self, user_id, fn, /, *args, **kwargs):
+        """
+        Admit a request and queue fn on the executor, or raise Overloaded
+        """
+        self._admit(user_id)
+
+        def timed():
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._observe(time.perf_counter() - start)
+
+        try:
+            future = self.executor.submit(timed)
+        except Exception:
+            self._release(user_id)
+            raise
+        future.add_done_callback(lambda _: self._release(user_id))
+
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "users_in_flight": len(self._per_user),
+                "service_time_ms": 1000 * self.service_time,
+                "estimated_wait_ms": 1000 * self.estimated_wait(),
+                "admitted": self.admitted,
+                "shed_user_limit": self.shed_user_limit,
+                "shed_overload": self.shed_overload,
+            }
+
+    def _admit(self, user_id):
+        with self._lock:
+            if self._per_user[user_id] >= self.max_per_user:
+                self.shed_user_limit += 1
+                raise Overloaded(
+                    "Too many analyses in progress for this user",
+                    status_code=429,
+                    retry_after=max(1, math.ceil(self.service_time)),
+                )
+
+            wait = self.estimated_wait()
+            if (
+                self._in_flight >= self.workers + self.max_queued
+                or wait > self.max_estimated_wait
+            ):
+                self.shed_overload += 1
+                raise Overloaded(
+                    "Server is busy, please retry later",
+                    status_code=503,
+                    retry_after=max(1, math.ceil(wait)),
+                )
+
+            self._in_flight += 1
+            self._per_user[user_id] += 1
+            self.admitted += 1
+
+    def _release(self, user_id):
+        with self._lock:
+            self._in_flight -= 1
+            self._per_user[user_id] -= 1
+            if self._per_user[user_id] <= 0:
+                del self._per_user[user_id]
+
+    def _observe(self, seconds):
+        with self._lock:
+            self.service_time += self.smoothing * (seconds - self.service_time)
@@ -0,0 +1,620 @@
+"""
+Chunked audio decoding for uploaded clips
+
+Uploads are decoded block by block while the bytes arrive: every block is
+converted to float32, downmixed to mono and resampled straight into a
+preallocated output buffer. Peak memory is bounded by the block size and the
+duration limit instead of by the size of the uploaded file.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+TARGET_SAMPLING_RATE = 16000
+
+# Number of source frames decoded per block for container formats
+DECODE_BLOCK_FRAMES = 65536
+
+# Initial output capacity when the clip duration is not known up front
+INITIAL_BUFFER_SECONDS = 30
+
+# Uploads are kept in memory up to this size before spilling to disk
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+ALLOWED_AUDIO_EXTENSIONS = [
+    ".wav",
+    ".mp3",
+    ".m4a",
+    ".flac",
+    ".ogg",
+    ".opus",
+    ".webm",
+]
+
+# Containers libsndfile cannot read; these are piped through ffmpeg
+FFMPEG_EXTENSIONS = [".webm", ".m4a"]
+
+# MP4 containers may keep their index (the moov atom) at the end of the file,
+# which ffmpeg cannot reach on a pipe; these are spooled to a file first
+FFMPEG_SPOOLED_EXTENSIONS = [".m4a"]
+
+# Bytes read from ffmpeg's output per read (0.5 s of 16 kHz float32)
+FFMPEG_READ_BYTES = 32768
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Largest header we are willing to buffer while looking for the "data" chunk
+MAX_WAV_HEADER_BYTES = 1024 * 1024
+
+
+class AudioDecodeError(Exception):
+    """
+    Raised when an upload cannot be decoded
+    """
+
+
+class AudioLimitExceeded(AudioDecodeError):
+    """
+    Raised as soon as an upload is known to exceed the size or duration limit
+    """
+
+
+class SampleBuffer:
+    """
+    Growable float32 buffer that resampled blocks are copied into
+    """
+
+    def __init__(self, max_samples=None, capacity=None):
+        self.max_samples = max_samples
+        if capacity is None:
+            capacity = INITIAL_BUFFER_SECONDS * TARGET_SAMPLING_RATE
+        if max_samples is not None:
+            capacity = min(capacity, max_samples)
+        # Nothing is allocated until the clip length is known or data arrives
+        self._initial_capacity = capacity
+        self._data = np.empty(0, dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def reserve(self, total_samples):
+        """
+        Preallocate room for the whole clip once its length is known
+        """
+        if total_samples > len(self._data):
+            self._resize(total_samples)
+
+    def append(self, block):
+        """
+        Copy a mono float32 block to the end of the buffer
+        """
+        end = self._size + len(block)
+        if self.max_samples is not None and end > self.max_samples:
+            raise AudioLimitExceeded("Audio exceeds the maximum allowed duration")
+        if end > len(self._data):
+            capacity = max(end, 2 * len(self._data), self._initial_capacity)
+            if self.max_samples is not None:
+                capacity = min(capacity, self.max_samples)
+            self._resize(capacity)
+        self._data[self._size : end] = block
+        self._size = end
+
+    def view(self):
+        """
+        Return the decoded samples without copying them
+        """
+        return self._data[: self._size]
+
+    def _resize(self, capacity):
+        data = np.empty(capacity, dtype=np.float32)
+        data[: self._size] = self._data[: self._size]
+        self._data = data
+
+
+def downmix(block, out=None):
+    """
+    Average a (frames, channels) float32 block into a mono block
+
+    ``out`` is an optional float32 array of at least ``frames`` samples to
+    write the average into instead of allocating one.
+    """
+    if block.ndim == 1:
+        return block
+    if block.shape[1] == 1:
+        return block[:, 0]
+    if out is not None:
+        out = out[: len(block)]
+    return block.mean(axis=1, dtype=np.float32, out=out)
+
+
+def pcm_to_float32(raw, sample_format, bits_per_sample):
+    """
+    Convert interleaved little-endian PCM bytes to float32 in [-1, 1)
+
+    The scaling matches what soundfile returns when reading as float.
+    """
+    if sample_format == WAVE_FORMAT_IEEE_FLOAT:
+        if bits_per_sample == 32:
+            return np.frombuffer(raw, dtype="<f4")
+        return np.frombuffer(raw, dtype="<f8").astype(np.float32)
+
+    if bits_per_sample == 8:
+        samples = np.frombuffer(raw, dtype=np.uint8).astype(np.float32)
+        samples -= 128.0
+        samples *= 1.0 / 128.0
+        return samples
+    if bits_per_sample == 16:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32)
+        samples *= 1.0 / 32768.0
+        return samples
+    if bits_per_sample == 24:
+        triples = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        values = (
+            triples[:, 0].astype(np.int32)
+            | (triples[:, 1].astype(np.int32) << 8)
+            | (triples[:, 2].astype(np.int32) << 16)
+        )
+        # Sign-extend from 24 to 32 bits
+        values = (values << 8) >> 8
+        samples = values.astype(np.float32)
+        samples *= 1.0 / 8388608.0
+        return samples
+    samples = np.frombuffer(raw, dtype="<i4").astype(np.float32)
+    samples *= 1.0 / 2147483648.0
+    return samples
+
+
+class StreamingAudioDecoder:
+    """
+    Incrementally turn uploaded bytes into mono float32 samples
+
+    PCM and float WAV files are decoded as the bytes are fed in. Other formats
+    libsndfile understands (FLAC, MP3, Ogg Vorbis/Opus) are spooled (in memory
+    up to SPOOL_MAX_MEMORY, then on disk) and decoded block by block once the
+    upload is complete. In both cases every block is
+    downmixed and resampled before it is stored, so only the target-rate mono
+    signal is ever held in full.
+    """
+
+    def __init__(
+        self,
+        file_extension,
+        target_sampling_rate=TARGET_SAMPLING_RATE,
+        max_duration=None,
+        max_bytes=None,
+    ):
+        self.file_extension = file_extension
+        self.target_sampling_rate = target_sampling_rate
+        self.max_duration = max_duration
+        self.max_bytes = max_bytes
+        self.bytes_received = 0
+        self.sampling_rate = None
+        self.channels = None
+
+        max_samples = None
+        if max_duration is not None:
+            max_samples = int(max_duration * target_sampling_rate)
+        self._output = SampleBuffer(max_samples=max_samples)
+        self._resampler = None
+        # Reused for every downmixed block, the output buffer keeps a copy
+        self._mono = None
+
+        self._wav = file_extension == ".wav"
+        self._header = bytearray()
+        self._data_remaining = None
+        self._remainder = b""
+        self._spool = None
+
+    def feed(self, data):
+        """
+        Consume the next chunk of the upload
+        """
+        self.bytes_received += len(data)
+        if self.max_bytes is not None and self.bytes_received > self.max_bytes:
+            raise AudioLimitExceeded("Audio file exceeds the maximum allowed size")
+
+        if self._wav:
+            if self.sampling_rate is None:
+                self._header += data
+                if not self._parse_wav_header():
+                    return
+                data = bytes(self._header)
+                self._header = bytearray()
+                if not self._wav:
+                    # Unsupported WAV flavour, let soundfile handle it
+                    self._spool_bytes(data)
+                    return
+            self._decode_pcm(data)
+        else:
+            self._spool_bytes(data)
+
+    def finish(self):
+        """
+        Flush the decoder and return the decoded samples
+        """
+        if self._spool is not None:
+            self._decode_spool()
+        elif self.sampling_rate is None:
+            raise AudioDecodeError("Empty or truncated audio upload")
+        elif self._remainder:
+            # Drop a trailing partial frame, as soundfile does
+            self._remainder = b""
+
+        if self._resampler is not None:
+            tail = self._resampler.resample_chunk(
+                np.zeros(0, dtype=np.float32), last=True
+            )
+            self._output.append(tail)
+
+        return self._output.view()
+
+    def close(self):
+        """
+        Release the spooled upload, if any
+        """
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def _start(self, sampling_rate, channels, total_frames=None):
+        self.sampling_rate = sampling_rate
+        self.channels = channels
+
+        if total_frames is not None:
+            duration = total_frames / sampling_rate
+            if self.max_duration is not None and duration > self.max_duration:
+                raise AudioLimitExceeded("Audio exceeds the maximum allowed duration")
+            expected = int(np.ceil(duration * self.target_sampling_rate))
+            self._output.reserve(expected + 1)
+
+        if sampling_rate != self.target_sampling_rate:
+            self._resampler = soxr.ResampleStream(
+                sampling_rate,
+                self.target_sampling_rate,
+                1,
+                dtype="float32",
+                quality="HQ",
+            )
+
+    def _emit(self, block):
+        if self._mono is None or len(self._mono) < len(block):
+            self._mono = np.empty(len(block), dtype=np.float32)
+        mono = downmix(block, self._mono)
+        if self._resampler is not None:
+            mono = self._resampler.resample_chunk(mono, last=False)
+        self._output.append(mono)
+
+    def _spool_bytes(self, data):
+        if self._spool is None:
+            self._spool = tempfile.SpooledTemporaryFile(
+                max_size=SPOOL_MAX_MEMORY, suffix=self.file_extension
+            )
+        self._spool.write(data)
+
+    def _decode_spool(self):
+        self._spool.seek(0)
+        try:
+            with sf.SoundFile(self._spool) as audio:
+                frames = audio.frames if audio.frames > 0 else None
+                self._start(audio.samplerate, audio.channels, frames)
+                # Every block is read into the same array
+                out = np.empty((DECODE_BLOCK_FRAMES, audio.channels), dtype=np.float32)
+                for block in audio.blocks(out=out):
+                    self._emit(block)
+        except (sf.LibsndfileError, RuntimeError, TypeError) as e:
+            raise AudioDecodeError(f"Could not decode audio: {e}") from e
+        finally:
+            self.close()
+
+    def _parse_wav_header(self):
+        """
+        Parse the RIFF header once enough bytes have arrived
+
+        Returns False while more bytes are needed. On success the header buffer
+        holds whatever followed the start of the "data" chunk.
+        """
+        header = self._header
+        if len(header) > MAX_WAV_HEADER_BYTES:
+            raise AudioDecodeError("WAV header is too large")
+        if len(header) < 12:
+            return False
+        if header[0:4] != b"RIFF" or header[8:12] != b"WAVE":
+            # Not really a WAV file, fall back to soundfile's detection
+            self._wav = False
+            self.sampling_rate = 0
+            return True
+
+        offset = 12
+        fmt = None
+        while offset + 8 <= len(header):
+            chunk_id = bytes(header[offset : offset + 4])
+            chunk_size = struct.unpack_from("<I", header, offset + 4)[0]
+            body = offset + 8
+
+            if chunk_id == b"data":
+                if fmt is None:
+                    raise AudioDecodeError("WAV data chunk precedes format chunk")
+                self._start_wav(fmt, chunk_size)
+                if self._wav:
+                    del header[:body]
+                return True
+
+            # Chunks are word aligned
+            end = body + chunk_size + (chunk_size & 1)
+            if end > len(header):
+                return False
+            if chunk_id == b"fmt ":
+                fmt = self._parse_fmt(bytes(header[body : body + chunk_size]))
+            offset = end
+
+        return False
+
+    def _parse_fmt(self, body):
+        if len(body) < 16:
+            raise AudioDecodeError("Invalid WAV format chunk")
+        sample_format, channels, sampling_rate, _, block_align, bits = struct.unpack_from(
+            "<HHIIHH", body
+        )
+        if sample_format == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+            # The first two bytes of the sub-format GUID hold the real format
+            sample_format = struct.unpack_from("<H", body, 24)[0]
+        return sample_format, channels, sampling_rate, block_align, bits
+
+    def _start_wav(self, fmt, data_size):
+        sample_format, channels, sampling_rate, block_align, bits = fmt
+        supported = (
+            sample_format == WAVE_FORMAT_PCM and bits in (8, 16, 24, 32)
+        ) or (sample_format == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64))
+        if (
+            not supported
+            or channels == 0
+            or sampling_rate == 0
+            or block_align != channels * bits // 8
+        ):
+            self._wav = False
+            self.sampling_rate = 0
+            return
+
+        self._sample_format = sample_format
+        self._bits = bits
+        self._block_align = block_align
+
+        # Streaming writers leave the size at 0 or 0xFFFFFFFF
+        total_frames = None
+        if 0 < data_size < 0xFFFFFFFF:
+            self._data_remaining = data_size
+            total_frames = data_size // block_align
+        self._start(sampling_rate, channels, total_frames)
+
+    def _decode_pcm(self, data):
+        if self._data_remaining is not None:
+            data = data[: self._data_remaining]
+            self._data_remaining -= len(data)
+        if self._remainder:
+            data = self._remainder + data
+
+        usable = len(data) - len(data) % self._block_align
+        self._remainder = data[usable:]
+        if usable == 0:
+            return
+
+        samples = pcm_to_float32(data[:usable], self._sample_format, self._bits)
+        self._emit(samples.reshape(-1, self.channels))
+
+
+class FfmpegAudioDecoder:
+    """
+    Decode containers libsndfile does not support by streaming them through ffmpeg
+
+    Uploaded chunks are written to ffmpeg's stdin as they arrive while a reader
+    thread collects the mono float32 output, already resampled by ffmpeg, into
+    the preallocated buffer. MP4 based uploads are written to a temporary file
+    instead and decoded from there once complete, as ffmpeg may need to seek
+    to their index. ffmpeg must be installed on the server.
+    """
+
+    def __init__(
+        self,
+        file_extension,
+        target_sampling_rate=TARGET_SAMPLING_RATE,
+        max_duration=None,
+        max_bytes=None,
+    ):
+        self.file_extension = file_extension
+        self.target_sampling_rate = target_sampling_rate
+        self.max_duration = max_duration
+        self.max_bytes = max_bytes
+        self.bytes_received = 0
+
+        max_samples = None
+        if max_duration is not None:
+            max_samples = int(max_duration * target_sampling_rate)
+        self._output = SampleBuffer(max_samples=max_samples)
+        self._process = None
+        self._reader = None
+        self._reader_error = None
+        self._stderr = None
+        self._spool = None
+
+    def feed(self, data):
+        """
+        Consume the next chunk of the upload
+        """
+        self.bytes_received += len(data)
+        if self.max_bytes is not None and self.bytes_received > self.max_bytes:
+            raise AudioLimitExceeded("Audio file exceeds the maximum allowed size")
+        if self._reader_error is not None:
+            raise self._reader_error
+
+        if self.file_extension in FFMPEG_SPOOLED_EXTENSIONS:
+            if self._spool is None:
+                self._spool = tempfile.NamedTemporaryFile(suffix=self.file_extension)
+            self._spool.write(data)
+            return
+
+        if self._process is None:
+            self._start("pipe:0")
+        try:
+            self._process.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            # ffmpeg gave up, the reason is reported by finish()
+            pass
+
+    def finish(self):
+        """
+        Flush ffmpeg and return the decoded samples
+        """
+        if self._spool is not None and self._process is None:
+            self._spool.flush()
+            self._start(self._spool.name)
+        if self._process is None:
+            raise AudioDecodeError("Empty or truncated audio upload")
+
+        if self._process.stdin is not None:
+            try:
+                self._process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+        self._reader.join()
+        returncode = self._process.wait()
+
+        if self._reader_error is not None:
+            raise self._reader_error
+        if returncode != 0:
+            self._stderr.seek(0)
+            message = self._stderr.read().decode(errors="replace").strip()
+            raise AudioDecodeError(f"Could not decode audio: {message}")
+
+        return self._output.view()
+
+    def close(self):
+        """
+        Stop ffmpeg if it is still running
+        """
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        if self._reader is not None:
+            self._reader.join()
+        if self._stderr is not None:
+            self._stderr.close()
+            self._stderr = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def _start(self, source):
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise AudioDecodeError(
+                f"ffmpeg is required to decode {self.file_extension} uploads"
+            )
+
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            [
+                ffmpeg,
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-i",
+                source,
+                "-f",
+                "f32le",
+                "-ac",
+                "1",
+                "-ar",
+                str(self.target_sampling_rate),
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE if source == "pipe:0" else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=self._stderr,
+        )
+        self._reader = threading.Thread(target=self._read_output, daemon=True)
+        self._reader.start()
+
+    def _read_output(self):
+        remainder = b""
+        try:
+            for chunk in iter(lambda: self._process.stdout.read(FFMPEG_READ_BYTES), b""):
+                if remainder:
+                    chunk = remainder + chunk
+                usable = len(chunk) - len(chunk) % 4
+                remainder = chunk[usable:]
+                self._output.append(np.frombuffer(chunk[:usable], dtype="<f4"))
+        except AudioDecodeError as e:
+            self._reader_error = e
+            self._process.kill()
+
+
+def create_decoder(
+    file_extension,
+    target_sampling_rate=TARGET_SAMPLING_RATE,
+    max_duration=None,
+    max_bytes=None,
+):
+    """
+    Return the streaming decoder suited to an upload's file extension
+    """
+    decoder_class = StreamingAudioDecoder
+    if file_extension in FFMPEG_EXTENSIONS:
+        decoder_class = FfmpegAudioDecoder
+
+    return decoder_class(
+        file_extension,
+        target_sampling_rate=target_sampling_rate,
+        max_duration=max_duration,
+        max_bytes=max_bytes,
+    )
+
+
+def decode_audio_bytes(
+    chunks,
+    file_extension,
+    target_sampling_rate=TARGET_SAMPLING_RATE,
+    max_duration=None,
+):
+    """
+    Decode an iterable of encoded byte chunks through the streaming pipeline
+    """
+    decoder = create_decoder(
+        file_extension,
+        target_sampling_rate=target_sampling_rate,
+        max_duration=max_duration,
+    )
+    try:
+        for chunk in chunks:
+            decoder.feed(chunk)
+        return decoder.finish()
+    finally:
+        decoder.close()
+
+
+def decode_audio_file(
+    audio_path,
+    target_sampling_rate=TARGET_SAMPLING_RATE,
+    max_duration=None,
+    chunk_size=DECODE_BLOCK_FRAMES,
+):
+    """
+    Decode an audio file from disk through the streaming pipeline
+    """
+    with open(audio_path, "rb") as f:
+        return decode_audio_bytes(
+            iter(lambda: f.read(chunk_size), b""),
+            os.path.splitext(audio_path)[1].lower(),
+            target_sampling_rate=target_sampling_rate,
+            max_duration=max_duration,
+        )
@@ -0,0 +1,99 @@
+import threading
+import time
+
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+class UserCache:
+    """
+    Small in-process cache of authenticated users with a short time-to-live
+
+    Entries are dropped explicitly when a user is saved or deleted (see
+    signals.py); the TTL bounds how long another worker process can keep
+    serving a stale entry.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            return user
+
+    def set(self, user_id, user):
+        with self._lock:
+            if user_id not in self._entries and len(self._entries) >= self.max_entries:
+                # Dicts keep insertion order, so this drops the oldest entry
+                del self._entries[next(iter(self._entries))]
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+USER_CACHE = UserCache(settings.AUTH_USER_CACHE_TTL)
+
+
+def invalidate_cached_user(user_id):
+    """
+    Forget a cached user, e.g. after it was deactivated
+    """
+    USER_CACHE.invalidate(str(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the user from a short-lived local cache
+
+    The token signature and expiry are still validated on every request; only
+    the database lookup of the user row is skipped while the user is cached.
+    """
+
+    def get_cached_user(self, validated_token):
+        """
+        Return the cached user for a validated token, or None on a cache miss
+        """
+        # Revocation on password change needs the current password hash
+        if getattr(api_settings, "CHECK_REVOKE_TOKEN", False):
+            return None
+
+        try:
+            user_id = str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        user = USER_CACHE.get(user_id)
+        if user is not None and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        return user
+
+    def get_user(self, validated_token):
+        user = self.get_cached_user(validated_token)
+        if user is not None:
+            return user
+
+        # Raises for unknown and inactive users, which are never cached
+        user = super().get_user(validated_token)
+        if not getattr(api_settings, "CHECK_REVOKE_TOKEN", False):
+            USER_CACHE.set(str(validated_token[api_settings.USER_ID_CLAIM]), user)
+
+        return user
@@ -0,0 +1,227 @@
+"""
+Channel layer that fans messages out across worker processes on one host
+
+InMemoryChannelLayer only delivers within the process that sent a message, so
+with several daphne workers a detection made in one worker never reaches a
+dashboard connected to another. This layer keeps the in-memory queues and
+group membership of InMemoryChannelLayer, but every process that has
+consumers also binds a Unix datagram socket in a shared directory. Group
+messages are sent to every socket in that directory and each process
+delivers them to its own group members; messages for a specific channel go
+straight to the socket of the process that owns the channel. No broker
+process is needed.
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import socket
+import tempfile
+import time
+import uuid
+from collections import deque
+
+import msgpack
+import numpy as np
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+logger = logging.getLogger(__name__)
+
+SOCKET_SUFFIX = ".sock"
+
+# Messages are sent as single datagrams
+MAX_MESSAGE_BYTES = 64 * 1024
+
+
+class LocalSocketChannelLayer(InMemoryChannelLayer):
+    """
+    InMemoryChannelLayer with cross-process delivery over Unix datagram sockets
+    """
+
+    def __init__(self, socket_dir=None, latency_window=1000, **kwargs):
+        super().__init__(**kwargs)
+        if socket_dir is None:
+            socket_dir = os.path.join(tempfile.gettempdir(), "bark_app_channels")
+        self.socket_dir = socket_dir
+        self.process_id = uuid.uuid4().hex[:16]
+        self.socket_path = os.path.join(socket_dir, self.process_id + SOCKET_SUFFIX)
+
+        self._sender = None
+        self._receiver = None
+        self._loop = None
+
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self._latencies = deque(maxlen=latency_window)
+
+    # Channel layer API
+
+    async def new_channel(self, prefix="specific."):
+        """
+        Return a channel name that routes back to this process
+        """
+        self._ensure_receiver()
+        return f"{prefix}{self.process_id}!{uuid.uuid4().hex[:12]}"
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+
+        owner = self._channel_owner(channel)
+        if owner is None:
+            # Not a process-specific channel, keep it local
+            await InMemoryChannelLayer.send(self, channel, message)
+            return
+
+        self._send_datagram(
+            os.path.join(self.socket_dir, owner + SOCKET_SUFFIX),
+            self._pack("channel", channel, message),
+        )
+
+    async def receive(self, channel):
+        self._ensure_receiver()
+        return await super().receive(channel)
+
+    async def group_add(self, group, channel):
+        self._ensure_receiver()
+        await super().group_add(group, channel)
+
+    async def group_send(self, group, message):
+        """
+        Send a message to the members of a group in every process
+        """
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+
+        # Local members are reached through our own socket as well, so queues
+        # are only ever touched from the loop that owns the receiver
+        payload = self._pack("group", group, message)
+        for path in self._peer_paths():
+            self._send_datagram(path, payload)
+
+    async def flush(self):
+        await super().flush()
+        self._close_sockets()
+
+    async def close(self):
+        self._close_sockets()
+
+    def stats(self):
+        """
+        Return message counters and fan-out latency of this process
+        """
+        latencies = 1000 * np.asarray(self._latencies)
+        return {
+            "process_id": self.process_id,
+            "peers": len(self._peer_paths()),
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped,
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+    # Transport
+
+    def _channel_owner(self, channel):
+        if "!" not in channel:
+            return None
+        return channel.split("!", 1)[0].rsplit(".", 1)[-1]
+
+    def _pack(self, kind, target, message):
+        payload = msgpack.packb(
+            {"kind": kind, "target": target, "message": message, "sent": time.time()},
+            use_bin_type=True,
+        )
+        if len(payload) > MAX_MESSAGE_BYTES:
+            raise ValueError(f"Message to {target} exceeds {MAX_MESSAGE_BYTES} bytes")
+        return payload
+
+    def _peer_paths(self):
+        try:
+            return [
+                entry.path
+                for entry in os.scandir(self.socket_dir)
+                if entry.name.endswith(SOCKET_SUFFIX)
+            ]
+        except FileNotFoundError:
+            return []
+
+    def _send_datagram(self, path, payload):
+        if self._sender is None:
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+
+        try:
+            self._sender.sendto(payload, path)
+            self.sent += 1
+        except (FileNotFoundError, ConnectionRefusedError):
+            # The process that owned this socket is gone
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        except BlockingIOError:
+            # The receiving process is not keeping up, like a full channel
+            self.dropped += 1
+
+    def _ensure_receiver(self):
+        if self._receiver is not None:
+            return
+
+        os.makedirs(self.socket_dir, exist_ok=True)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(self.socket_path)
+        receiver.setblocking(False)
+
+        self._receiver = receiver
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(receiver.fileno(), self._on_readable)
+        atexit.register(self._close_sockets)
+
+    def _on_readable(self):
+        while True:
+            try:
+                payload = self._receiver.recv(MAX_MESSAGE_BYTES)
+            except (BlockingIOError, InterruptedError):
+                return
+
+            try:
+                envelope = msgpack.unpackb(payload, raw=False)
+            except Exception as e:
+                logger.warning(f"Discarding malformed channel message: {e}")
+                continue
+
+            self.received += 1
+            self._latencies.append(time.time() - envelope["sent"])
+            self._loop.create_task(self._deliver(envelope))
+
+    async def _deliver(self, envelope):
+        if envelope["kind"] == "group":
+            self._clean_expired()
+            channels = list(self.groups.get(envelope["target"], {}))
+        else:
+            channels = [envelope["target"]]
+
+        for channel in channels:
+            try:
+                await InMemoryChannelLayer.send(self, channel, envelope["message"])
+            except ChannelFull:
+                self.dropped += 1
+
+    def _close_sockets(self):
+        if self._receiver is not None:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self._receiver.fileno())
+            self._receiver.close()
+            self._receiver = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        if self._sender is not None:
+            self._sender.close()
+            self._sender = None
@@ -0,0 +1,359 @@
+"""
+Content-addressed archive of detected and uncertain clips
+
+Uploads are decoded while they are received and never written to disk, so
+without this archive a production bark cannot be replayed, relabeled or
+trained on. When AI_CLIP_ARCHIVE_ENABLED is set, every clip the model calls a
+bark or is unsure about is kept:
+
+- clips are addressed by a hash of their decoded 16 kHz samples, so a clip
+  that is uploaded again is stored once
+- the decoded signal is compressed (FLAC by default, Opus optionally) and
+  appended to the current segment file; a new segment is started once it
+  reaches AI_CLIP_ARCHIVE_SEGMENT_BYTES
+- an append-only index of fixed-size records maps each hash to its segment,
+  offset and length, so any clip (or byte range of it) is read with a single
+  seek
+
+Like the embedding index, appends from several processes are serialized with
+an exclusive lock on the index file and every process picks up what others
+appended when the index has grown. ``export_clip_archive`` writes a manifest
+that ai_model/audio_training_guide.py trains on directly from the segments.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import soundfile as sf
+from django.conf import settings
+
+from .audio import TARGET_SAMPLING_RATE
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: appends are only serialized within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("digest", "V16"),
+        ("segment", "<u4"),
+        ("offset", "<u8"),
+        ("length", "<u4"),
+        ("samples", "<u4"),
+        ("kind", "u1"),
+        ("format", "u1"),
+        ("bark_probability", "<f4"),
+        ("user_id", "<i8"),
+        ("created_at", "<f8"),
+    ]
+)
+
+# Why a clip was kept, stored as the index into this tuple
+CLIP_KINDS = ("bark", "uncertain")
+
+# soundfile format, subtype and content type of the supported codecs. The
+# codec is recorded per clip, so AI_CLIP_ARCHIVE_FORMAT can be changed on an
+# existing archive.
+CLIP_FORMATS = {
+    "flac": ("FLAC", "PCM_16", "audio/flac"),
+    "opus": ("OGG", "OPUS", "audio/ogg"),
+}
+CLIP_FORMAT_NAMES = tuple(CLIP_FORMATS)
+
+
+def clip_digest(samples):
+    """
+    Content address of a decoded clip
+    """
+    samples = np.ascontiguousarray(samples, dtype=np.float32)
+    return hashlib.blake2b(samples.tobytes(), digest_size=16).digest()
+
+
+def clip_kind(result, uncertain_band=None):
+    """
+    Why a classified clip should be archived, or None if it should not be
+    """
+    low, high = uncertain_band or settings.AI_CLIP_ARCHIVE_UNCERTAIN_BAND
+    if low <= result["probabilities"]["bark"] <= high:
+        return "uncertain"
+    if result["prediction"] == "bark":
+        return "bark"
+    return None
+
+
+def encode_clip(samples, audio_format="flac"):
+    file_format, subtype, _ = CLIP_FORMATS[audio_format]
+    buffer = io.BytesIO()
+    sf.write(
+        buffer,
+        np.clip(samples, -1.0, 1.0),
+        TARGET_SAMPLING_RATE,
+        format=file_format,
+        subtype=subtype,
+    )
+    return buffer.getvalue()
+
+
+class ClipArchive:
+    """
+    Compressed clips packed into append-only segment files with an index
+    """
+
+    def __init__(self, root, segment_bytes=None, audio_format=None):
+        if segment_bytes is None:
+            segment_bytes = settings.AI_CLIP_ARCHIVE_SEGMENT_BYTES
+        if audio_format is None:
+            audio_format = settings.AI_CLIP_ARCHIVE_FORMAT
+        if audio_format not in CLIP_FORMATS:
+            raise ValueError(f"Unsupported clip format: {audio_format}")
+
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.audio_format = audio_format
+        self.index_path = os.path.join(root, "index.bin")
+
+        self._records = None
+        self._count = 0
+        self._rows = {}
+        self._lock = threading.Lock()
+
+        # Figures of the clips written by this process
+        self.written = 0
+        self.duplicates = 0
+        self.bytes_written = 0
+        self.write_ms_total = 0.0
+        self.write_ms_max = 0.0
+
+    def __len__(self):
+        return self._count
+
+    def segment_path(self, segment):
+        return os.path.join(self.root, f"segment_{segment:06d}.seg")
+
+    def refresh(self):
+        """
+        Map the index records appended since the last look at the file
+        """
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            return
+        # A record that is still being written is picked up next time
+        total = size // INDEX_DTYPE.itemsize
+        if total <= self._count:
+            return
+
+        self._records = np.memmap(
+            self.index_path, dtype=INDEX_DTYPE, mode="r", shape=(total,)
+        )
+        new_digests = self._records["digest"][self._count :].tolist()
+        for row, digest in enumerate(new_digests, self._count):
+            self._rows[digest] = row
+        self._count = total
+
+    def lookup(self, digest):
+        """
+        Return the index record of a clip as a dict, or None
+        """
+        with self._lock:
+            self.refresh()
+            row = self._rows.get(digest)
+            if row is None:
+                return None
+            return self._describe(row)
+
+    def _describe(self, row):
+        record = self._records[row]
+        audio_format = CLIP_FORMAT_NAMES[record["format"]]
+        return {
+            "clip_id": record["digest"].tobytes().hex(),
+            "segment": self.segment_path(int(record["segment"])),
+            "offset": int(record["offset"]),
+            "length": int(record["length"]),
+            "duration": int(record["samples"]) / TARGET_SAMPLING_RATE,
+            "kind": CLIP_KINDS[record["kind"]],
+            "bark_probability": float(record["bark_probability"]),
+            "user_id": int(record["user_id"]),
+            "created_at": datetime.fromtimestamp(record["created_at"]).isoformat(),
+            "format": audio_format,
+            "content_type": CLIP_FORMATS[audio_format][2],
+        }
+
+    def records(self):
+        """
+        Every archived clip, oldest first
+        """
+        with self._lock:
+            self.refresh()
+            return [self._describe(row) for row in range(self._count)]
+
+    def put(self, samples, kind, bark_probability, user_id=None, created_at=None):
+        """
+        Archive a decoded clip and return (clip_id, stored)
+
+        stored is False when the same clip was archived before.
+        """
+        start = time.perf_counter()
+        digest = clip_digest(samples)
+
+        with self._lock:
+            self.refresh()
+            if digest in self._rows:
+                self.duplicates += 1
+                return digest.hex(), False
+
+        data = encode_clip(samples, self.audio_format)
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record["digest"] = digest
+        record["length"] = len(data)
+        record["samples"] = len(samples)
+        record["kind"] = CLIP_KINDS.index(kind)
+        record["format"] = CLIP_FORMAT_NAMES.index(self.audio_format)
+        record["bark_probability"] = bark_probability
+        record["user_id"] = -1 if user_id is None else user_id
+        record["created_at"] = time.time() if created_at is None else created_at
+
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(self.index_path, "ab") as index_file:
+            if fcntl is not None:
+                fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have archived the clip in the meantime
+                self.refresh()
+                if digest in self._rows:
+                    self.duplicates += 1
+                    return digest.hex(), False
+
+                segment = 0
+                if self._count:
+                    segment = int(self._records["segment"][self._count - 1])
+                    last_size = os.path.getsize(self.segment_path(segment))
+                    if last_size + len(data) > self.segment_bytes:
+                        segment += 1
+
+                # The index is written last, bytes of a crashed write are
+                # never referenced
+                with open(self.segment_path(segment), "ab") as segment_file:
+                    record["segment"] = segment
+                    record["offset"] = segment_file.tell()
+                    segment_file.write(data)
+                index_file.truncate(self._count * INDEX_DTYPE.itemsize)
+                index_file.write(record.tobytes())
+                index_file.flush()
+                self.refresh()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(index_file, fcntl.LOCK_UN)
+
+            elapsed_ms = 1000 * (time.perf_counter() - start)
+            self.written += 1
+            self.bytes_written += len(data)
+            self.write_ms_total += elapsed_ms
+            self.write_ms_max = max(self.write_ms_max, elapsed_ms)
+
+        return digest.hex(), True
+
+    def read(self, clip_id, start=0, end=None):
+        """
+        Return bytes [start, end) of an archived clip's encoded file
+
+        Raises KeyError for unknown clips.
+        """
+        try:
+            digest = bytes.fromhex(clip_id)
+        except ValueError:
+            raise KeyError(clip_id)
+        record = self.lookup(digest)
+        if record is None:
+            raise KeyError(clip_id)
+
+        end = record["length"] if end is None else min(end, record["length"])
+        if start >= end:
+            return b""
+        with open(record["segment"], "rb") as f:
+            f.seek(record["offset"] + start)
+            return f.read(end - start)
+
+    def stats(self):
+        with self._lock:
+            self.refresh()
+            if self._count:
+                lengths = np.asarray(self._records["length"], dtype=np.int64)
+                samples = np.asarray(self._records["samples"], dtype=np.int64)
+                stored_bytes = int(lengths.sum())
+                seconds = float(samples.sum()) / TARGET_SAMPLING_RATE
+                pcm_bytes = 2 * int(samples.sum())
+                segments = int(self._records["segment"][-1]) + 1
+            else:
+                stored_bytes = pcm_bytes = segments = 0
+                seconds = 0.0
+
+            return {
+                "format": self.audio_format,
+                "clips": self._count,
+                "segments": segments,
+                "stored_bytes": stored_bytes,
+                "bytes_per_clip": stored_bytes / max(self._count, 1),
+                "bytes_per_second": stored_bytes / max(seconds, 1e-9),
+                "compression_vs_pcm16": pcm_bytes / max(stored_bytes, 1),
+                "index_bytes": self._count * INDEX_DTYPE.itemsize,
+                "written": self.written,
+                "duplicates": self.duplicates,
+                "write_ms_mean": self.write_ms_total / max(self.written, 1),
+                "write_ms_max": self.write_ms_max,
+            }
+
+
+# Fields an archived clip adds to the analysis response
+CLIP_ARCHIVE_FIELDS = ("clip_id",)
+
+
+CLIP_ARCHIVE = None
+
+
+def get_clip_archive():
+    """
+    Return the clip archive of this process, or None if archiving is off
+    """
+    global CLIP_ARCHIVE
+
+    if not settings.AI_CLIP_ARCHIVE_ENABLED:
+        return None
+    if CLIP_ARCHIVE is None:
+        CLIP_ARCHIVE = ClipArchive(settings.AI_CLIP_ARCHIVE_DIR)
+
+    return CLIP_ARCHIVE
+
+
+def archive_clip(samples, result, user_id=None):
+    """
+    Archive a classified clip if it is a bark or uncertain
+
+    Returns the clip_id, or None if the clip is not archived. A failing
+    archive never fails the analysis.
+    """
+    archive = get_clip_archive()
+    if archive is None:
+        return None
+    kind = clip_kind(result)
+    if kind is None:
+        return None
+
+    try:
+        clip_id, _ = archive.put(
+            samples, kind, result["probabilities"]["bark"], user_id=user_id
+        )
+    except (OSError, sf.SoundFileError) as e:
+        logger.error(f"Could not archive clip: {e}")
+        return None
+    return clip_id
@@ -0,0 +1,289 @@
+"""
+Coalescing of overlapping clips from one recorder
+
+The recorder sends a clip for every loud noise, so a barking episode arrives
+as a burst of clips from the same user that largely overlap. Instead of
+scoring each of them, the first clip of a user (and device, from the optional
+X-Device-ID header) opens a group that stays open for AI_COALESCE_WINDOW
+seconds. Clips arriving meanwhile that overlap the group's audio join it: the
+overlapping part, found by cross-correlation, is dropped and the rest is
+appended. A clip that does not overlap opens a group of its own, so it is
+never answered with another clip's result. When the window closes the merged
+segment is scored once (all of its one-second windows in a single batch, the
+most bark-like window decides) and every waiting request gets that
+consolidated result. The result is cached under every clip's key, and a bark
+is added to the embedding index once per clip, from the windows covering it.
+
+A group with a single clip is analyzed exactly as without coalescing.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+import numpy as np
+from django.conf import settings
+
+from .audio import TARGET_SAMPLING_RATE
+from .inference import analyze_coalesced, analyze_samples, get_admission_controller
+
+logger = logging.getLogger(__name__)
+
+# Fields a coalesced result adds to the analysis response
+COALESCED_FIELDS = ("coalesced", "windows_scored")
+
+# Start of a clip that is searched for in the group's audio
+OVERLAP_PROBE_SECONDS = 0.25
+# Normalized cross-correlation above which the probe is taken as found
+OVERLAP_MIN_CORRELATION = 0.9
+# Recent audio of a group that a new clip's start is searched in
+OVERLAP_SEARCH_SECONDS = 10.0
+
+
+def find_overlap(
+    merged,
+    clip,
+    sampling_rate=TARGET_SAMPLING_RATE,
+    search_seconds=OVERLAP_SEARCH_SECONDS,
+):
+    """
+    Number of leading samples of clip that are already at the end of merged
+
+    The start of the clip is located in the recent part of the merged audio
+    with an FFT normalized cross-correlation; 0 means the clip does not
+    overlap.
+    """
+    probe = clip[: int(OVERLAP_PROBE_SECONDS * sampling_rate)]
+    search = merged[-int(search_seconds * sampling_rate) :]
+    if len(probe) == 0 or len(search) < len(probe):
+        return 0
+
+    probe_norm = float(np.linalg.norm(probe))
+    if probe_norm < 1e-6:
+        return 0
+
+    n_fft = 1 << (len(search) + len(probe) - 1).bit_length()
+    correlation = np.fft.irfft(
+        np.fft.rfft(search, n_fft) * np.conj(np.fft.rfft(probe, n_fft)), n_fft
+    )[: len(search) - len(probe) + 1]
+
+    # Energy of every probe-sized window of the search range
+    energy = np.concatenate(([0.0], np.cumsum(search.astype(np.float64) ** 2)))
+    window_energy = energy[len(probe) :] - energy[: -len(probe)]
+    similarity = correlation / (probe_norm * np.sqrt(np.maximum(window_energy, 1e-12)))
+
+    lag = int(np.argmax(similarity))
+    if similarity[lag] < OVERLAP_MIN_CORRELATION:
+        return 0
+
+    start = len(merged) - len(search) + lag
+    return min(len(merged) - start, len(clip))
+
+
+class ClipGroup:
+    """
+    Merged audio of the clips that joined within one window
+    """
+
+    def __init__(self, key, samples, schedule, cache_key=None):
+        self.key = key
+        self.schedule = schedule
+        self.parts = [samples]
+        self.tail = samples
+        self.samples = len(samples)
+        # (start, end, cache_key) of every clip in the merged audio
+        self.clips = [(0, len(samples), cache_key)]
+        self.waiters = []
+        # Guards the group's audio while a clip is matched against it
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def overlap(self, clip):
+        return find_overlap(self.tail, clip)
+
+    def merge(self, clip, overlap, cache_key=None):
+        """
+        Append the part of clip after its first ``overlap`` samples, which are
+        already in the group
+        """
+        start = self.samples - overlap
+        self.clips.append((start, start + len(clip), cache_key))
+        if overlap < len(clip):
+            self.parts.append(clip[overlap:])
+            self.samples += len(clip) - overlap
+            # Enough recent audio for the next overlap search
+            self.tail = np.concatenate([self.tail, clip[overlap:]])[
+                -int(OVERLAP_SEARCH_SECONDS * TARGET_SAMPLING_RATE) :
+            ]
+
+    def audio(self):
+        if len(self.parts) == 1:
+            return self.parts[0]
+        return np.concatenate(self.parts)
+
+
+class ClipCoalescer:
+    """
+    Groups the overlapping clips of one key that arrive within ``window``
+    seconds
+    """
+
+    def __init__(self, window, max_seconds):
+        self.window = window
+        self.max_samples = int(max_seconds * TARGET_SAMPLING_RATE)
+
+        self._groups = {}
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.groups = 0
+        self.joined = 0
+        self.deduplicated_samples = 0
+
+    def submit(self, key, samples, schedule, cache_key=None):
+        """
+        Add a clip to the open group of ``key`` or open a new one
+
+        ``schedule(samples, clips)`` queues the scoring of a group's audio,
+        where ``clips`` are the (start, end, cache_key) of its clips in the
+        order they joined, and returns a Future of one result per clip; the
+        first clip's is used for the whole group. Returns a Future of this
+        request's result; it may fail with Overloaded if the group is shed.
+        """
+        waiter = Future()
+        with self._lock:
+            self.requests += 1
+            group = self._groups.get(key)
+
+        # The cross-correlation only holds up clips of the same key
+        if group is not None:
+            with group.lock:
+                if not group.closed:
+                    overlap = group.overlap(samples)
+                    size = group.samples + len(samples) - overlap
+                    if overlap > 0 and size <= self.max_samples:
+                        group.merge(samples, overlap, cache_key)
+                        group.waiters.append(waiter)
+                        with self._lock:
+                            self.deduplicated_samples += overlap
+                            self.joined += 1
+                        return waiter
+
+        group = ClipGroup(key, samples, schedule, cache_key)
+        group.waiters.append(waiter)
+        with self._lock:
+            self._groups[key] = group
+            self.groups += 1
+
+        timer = threading.Timer(self.window, self._flush, args=(group,))
+        timer.daemon = True
+        timer.start()
+        return waiter
+
+    def _flush(self, group):
+        # No clip joins once the group is closed
+        with group.lock:
+            group.closed = True
+            with self._lock:
+                if self._groups.get(group.key) is group:
+                    del self._groups[group.key]
+
+        try:
+            future = group.schedule(group.audio(), group.clips)
+        except Exception as e:
+            self._resolve(group, exception=e)
+            return
+
+        def done(future):
+            try:
+                results = future.result()
+            except Exception as e:
+                self._resolve(group, exception=e)
+            else:
+                self._resolve(group, results=results)
+
+        future.add_done_callback(done)
+
+    @staticmethod
+    def _resolve(group, results=None, exception=None):
+        for index, waiter in enumerate(group.waiters):
+            # Waiters of clients that went away are cancelled already
+            try:
+                if exception is not None:
+                    waiter.set_exception(exception)
+                else:
+                    waiter.set_result(results[index])
+            except InvalidStateError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window": self.window,
+                "requests": self.requests,
+                "groups": self.groups,
+                "open_groups": len(self._groups),
+                # Every clip that joined a group would have been a forward pass
+                "forward_passes_avoided": self.joined,
+                "deduplicated_seconds": self.deduplicated_samples
+                / TARGET_SAMPLING_RATE,
+            }
+
+
+CLIP_COALESCER = None
+
+
+def get_clip_coalescer():
+    """
+    Return the coalescer of this process, or None if coalescing is off
+    """
+    global CLIP_COALESCER
+
+    if settings.AI_COALESCE_WINDOW <= 0:
+        return None
+    if CLIP_COALESCER is None:
+        CLIP_COALESCER = ClipCoalescer(
+            settings.AI_COALESCE_WINDOW, settings.AI_COALESCE_MAX_SECONDS
+        )
+
+    return CLIP_COALESCER
+
+
+def submit_analysis(user_id, samples, cache_key=None, cancelled=None, device=""):
+    """
+    Queue the analysis of a clip, coalesced with overlapping ones if enabled
+
+    Without coalescing this is get_admission_controller().submit() of
+    analyze_samples and raises Overloaded directly; with it the returned
+    Future fails with Overloaded instead. A coalesced request cannot be
+    cancelled on its own, cancelling its Future only stops the wait.
+    """
+    coalescer = get_clip_coalescer()
+    if coalescer is None:
+        return get_admission_controller().submit(
+            user_id,
+            analyze_samples,
+            samples,
+            cancelled,
+            cache_key=cache_key,
+            user_id=user_id,
+        )
+
+    def schedule(group_samples, clips):
+        return get_admission_controller().submit(
+            user_id, analyze_group, group_samples, clips, user_id=user_id
+        )
+
+    return coalescer.submit((user_id, device), samples, schedule, cache_key)
+
+
+def analyze_group(samples, clips, user_id=None):
+    """
+    Analyze the merged audio of a group, one result per clip
+    """
+    if len(clips) == 1:
+        _, _, cache_key = clips[0]
+        return [analyze_samples(samples, cache_key=cache_key, user_id=user_id)]
+
+    logger.info(f"Coalesced {len(clips)} clips of user {user_id} into one analysis")
+    return analyze_coalesced(samples, clips, user_id=user_id)
@@ -0,0 +1,54 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication
+from .live import detection_group
+
+
+class DetectionConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes live detection events of the connected user to a dashboard
+
+    The access token is passed as the ``token`` query parameter, since
+    browsers cannot set headers on WebSocket connections.
+    """
+
+    async def connect(self):
+        self.group_name = None
+        user = await self.authenticate()
+        if user is None:
+            await self.close(code=4401)
+            return
+
+        self.group_name = detection_group(user.pk)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.group_name is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def detection_event(self, event):
+        await self.send_json(event["event"])
+
+    async def authenticate(self):
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        raw_token = query.get("token", [None])[0]
+        if not raw_token:
+            return None
+
+        authentication = CachedJWTAuthentication()
+        try:
+            validated_token = authentication.get_validated_token(raw_token.encode())
+            user = authentication.get_cached_user(validated_token)
+            if user is None:
+                user = await database_sync_to_async(authentication.get_user)(
+                    validated_token
+                )
+        except AuthenticationFailed:
+            return None
+
+        return user
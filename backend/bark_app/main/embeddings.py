@@ -0,0 +1,370 @@
+"""
+Embedding index of detected barks
+
+The classifier's pooled projector output (the input of model.classifier) is a
+compact description of a clip. Every bark a user uploads is stored as a unit
+length float16 vector in append-only files per user, so similar past barks
+can be found with one vectorized cosine scan and barks can be grouped into
+clusters ("the same dog") as they arrive.
+
+Clustering is incremental leader clustering: a bark joins the cluster whose
+first member (its leader) is most similar, if that similarity passes
+AI_EMBEDDING_CLUSTER_THRESHOLD, and starts a new cluster otherwise. Only the
+recent members of that cluster are compared against to spot near-identical
+clips, which keeps adding a bark cheap however large the index grows.
+
+Each process maps the files of recently used users and picks up whatever
+other processes appended when a file has grown.
+"""
+
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import torch
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: appends are only serialized within one process
+    fcntl = None
+
+MAGIC = b"BARKEMB1"
+HEADER = struct.Struct("<8sI4x")
+
+# Per-bark metadata, stored next to the vectors in a file of its own
+RECORD_DTYPE = np.dtype([("created_at", "<f8"), ("cluster", "<i4")])
+
+# Most recent barks of a cluster that a new bark is checked against for being
+# a near-identical copy
+DUPLICATE_WINDOW = 1024
+
+# Users whose index is kept in memory by this process
+MAX_OPEN_INDEXES = 64
+
+# Fields index_bark() adds to an analysis result
+BARK_INDEX_FIELDS = ("bark_id", "cluster", "duplicate_of")
+
+# Thread-local slot the forward hook leaves the last batch's embeddings in
+_CAPTURED = threading.local()
+
+
+def capture_pooled_embeddings(model):
+    """
+    Keep the pooled features the classifier head receives on every forward pass
+
+    Returns the hook handle.
+    """
+
+    def hook(module, inputs, output):
+        _CAPTURED.embeddings = inputs[0].detach()
+
+    return model.classifier.register_forward_hook(hook)
+
+
+def reset_captured_embeddings():
+    _CAPTURED.embeddings = None
+
+
+def captured_embeddings():
+    """
+    Return the (batch, dim) embeddings of the last forward pass on this thread
+    """
+    return getattr(_CAPTURED, "embeddings", None)
+
+
+def isoformat(timestamp):
+    return datetime.fromtimestamp(float(timestamp)).isoformat()
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class EmbeddingIndex:
+    """
+    Append-only float16 embeddings of one user's barks
+
+    Vectors are kept as one contiguous float16 matrix in ``<path>.vec`` and
+    their creation time and cluster in ``<path>.meta``. Both files are
+    memory-mapped, so the vectors live in the page cache rather than in every
+    worker's heap, and the cosine scan runs as a single float16 matrix-vector
+    product in torch (NumPy has no fast float16 kernels).
+    """
+
+    def __init__(self, path, cluster_threshold=None, duplicate_threshold=None):
+        self.vectors_path = path + ".vec"
+        self.records_path = path + ".meta"
+        if cluster_threshold is None:
+            cluster_threshold = settings.AI_EMBEDDING_CLUSTER_THRESHOLD
+        if duplicate_threshold is None:
+            duplicate_threshold = settings.AI_EMBEDDING_DUPLICATE_THRESHOLD
+        self.cluster_threshold = cluster_threshold
+        self.duplicate_threshold = duplicate_threshold
+
+        self.dim = None
+        self._vectors = None
+        self._records = None
+        self._count = 0
+        self._leaders = []
+        self._leader_matrix = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        return HEADER.size + self._count * (2 * (self.dim or 0) + RECORD_DTYPE.itemsize)
+
+    def refresh(self):
+        """
+        Map the barks appended since the last look at the files
+        """
+        try:
+            vectors_size = os.path.getsize(self.vectors_path)
+            records_size = os.path.getsize(self.records_path)
+        except FileNotFoundError:
+            return
+        if vectors_size < HEADER.size:
+            return
+
+        if self.dim is None:
+            with open(self.vectors_path, "rb") as f:
+                magic, dim = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Not an embedding index: {self.vectors_path}")
+            self.dim = dim
+
+        # A bark that is still being written is picked up next time
+        total = min(
+            (vectors_size - HEADER.size) // (2 * self.dim),
+            records_size // RECORD_DTYPE.itemsize,
+        )
+        if total <= self._count:
+            return
+
+        # Copy-on-write maps are writable arrays, which torch can wrap without
+        # complaint; nothing is ever written through them
+        self._vectors = np.memmap(
+            self.vectors_path,
+            dtype=np.float16,
+            mode="c",
+            offset=HEADER.size,
+            shape=(total, self.dim),
+        )
+        self._records = np.memmap(
+            self.records_path, dtype=RECORD_DTYPE, mode="c", shape=(total,)
+        )
+
+        # Clusters are numbered in order of appearance, so a bark whose
+        # cluster is new is that cluster's leader
+        new_clusters = self._records["cluster"][self._count :].tolist()
+        for row, cluster in enumerate(new_clusters, self._count):
+            if cluster == len(self._leaders):
+                self._leaders.append(row)
+                self._leader_matrix = None
+        self._count = total
+
+    def scores(self, vector):
+        """
+        Cosine similarity of a vector to every stored bark
+        """
+        query = torch.from_numpy(unit(vector)).half()
+        with torch.no_grad():
+            scores = torch.mv(torch.from_numpy(self._vectors[: self._count]), query)
+        return scores.float().numpy()
+
+    def search(self, vector, k=10, exclude=None):
+        """
+        Return the k barks most similar to a vector, most similar first
+        """
+        with self._lock:
+            self.refresh()
+            if self._count == 0:
+                return []
+            scores = self.scores(vector)
+            if exclude is not None:
+                scores[exclude] = -np.inf
+            k = min(k, len(scores) - (exclude is not None))
+            if k <= 0:
+                return []
+
+            rows = np.argpartition(-scores, k - 1)[:k]
+            rows = rows[np.argsort(-scores[rows])]
+            return self._describe(rows, scores[rows])
+
+    def similar_to(self, row, k=10):
+        """
+        Return the k stored barks most similar to a stored bark
+        """
+        with self._lock:
+            self.refresh()
+            if not 0 <= row < self._count:
+                raise IndexError(row)
+            vector = self._vectors[row].astype(np.float32)
+        return self.search(vector, k, exclude=row)
+
+    def describe(self, row):
+        with self._lock:
+            self.refresh()
+            if not 0 <= row < self._count:
+                raise IndexError(row)
+            return self._describe([row])[0]
+
+    def _describe(self, rows, similarities=None):
+        barks = []
+        for position, row in enumerate(np.asarray(rows).tolist()):
+            record = self._records[row]
+            bark = {
+                "bark_id": row,
+                "cluster": int(record["cluster"]),
+                "created_at": isoformat(record["created_at"]),
+            }
+            if similarities is not None:
+                bark["similarity"] = float(similarities[position])
+            barks.append(bark)
+        return barks
+
+    def clusters(self):
+        """
+        Size, first and last appearance of every cluster
+        """
+        with self._lock:
+            self.refresh()
+            if self._count == 0:
+                return []
+            clusters = np.asarray(self._records["cluster"])
+            created_at = np.asarray(self._records["created_at"])
+            sizes = np.bincount(clusters, minlength=len(self._leaders))
+            last_seen = np.full(len(self._leaders), -np.inf)
+            np.maximum.at(last_seen, clusters, created_at)
+
+            return [
+                {
+                    "cluster": cluster,
+                    "size": int(sizes[cluster]),
+                    "first_seen": isoformat(created_at[leader]),
+                    "last_seen": isoformat(last_seen[cluster]),
+                }
+                for cluster, leader in enumerate(self._leaders)
+            ]
+
+    def add(self, vector, created_at=None):
+        """
+        Store a bark and return (row, cluster, duplicate_of)
+
+        Near-identical clips are not stored again: their row is that of the
+        earlier copy and duplicate_of is set.
+        """
+        vector = unit(vector)
+        if created_at is None:
+            created_at = time.time()
+
+        with self._lock, open(self.vectors_path, "ab") as vectors_file:
+            if fcntl is not None:
+                fcntl.flock(vectors_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have appended in the meantime
+                self.refresh()
+                if self.dim is None:
+                    # Also drops a header a crashed first writer left alone
+                    vectors_file.truncate(0)
+                    vectors_file.write(HEADER.pack(MAGIC, len(vector)))
+                    self.dim = len(vector)
+                elif len(vector) != self.dim:
+                    raise ValueError(
+                        f"Expected a {self.dim}-d embedding, got {len(vector)}"
+                    )
+
+                cluster, similarity = self._nearest_leader(vector)
+                if cluster is not None and similarity >= self.cluster_threshold:
+                    duplicate = self._find_duplicate(vector, cluster)
+                    if duplicate is not None:
+                        return duplicate, cluster, duplicate
+                else:
+                    cluster = len(self._leaders)
+
+                record = np.zeros(1, dtype=RECORD_DTYPE)
+                record["created_at"] = created_at
+                record["cluster"] = cluster
+
+                with open(self.records_path, "ab") as records_file:
+                    # Drop the half of a bark a crashed writer may have left
+                    vectors_file.truncate(HEADER.size + self._count * 2 * self.dim)
+                    records_file.truncate(self._count * RECORD_DTYPE.itemsize)
+                    vectors_file.write(vector.astype(np.float16).tobytes())
+                    vectors_file.flush()
+                    records_file.write(record.tobytes())
+
+                self.refresh()
+                return self._count - 1, cluster, None
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(vectors_file, fcntl.LOCK_UN)
+
+    def _nearest_leader(self, vector):
+        if not self._leaders:
+            return None, -1.0
+        if self._leader_matrix is None:
+            self._leader_matrix = self._vectors[self._leaders].astype(np.float32)
+        similarities = self._leader_matrix @ vector
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    def _find_duplicate(self, vector, cluster):
+        # Re-sent and overlapping clips arrive close together, so only the
+        # cluster's most recent barks are compared against
+        members = np.flatnonzero(self._records["cluster"] == cluster)
+        members = members[-DUPLICATE_WINDOW:]
+        similarities = self._vectors[members].astype(np.float32) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.duplicate_threshold:
+            return int(members[best])
+        return None
+
+
+class EmbeddingIndexRegistry:
+    """
+    Per-user indexes of this process, least recently used ones are dropped
+    """
+
+    def __init__(self, index_dir=None, max_open=MAX_OPEN_INDEXES):
+        self.index_dir = index_dir
+        self.max_open = max_open
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+
+            index_dir = self.index_dir or settings.AI_EMBEDDING_INDEX_DIR
+            os.makedirs(index_dir, exist_ok=True)
+            index = EmbeddingIndex(os.path.join(index_dir, f"user_{user_id}"))
+            self._indexes[user_id] = index
+            if len(self._indexes) > self.max_open:
+                self._indexes.popitem(last=False)
+            return index
+
+
+EMBEDDING_INDEXES = EmbeddingIndexRegistry()
+
+
+def index_bark(user_id, embedding):
+    """
+    Add a detected bark to its user's index
+
+    Returns the fields added to the analysis result.
+    """
+    row, cluster, duplicate_of = EMBEDDING_INDEXES.get(user_id).add(embedding)
+    return {"bark_id": row, "cluster": cluster, "duplicate_of": duplicate_of}
@@ -0,0 +1,186 @@
+"""
+Write-behind logging of detection results
+
+Analysis requests only append their result to an in-memory buffer. A
+background thread writes the buffer to the database in batches, when it
+reaches the batch size or when the flush interval elapses, and once more when
+the process exits. The writer thread keeps its database connection open
+between flushes; request threads use Django's default per-request connections.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, connection
+from django.utils import timezone
+
+from .models import DetectionEvent
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedEventWriter:
+    """
+    Queue DetectionEvent rows in memory and bulk insert them in batches
+    """
+
+    def __init__(self, batch_size, flush_interval, max_buffer):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self.flushes = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.max_depth = 0
+
+    def record(self, user_id, result, filename="", file_size=0):
+        """
+        Queue the result of one analyzed clip
+        """
+        event = DetectionEvent(
+            user_id=user_id,
+            prediction=result["prediction"],
+            confidence=result["confidence"],
+            bark_probability=result["probabilities"]["bark"],
+            filename=filename[:255],
+            file_size=file_size,
+            clip_id=result.get("clip_id", ""),
+            created_at=timezone.now(),
+        )
+
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                # The database is not keeping up, shed the oldest record
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(event)
+            depth = len(self._buffer)
+            self.max_depth = max(self.max_depth, depth)
+            if self._thread is None:
+                self._start()
+
+        if depth >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Write everything that is currently buffered
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._buffer)
+                self._buffer.clear()
+            if not batch:
+                return
+
+            # Reconnect if the kept connection went away since the last flush
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
+
+            start = time.perf_counter()
+            try:
+                DetectionEvent.objects.bulk_create(batch, batch_size=self.batch_size)
+                written = len(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} detection events: {e}")
+                self.failed_flushes += 1
+                written = self._write_one_by_one(batch)
+            finally:
+                elapsed = 1000 * (time.perf_counter() - start)
+                self.last_flush_ms = elapsed
+                self.max_flush_ms = max(self.max_flush_ms, elapsed)
+
+            self.flushes += 1
+            self.written += written
+            self.total_flush_ms += elapsed
+
+    def _write_one_by_one(self, batch):
+        """
+        Insert the rows of a failed batch separately and return how many made it
+
+        Rows the database rejects are dropped, so one bad row does not hold
+        back the others forever. If the database itself is unreachable the
+        remaining rows are put back in front of the queue for the next flush.
+        """
+        written = 0
+        for position, event in enumerate(batch):
+            try:
+                DetectionEvent.objects.bulk_create([event])
+            except (OperationalError, InterfaceError) as e:
+                logger.error(f"Database unavailable, keeping detection events: {e}")
+                connection.close()
+                self._requeue(batch[position:])
+                break
+            except (DatabaseError, ValueError, TypeError) as e:
+                logger.error(f"Dropping detection event of user {event.user_id}: {e}")
+                self.rejected += 1
+            else:
+                written += 1
+        return written
+
+    def _requeue(self, events):
+        with self._lock:
+            # Put the events back in front, keeping within max_buffer
+            room = max(self.max_buffer - len(self._buffer), 0)
+            kept = events[-room:] if room else []
+            self.dropped += len(events) - len(kept)
+            self._buffer.extendleft(reversed(kept))
+
+    def stats(self):
+        """
+        Return buffer depth and flush latency figures
+        """
+        with self._lock:
+            depth = len(self._buffer)
+
+        return {
+            "buffer_depth": depth,
+            "max_buffer_depth": self.max_depth,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="event-log-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Event log flush failed: {e}")
+
+
+EVENT_LOG = BufferedEventWriter(
+    batch_size=settings.EVENT_LOG_BATCH_SIZE,
+    flush_interval=settings.EVENT_LOG_FLUSH_INTERVAL,
+    max_buffer=settings.EVENT_LOG_MAX_BUFFER,
+)
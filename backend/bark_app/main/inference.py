@@ -0,0 +1,798 @@
+"""
+Model loading and inference for bark detection
+
+CPU-bound work is run on a bounded thread pool so that async views can await
+it without blocking the event loop.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from transformers import AutoModelForAudioClassification, AutoFeatureExtractor
+from django.conf import settings
+
+from .admission import AdmissionController
+from .audio import decode_audio_file
+from .clip_archive import archive_clip
+from .embeddings import (
+    capture_pooled_embeddings,
+    captured_embeddings,
+    index_bark,
+    reset_captured_embeddings,
+)
+from .segmentation import (
+    MAX_WINDOWS_PER_EVENT,
+    WINDOW_SECONDS,
+    detect_events,
+    event_windows,
+    window_offsets,
+)
+from .user_heads import get_user_heads
+
+logger = logging.getLogger(__name__)
+
+# Global variables for model loading
+MODEL = None
+FEATURE_EXTRACTOR = None
+STUDENT_MODEL = None
+EARLY_EXIT_HEADS = None
+_MODEL_LOCK = threading.Lock()
+
+# Clips answered by the student alone vs. escalated to the teacher
+CASCADE_STATS = Counter()
+
+# Clips answered after each transformer layer by the early-exit backend
+EXIT_STATS = Counter()
+
+# Shared pool for CPU-heavy decode and inference work
+INFERENCE_EXECUTOR = None
+ADMISSION_CONTROLLER = None
+
+# Recordings are segmented on a pool of their own, so a long job neither holds
+# up clip analyses nor skews their service time estimate
+SEGMENT_EXECUTOR = None
+SEGMENT_ADMISSION_CONTROLLER = None
+
+# The classifier only ever looks at the first second of a clip
+MODEL_INPUT_SAMPLES = 16000
+
+# Per-thread scratch buffer that model inputs are normalized into
+_INPUT_BUFFERS = threading.local()
+
+
+class AnalysisCancelled(Exception):
+    """
+    Raised inside a worker when the request that queued the work went away
+    """
+
+
+def get_inference_executor():
+    """
+    Return the bounded pool that runs inference off the event loop
+    """
+    global INFERENCE_EXECUTOR
+
+    if INFERENCE_EXECUTOR is None:
+        INFERENCE_EXECUTOR = ThreadPoolExecutor(
+            max_workers=settings.AI_INFERENCE_WORKERS,
+            thread_name_prefix="inference",
+        )
+
+    return INFERENCE_EXECUTOR
+
+
+def get_admission_controller():
+    """
+    Return the admission controller guarding the inference executor
+    """
+    global ADMISSION_CONTROLLER
+
+    if ADMISSION_CONTROLLER is None:
+        ADMISSION_CONTROLLER = AdmissionController(
+            get_inference_executor(),
+            workers=settings.AI_INFERENCE_WORKERS,
+            max_queued=settings.AI_MAX_QUEUED_REQUESTS,
+            max_per_user=settings.AI_MAX_CONCURRENT_PER_USER,
+            max_estimated_wait=settings.AI_MAX_ESTIMATED_WAIT,
+        )
+
+    return ADMISSION_CONTROLLER
+
+
+def get_segment_admission_controller():
+    """
+    Return the admission controller guarding the recording segmentation pool
+    """
+    global SEGMENT_EXECUTOR, SEGMENT_ADMISSION_CONTROLLER
+
+    if SEGMENT_ADMISSION_CONTROLLER is None:
+        SEGMENT_EXECUTOR = ThreadPoolExecutor(
+            max_workers=settings.AI_SEGMENT_WORKERS,
+            thread_name_prefix="segment",
+        )
+        SEGMENT_ADMISSION_CONTROLLER = AdmissionController(
+            SEGMENT_EXECUTOR,
+            workers=settings.AI_SEGMENT_WORKERS,
+            max_queued=settings.AI_SEGMENT_MAX_QUEUED_REQUESTS,
+            max_per_user=settings.AI_SEGMENT_MAX_CONCURRENT_PER_USER,
+            max_estimated_wait=settings.AI_SEGMENT_MAX_ESTIMATED_WAIT,
+            initial_service_time=settings.AI_SEGMENT_INITIAL_SERVICE_TIME,
+        )
+
+    return SEGMENT_ADMISSION_CONTROLLER
+
+
+class ResultCache:
+    """
+    LRU cache of predictions keyed by a hash of the audio the model sees
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(samples, user_id=None):
+        window = np.ascontiguousarray(samples[:MODEL_INPUT_SAMPLES])
+        digest = hashlib.blake2b(window.tobytes(), digest_size=16)
+        # With per-user heads the same audio may be scored differently per user
+        if user_id is not None and settings.AI_USER_HEADS_ENABLED:
+            digest.update(str(user_id).encode())
+        return digest.digest()
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+RESULT_CACHE = ResultCache(settings.AI_RESULT_CACHE_SIZE)
+
+
+def silence_gate_result(samples):
+    """
+    Return a no-bark result for near-silent clips without running the model
+    """
+    window = samples[:MODEL_INPUT_SAMPLES]
+    if len(window) == 0:
+        level = -np.inf
+    else:
+        energy = float(np.dot(window, window)) / len(window)
+        level = 10.0 * np.log10(energy + 1e-12)
+
+    if level >= settings.AI_SILENCE_GATE_DBFS:
+        return None
+
+    return {
+        "prediction": "no_bark",
+        "confidence": 1.0,
+        "class": 0,
+        "probabilities": {"no_bark": 1.0, "bark": 0.0},
+        "gated": True,
+    }
+
+
+def cheap_result(samples, user_id=None):
+    """
+    Answer a clip without inference if it is silent or was scored before
+
+    Returns (result, cache_key); result is None when the model has to run.
+    """
+    result = silence_gate_result(samples)
+    if result is not None:
+        return result, None
+
+    key = RESULT_CACHE.key(samples, user_id)
+    result = RESULT_CACHE.get(key)
+    if result is not None:
+        return dict(result, cached=True), key
+
+    return None, key
+
+
+def load_model(model_path=None):
+    """
+    Load the trained model and feature extractor
+    """
+    global MODEL, FEATURE_EXTRACTOR
+
+    if MODEL is not None and FEATURE_EXTRACTOR is not None:
+        return MODEL, FEATURE_EXTRACTOR
+
+    # Worker threads may race to load the model on the first requests
+    with _MODEL_LOCK:
+        if MODEL is not None and FEATURE_EXTRACTOR is not None:
+            return MODEL, FEATURE_EXTRACTOR
+
+        try:
+            # Use Django settings for model path
+            if model_path is None:
+                model_path = settings.AI_MODEL_ROOT
+
+            logger.info(f"Loading model from {model_path}...")
+
+            # Check if model directory exists
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"Model directory not found: {model_path}")
+
+            # Load the model from local path
+            MODEL = AutoModelForAudioClassification.from_pretrained(
+                model_path, local_files_only=True
+            )
+
+            # Set model to evaluation mode
+            MODEL.eval()
+
+            # Pooled features are kept for the embedding index
+            capture_pooled_embeddings(MODEL)
+
+            # Load the feature extractor from the original pre-trained model
+            FEATURE_EXTRACTOR = AutoFeatureExtractor.from_pretrained(
+                "facebook/wav2vec2-base"
+            )
+
+            logger.info("Model loaded successfully")
+        except Exception as e:
+            logger.error(f"Error loading model: {e}")
+            raise e
+
+    return MODEL, FEATURE_EXTRACTOR
+
+
+def load_audio_file(audio_path, target_sampling_rate=16000):
+    """
+    Load audio file as mono float32 through the streaming decoder
+    """
+    try:
+        audio_array = decode_audio_file(audio_path, target_sampling_rate)
+
+        return audio_array, target_sampling_rate
+    except Exception as e:
+        logger.error(f"Error loading audio file {audio_path}: {e}")
+        # Return silence if loading fails
+        return np.zeros(target_sampling_rate, dtype=np.float32), target_sampling_rate
+
+
+def input_buffer(rows, length):
+    """
+    Return a (rows, length) float32 array backed by this thread's scratch buffer
+
+    The buffer only grows, so after the first requests no memory is allocated
+    for model inputs. Its contents are overwritten by the next call on the
+    same thread.
+    """
+    size = rows * length
+    buffer = getattr(_INPUT_BUFFERS, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        buffer = np.empty(size, dtype=np.float32)
+        _INPUT_BUFFERS.buffer = buffer
+
+    return buffer[:size].reshape(rows, length)
+
+
+def fill_rows(clips, out, padding_value=0.0):
+    """
+    Copy clips into the rows of ``out``, truncated or padded to the row length
+
+    Returns the number of real samples in every row.
+    """
+    lengths = []
+    for row, clip in zip(out, clips):
+        length = min(len(clip), len(row))
+        row[:length] = clip[:length]
+        row[length:] = padding_value
+        lengths.append(length)
+
+    return lengths
+
+
+def normalize_rows(out, lengths=None):
+    """
+    Scale rows to zero mean and unit variance in place
+
+    Matches Wav2Vec2FeatureExtractor: with ``lengths`` only the real samples
+    of a row are normalized and its padding is left alone.
+    """
+    for index, row in enumerate(out):
+        valid = row if lengths is None else row[: lengths[index]]
+        if len(valid) == 0:
+            continue
+        valid -= valid.mean(dtype=np.float32)
+        # Mean is zero now, so the variance needs no temporary array
+        variance = np.dot(valid, valid) / len(valid)
+        valid *= np.float32(1.0 / np.sqrt(variance + 1e-7))
+
+    return out
+
+
+def preprocess_samples(audio_array, feature_extractor, target_sampling_rate=16000):
+    """
+    Preprocess already decoded mono samples for inference
+
+    Takes one clip or a batch of clips and gives the same input_values as the
+    feature extractor with padding=True and truncation to one second, but in
+    float32 throughout, written into the thread's reused input buffer and
+    handed to torch without a copy. The returned tensor is only valid until
+    the next call on the same thread.
+    """
+    single = isinstance(audio_array, np.ndarray) and audio_array.ndim == 1
+    clips = [audio_array] if single else audio_array
+    length = min(max(len(clip) for clip in clips), MODEL_INPUT_SAMPLES)
+
+    out = input_buffer(len(clips), length)
+    lengths = fill_rows(clips, out, feature_extractor.padding_value)
+    if feature_extractor.do_normalize:
+        use_lengths = feature_extractor.return_attention_mask
+        normalize_rows(out, lengths if use_lengths else None)
+
+    inputs = {"input_values": torch.from_numpy(out)}
+    if feature_extractor.return_attention_mask:
+        mask = np.arange(length) < np.asarray(lengths)[:, None]
+        inputs["attention_mask"] = torch.from_numpy(mask.astype(np.int32))
+
+    return inputs
+
+
+def preprocess_audio(audio_path, feature_extractor, target_sampling_rate=16000):
+    """
+    Preprocess a single audio file for inference
+    """
+    # Load and resample audio
+    audio_array, sr = load_audio_file(audio_path, target_sampling_rate)
+
+    # Extract features
+    return preprocess_samples(audio_array, feature_extractor, target_sampling_rate)
+
+
+def use_model(model, feature_extractor, audio_path):
+    """
+    Predict whether an audio file contains a bark
+    """
+    # Preprocess the audio
+    inputs = preprocess_audio(audio_path, feature_extractor)
+
+    return classify_inputs(model, inputs)
+
+
+def use_model_on_samples(model, feature_extractor, samples):
+    """
+    Predict whether decoded 16 kHz mono samples contain a bark
+    """
+    inputs = preprocess_samples(samples, feature_extractor)
+
+    return classify_inputs(model, inputs)
+
+
+def classify_inputs(model, inputs):
+    """
+    Run the classifier on extracted features
+    """
+    return classify_batch(model, inputs)[0]
+
+
+def classify_batch(model, inputs, user_id=None):
+    """
+    Run the classifier on a batch of extracted features
+
+    A batch belongs to one user; if ``user_id`` has a fine-tuned head, it
+    scores the batch on the backbone's pooled features.
+    """
+    # Make prediction
+    with torch.no_grad():
+        outputs = model(**inputs)
+
+    logits = outputs.logits
+    personalized = False
+    user_heads = get_user_heads()
+    embeddings = captured_embeddings()
+    if (
+        user_id is not None
+        and user_heads is not None
+        and embeddings is not None
+        and len(embeddings) == len(logits)
+    ):
+        with torch.no_grad():
+            logits, personalized = user_heads.personalize(logits, embeddings, user_id)
+
+    results = results_from_logits(logits, "teacher")
+    if personalized:
+        for result in results:
+            result["personalized"] = True
+
+    return results
+
+
+def results_from_logits(logits, model_name):
+    """
+    Turn a batch of logits into prediction dicts
+    """
+    probabilities = torch.softmax(logits, dim=-1)
+    predicted_classes = torch.argmax(logits, dim=-1)
+
+    # Map class index to label
+    class_labels = ["no_bark", "bark"]
+
+    results = []
+    for row, predicted_class in zip(probabilities.tolist(), predicted_classes.tolist()):
+        results.append(
+            {
+                "prediction": class_labels[predicted_class],
+                "confidence": row[predicted_class],
+                "class": predicted_class,
+                "probabilities": {
+                    "no_bark": row[0],
+                    "bark": row[1],
+                },
+                "model": model_name,
+            }
+        )
+
+    return results
+
+
+def load_student(model_path=None):
+    """
+    Load the distilled log-mel CNN exported by ai_model/distill_student.py
+    """
+    global STUDENT_MODEL
+
+    if STUDENT_MODEL is not None:
+        return STUDENT_MODEL
+
+    with _MODEL_LOCK:
+        if STUDENT_MODEL is None:
+            if model_path is None:
+                model_path = settings.AI_STUDENT_MODEL_PATH
+
+            logger.info(f"Loading student model from {model_path}...")
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"Student model not found: {model_path}")
+
+            student = torch.jit.load(model_path, map_location="cpu")
+            student.eval()
+            STUDENT_MODEL = student
+
+    return STUDENT_MODEL
+
+
+def classify_batch_with_student(student, inputs):
+    """
+    Run the student on a batch of extracted features
+
+    The student was trained on clips zero-padded to MODEL_INPUT_SAMPLES, and
+    its convolutions cannot score much shorter ones, so shorter batches are
+    padded the same way.
+    """
+    input_values = inputs["input_values"]
+    missing = MODEL_INPUT_SAMPLES - input_values.shape[-1]
+    if missing > 0:
+        input_values = torch.nn.functional.pad(input_values, (0, missing))
+
+    with torch.no_grad():
+        logits = student(input_values)
+
+    return results_from_logits(logits, "student")
+
+
+def load_early_exit_heads(model_path=None):
+    """
+    Load the intermediate-layer heads exported by ai_model/train_early_exit.py
+    """
+    global EARLY_EXIT_HEADS
+
+    if EARLY_EXIT_HEADS is not None:
+        return EARLY_EXIT_HEADS
+
+    with _MODEL_LOCK:
+        if EARLY_EXIT_HEADS is None:
+            if model_path is None:
+                model_path = settings.AI_EARLY_EXIT_HEADS_PATH
+
+            logger.info(f"Loading early-exit heads from {model_path}...")
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"Early-exit heads not found: {model_path}")
+
+            heads = torch.jit.load(model_path, map_location="cpu")
+            heads.eval()
+            EARLY_EXIT_HEADS = heads
+
+    return EARLY_EXIT_HEADS
+
+
+def run_encoder_layer(model, number, hidden_states):
+    """
+    Apply wav2vec2 transformer layer ``number`` (1-based)
+    """
+    encoder = model.wav2vec2.encoder
+    outputs = encoder.layers[number - 1](hidden_states)
+    hidden_states = outputs[0] if isinstance(outputs, tuple) else outputs
+    if model.config.do_stable_layer_norm and number == len(encoder.layers):
+        hidden_states = encoder.layer_norm(hidden_states)
+    return hidden_states
+
+
+def classify_batch_early_exit(model, heads, inputs, threshold):
+    """
+    Run wav2vec2 one layer at a time, clips leave at the first confident head
+
+    Follows Wav2Vec2ForSequenceClassification for unpadded inputs. Clips no
+    head is confident about get the full model's answer; the result says
+    after which layer each clip was answered.
+    """
+    input_values = inputs["input_values"]
+    wav2vec2 = model.wav2vec2
+    encoder = wav2vec2.encoder
+    num_layers = len(encoder.layers)
+    exit_indexes = {layer: index for index, layer in enumerate(heads.exit_layers)}
+
+    logits = torch.zeros(len(input_values), model.config.num_labels)
+    exits = [num_layers] * len(input_values)
+    remaining = torch.arange(len(input_values))
+
+    with torch.no_grad():
+        features = wav2vec2.feature_extractor(input_values).transpose(1, 2)
+        hidden_states, _ = wav2vec2.feature_projection(features)
+        hidden_states = hidden_states + encoder.pos_conv_embed(hidden_states)
+        if not model.config.do_stable_layer_norm:
+            hidden_states = encoder.layer_norm(hidden_states)
+
+        for number in range(1, num_layers + 1):
+            hidden_states = run_encoder_layer(model, number, hidden_states)
+            if number == num_layers:
+                pooled = model.projector(hidden_states).mean(dim=1)
+                logits[remaining] = model.classifier(pooled)
+                break
+            if number not in exit_indexes:
+                continue
+
+            head_logits = heads(hidden_states, exit_indexes[number])
+            confidence = torch.softmax(head_logits, dim=-1).max(dim=-1).values
+            confident = confidence >= threshold
+            logits[remaining[confident]] = head_logits[confident]
+            for row in remaining[confident].tolist():
+                exits[row] = number
+
+            # Only the clips that did not leave go through the next layers
+            remaining = remaining[~confident]
+            hidden_states = hidden_states[~confident]
+            if len(remaining) == 0:
+                break
+
+    results = results_from_logits(logits, "early_exit")
+    for result, exit_layer in zip(results, exits):
+        result["exit_layer"] = exit_layer
+        # Answered by the full model, comparable to the teacher's results
+        if exit_layer == num_layers:
+            result["model"] = "teacher"
+        EXIT_STATS[exit_layer] += 1
+
+    return results
+
+
+def classify_features(inputs, user_id=None):
+    """
+    Classify extracted features with the configured serving backend
+
+    "teacher" runs the wav2vec2 model, "student" the distilled CNN only, and
+    "cascade" runs the student first and escalates only the clips whose bark
+    probability falls inside AI_CASCADE_UNCERTAIN_BAND to the teacher.
+    "early_exit" runs wav2vec2 layer by layer and answers a clip at the first
+    intermediate head at least AI_EARLY_EXIT_THRESHOLD confident.
+
+    The head of ``user_id``, whose clips make up the batch, applies wherever
+    the teacher scores a clip.
+    """
+    backend = settings.AI_SERVING_BACKEND
+
+    if backend == "teacher":
+        model, _ = load_model()
+        return classify_batch(model, inputs, user_id)
+
+    if backend == "early_exit":
+        model, _ = load_model()
+        return classify_batch_early_exit(
+            model, load_early_exit_heads(), inputs, settings.AI_EARLY_EXIT_THRESHOLD
+        )
+
+    results = classify_batch_with_student(load_student(), inputs)
+    if backend == "student":
+        CASCADE_STATS["student"] += len(results)
+        return results
+
+    low, high = settings.AI_CASCADE_UNCERTAIN_BAND
+    uncertain = [
+        index
+        for index, result in enumerate(results)
+        if low < result["probabilities"]["bark"] < high
+    ]
+    CASCADE_STATS["student"] += len(results) - len(uncertain)
+    CASCADE_STATS["escalated"] += len(uncertain)
+
+    if uncertain:
+        model, _ = load_model()
+        teacher_inputs = {"input_values": inputs["input_values"][uncertain]}
+        teacher_results = classify_batch(model, teacher_inputs, user_id)
+        for index, result in zip(uncertain, teacher_results):
+            results[index] = result
+
+    return results
+
+
+def use_model_on_events(
+    feature_extractor,
+    samples,
+    events,
+    sampling_rate=16000,
+    batch_size=16,
+    user_id=None,
+):
+    """
+    Score the candidate events of a long recording
+
+    Every event is covered by one or more one-second windows. The windows are
+    scored in batches and an event takes the prediction of its most bark-like
+    window.
+    """
+    windows, owners = event_windows(samples, events, sampling_rate)
+
+    window_results = []
+    for start in range(0, len(windows), batch_size):
+        batch = list(windows[start : start + batch_size])
+        inputs = preprocess_samples(batch, feature_extractor, sampling_rate)
+        window_results.extend(classify_features(inputs, user_id))
+
+    event_results = [None] * len(events)
+    for owner, result in zip(owners.tolist(), window_results):
+        best = event_results[owner]
+        if best is None or result["probabilities"]["bark"] > best["probabilities"]["bark"]:
+            event_results[owner] = result
+
+    return event_results, len(windows)
+
+
+def analyze_samples(samples, cancelled=None, cache_key=None, user_id=None):
+    """
+    Classify decoded samples, giving up early if the request was cancelled
+
+    Meant to be run on the inference executor. ``cancelled`` is a
+    threading.Event set by the caller when the client disconnects. The result
+    is stored in the result cache under ``cache_key`` when one is given. Barks
+    scored by the teacher are added to ``user_id``'s embedding index and the
+    result gets their bark_id, cluster and duplicate_of. Barks and uncertain
+    clips are kept in the clip archive when it is enabled and the result gets
+    their clip_id.
+    """
+    if cancelled is not None and cancelled.is_set():
+        raise AnalysisCancelled()
+
+    _, feature_extractor = load_model()
+    inputs = preprocess_samples(samples, feature_extractor)
+
+    if cancelled is not None and cancelled.is_set():
+        raise AnalysisCancelled()
+
+    reset_captured_embeddings()
+    result = classify_features(inputs, user_id)[0]
+    if cache_key is not None:
+        RESULT_CACHE.put(cache_key, result)
+    # Added after caching, the cache key only covers the first second
+    clip_id = archive_clip(samples, result, user_id)
+    if clip_id is not None:
+        result = dict(result, clip_id=clip_id)
+
+    embeddings = captured_embeddings()
+    if embeddings is not None:
+        result = index_result(result, user_id, embeddings[0])
+
+    return result
+
+
+def index_result(result, user_id, embedding):
+    """
+    Add a bark to the user's embedding index and its fields to the result
+
+    The student has no comparable embedding, only teacher scores are indexed.
+    """
+    if (
+        user_id is None
+        or result["prediction"] != "bark"
+        or result["model"] != "teacher"
+    ):
+        return result
+
+    # The index is a side effect, the prediction stands without it
+    try:
+        return dict(result, **index_bark(user_id, embedding.numpy()))
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not index bark of user {user_id}: {e}")
+        return result
+
+
+def analyze_coalesced(samples, clips, user_id=None):
+    """
+    Classify the merged audio of several overlapping clips in one pass
+
+    All one-second windows of the segment are scored in a single batch and the
+    most bark-like one decides, like an event of analyze_recording. ``clips``
+    holds the (start, end, cache_key) of every clip in the merged samples.
+    Returns one result per clip: the consolidated prediction, which also goes
+    into the result cache under every clip's key, with how many clips it
+    answers and how many windows were scored. A bark is indexed once per clip,
+    with the embeddings of the windows covering that clip pooled.
+    """
+    _, feature_extractor = load_model()
+    events = np.array([[0, len(samples)]])
+    reset_captured_embeddings()
+    results, windows_scored = use_model_on_events(
+        feature_extractor,
+        samples,
+        events,
+        batch_size=MAX_WINDOWS_PER_EVENT,
+        user_id=user_id,
+    )
+
+    for _, _, cache_key in clips:
+        if cache_key is not None:
+            RESULT_CACHE.put(cache_key, results[0])
+    result = dict(results[0], coalesced=len(clips), windows_scored=windows_scored)
+    clip_id = archive_clip(samples, result, user_id)
+    if clip_id is not None:
+        result["clip_id"] = clip_id
+
+    # All windows went through the teacher in one batch, unless the backend
+    # only escalated some of them
+    embeddings = captured_embeddings()
+    if embeddings is None or len(embeddings) != windows_scored:
+        return [result] * len(clips)
+
+    window = min(int(WINDOW_SECONDS * 16000), len(samples))
+    offsets, _ = window_offsets(events, len(samples), window)
+    centres = offsets + window / 2
+    clip_results = []
+    for start, end, _ in clips:
+        covering = (offsets < end) & (offsets + window > start)
+        if not covering.any():
+            covering[np.argmin(np.abs(centres - (start + end) / 2))] = True
+        embedding = embeddings[torch.from_numpy(covering)].mean(dim=0)
+        clip_results.append(index_result(result, user_id, embedding))
+
+    return clip_results
+
+
+def analyze_recording(samples, sampling_rate=16000, user_id=None):
+    """
+    Segment a long recording and classify its candidate events
+
+    Returns (events, results, windows_scored).
+    """
+    events = detect_events(samples, sampling_rate)
+
+    _, feature_extractor = load_model()
+    results, windows_scored = use_model_on_events(
+        feature_extractor, samples, events, sampling_rate, user_id=user_id
+    )
+
+    return events, results, windows_scored
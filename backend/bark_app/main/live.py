@@ -0,0 +1,46 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+def detection_group(user_id):
+    """
+    Name of the group that receives a user's live detection events
+    """
+    return f"detections_{user_id}"
+
+
+def detection_message(result, filename, timestamp):
+    return {
+        "type": "detection.event",
+        "event": {
+            "prediction": result["prediction"],
+            "confidence": result["confidence"],
+            "probabilities": result["probabilities"],
+            "filename": filename,
+            "timestamp": timestamp,
+        },
+    }
+
+
+async def publish_detection(user_id, result, filename, timestamp):
+    """
+    Broadcast a detection to the user's dashboards in every worker process
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        await channel_layer.group_send(
+            detection_group(user_id), detection_message(result, filename, timestamp)
+        )
+    except Exception as e:
+        # Live updates are best effort, the analysis result still stands
+        logger.warning(f"Could not publish detection for user {user_id}: {e}")
+
+
+def publish_detection_sync(user_id, result, filename, timestamp):
+    async_to_sync(publish_detection)(user_id, result, filename, timestamp)
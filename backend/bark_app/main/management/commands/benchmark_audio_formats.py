@@ -0,0 +1,120 @@
+import io
+import os
+import shutil
+import subprocess
+import time
+
+import numpy as np
+import soundfile as sf
+from django.core.management.base import BaseCommand, CommandError
+
+from main.audio import TARGET_SAMPLING_RATE, decode_audio_bytes, decode_audio_file
+from main.inference import load_model, use_model_on_samples
+
+# Size of the chunks the upload handler receives
+UPLOAD_CHUNK_BYTES = 64 * 2**10
+
+
+def encode_with_soundfile(samples, file_format, subtype):
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, TARGET_SAMPLING_RATE, format=file_format, subtype=subtype)
+    return buffer.getvalue()
+
+
+def encode_webm_opus(samples):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    result = subprocess.run(
+        [
+            ffmpeg,
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "f32le",
+            "-ar",
+            str(TARGET_SAMPLING_RATE),
+            "-ac",
+            "1",
+            "-i",
+            "pipe:0",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            "32k",
+            "-f",
+            "webm",
+            "pipe:1",
+        ],
+        input=samples.astype("<f4").tobytes(),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return result.stdout
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare upload size, decode time and prediction parity of a clip "
+        "encoded as WAV, FLAC, Ogg Vorbis, Ogg Opus and WebM Opus"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("audio_path", help="Reference clip to encode")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--with-model",
+            action="store_true",
+            help="Also run the classifier on every decoded variant",
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["audio_path"]):
+            raise CommandError(f"File not found: {options['audio_path']}")
+
+        samples = decode_audio_file(options["audio_path"])
+        variants = [
+            (".wav", encode_with_soundfile(samples, "WAV", "PCM_16")),
+            (".flac", encode_with_soundfile(samples, "FLAC", "PCM_16")),
+            (".ogg", encode_with_soundfile(samples, "OGG", "VORBIS")),
+            (".opus", encode_with_soundfile(samples, "OGG", "OPUS")),
+            (".webm", encode_webm_opus(samples)),
+        ]
+
+        model = feature_extractor = None
+        if options["with_model"]:
+            model, feature_extractor = load_model()
+
+        wav_bytes = len(variants[0][1])
+        reference = None
+        self.stdout.write(
+            f"{'format':<8}{'bytes':>12}{'vs wav':>9}{'decode ms':>12}{'bark prob':>12}"
+        )
+        for extension, encoded in variants:
+            if encoded is None:
+                self.stdout.write(f"{extension:<8} skipped (ffmpeg not found)")
+                continue
+
+            chunks = [
+                encoded[i : i + UPLOAD_CHUNK_BYTES]
+                for i in range(0, len(encoded), UPLOAD_CHUNK_BYTES)
+            ]
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                decoded = decode_audio_bytes(chunks, extension)
+                timings.append(time.perf_counter() - start)
+
+            bark = ""
+            if model is not None:
+                result = use_model_on_samples(model, feature_extractor, decoded)
+                probability = result["probabilities"]["bark"]
+                if reference is None:
+                    reference = probability
+                bark = f"{probability:.4f} ({probability - reference:+.4f})"
+
+            self.stdout.write(
+                f"{extension:<8}{len(encoded):>12}{len(encoded) / wav_bytes:>9.2f}"
+                f"{1000 * np.median(timings):>12.2f}{bark:>12}"
+            )
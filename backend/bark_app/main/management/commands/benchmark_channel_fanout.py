@@ -0,0 +1,104 @@
+import asyncio
+import multiprocessing
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from main.channel_layers import LocalSocketChannelLayer
+
+GROUP = "fanout_benchmark"
+
+
+def subscriber(socket_dir, consumers, messages, ready, results):
+    """
+    Worker process with several consumers in the benchmark group
+    """
+
+    async def run():
+        layer = LocalSocketChannelLayer(socket_dir=socket_dir)
+        channels = [await layer.new_channel() for _ in range(consumers)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        ready.set()
+
+        async def consume(channel):
+            latencies = []
+            for _ in range(messages):
+                try:
+                    message = await asyncio.wait_for(layer.receive(channel), 5)
+                except asyncio.TimeoutError:
+                    # Dropped messages are reported as missing deliveries
+                    break
+                latencies.append(time.time() - message["sent"])
+            return latencies
+
+        per_channel = await asyncio.gather(*[consume(c) for c in channels])
+        await layer.close()
+        results.put([latency for latencies in per_channel for latency in latencies])
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = (
+        "Broadcast group messages to consumers in several worker processes "
+        "through LocalSocketChannelLayer and report per-message fan-out latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=4)
+        parser.add_argument("--consumers", type=int, default=10)
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--interval", type=float, default=0.005)
+
+    def handle(self, *args, **options):
+        socket_dir = tempfile.mkdtemp(prefix="bark_app_fanout_")
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        readies = []
+        workers = []
+        for _ in range(options["processes"]):
+            ready = context.Event()
+            worker = context.Process(
+                target=subscriber,
+                args=(
+                    socket_dir,
+                    options["consumers"],
+                    options["messages"],
+                    ready,
+                    results,
+                ),
+            )
+            worker.start()
+            readies.append(ready)
+            workers.append(worker)
+        for ready in readies:
+            ready.wait()
+
+        async def publish():
+            layer = LocalSocketChannelLayer(socket_dir=socket_dir)
+            for index in range(options["messages"]):
+                await layer.group_send(
+                    GROUP, {"type": "benchmark", "index": index, "sent": time.time()}
+                )
+                await asyncio.sleep(options["interval"])
+            await layer.close()
+
+        asyncio.run(publish())
+
+        latencies = []
+        for _ in workers:
+            latencies.extend(results.get())
+        for worker in workers:
+            worker.join()
+
+        expected = options["processes"] * options["consumers"] * options["messages"]
+        values = 1000 * np.asarray(latencies)
+        self.stdout.write(f"delivered {len(values)} of {expected} messages")
+        if len(values):
+            self.stdout.write(
+                f"fan-out latency p50={np.percentile(values, 50):.3f}ms "
+                f"p99={np.percentile(values, 99):.3f}ms max={values.max():.3f}ms"
+            )
@@ -0,0 +1,112 @@
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from main.audio import TARGET_SAMPLING_RATE
+from main.clip_archive import CLIP_FORMATS, ClipArchive
+
+
+def percentiles(timings):
+    values = 1000 * np.asarray(timings)
+    return (
+        f"p50={np.percentile(values, 50):.2f}ms p95={np.percentile(values, 95):.2f}ms"
+    )
+
+
+def synthetic_bark(rng, seconds):
+    """
+    A few harmonic bursts with a fast decay over quiet background noise
+    """
+    length = int(seconds * TARGET_SAMPLING_RATE)
+    t = np.arange(length, dtype=np.float32) / TARGET_SAMPLING_RATE
+    clip = 0.01 * rng.standard_normal(length).astype(np.float32)
+    for _ in range(rng.integers(1, 4)):
+        onset = rng.uniform(0, seconds * 0.8)
+        pitch = rng.uniform(300, 900)
+        envelope = np.where(t >= onset, np.exp(-(t - onset) * 12), 0).astype(np.float32)
+        for harmonic in range(1, 5):
+            clip += (
+                0.3
+                / harmonic
+                * envelope
+                * np.sin(2 * np.pi * pitch * harmonic * t).astype(np.float32)
+            )
+    return clip
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive synthetic bark clips and report storage per clip, write "
+        "overhead per request, duplicate writes and range reads per codec"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clips", type=int, default=500)
+        parser.add_argument("--seconds", type=float, default=3.0)
+        parser.add_argument(
+            "--duplicates",
+            type=float,
+            default=0.2,
+            help="Fraction of uploads that repeat an earlier clip",
+        )
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        clips = [
+            synthetic_bark(rng, options["seconds"]) for _ in range(options["clips"])
+        ]
+        uploads = list(range(len(clips)))
+        repeats = int(options["duplicates"] * len(clips))
+        uploads += rng.integers(len(clips), size=repeats).tolist()
+        pcm_bytes = 2 * options["seconds"] * TARGET_SAMPLING_RATE
+
+        self.stdout.write(
+            f"{len(clips)} clips of {options['seconds']:.1f}s, {repeats} repeated "
+            f"uploads; 16-bit PCM = {pcm_bytes / 1024:.0f} KB per clip"
+        )
+        for audio_format in CLIP_FORMATS:
+            archive_dir = tempfile.mkdtemp(prefix="bark_clips_")
+            try:
+                self.run(archive_dir, audio_format, clips, uploads, rng)
+            finally:
+                shutil.rmtree(archive_dir, ignore_errors=True)
+
+    def run(self, archive_dir, audio_format, clips, uploads, rng):
+        archive = ClipArchive(
+            archive_dir, segment_bytes=4 * 1024 * 1024, audio_format=audio_format
+        )
+        new_timings, duplicate_timings = [], []
+        clip_ids = {}
+        for upload in uploads:
+            start = time.perf_counter()
+            clip_id, stored = archive.put(clips[upload], "bark", 0.9, user_id=1)
+            elapsed = time.perf_counter() - start
+            (new_timings if stored else duplicate_timings).append(elapsed)
+            clip_ids[upload] = clip_id
+
+        read_timings = []
+        for upload in rng.integers(len(clips), size=200):
+            record = archive.lookup(bytes.fromhex(clip_ids[upload]))
+            start = time.perf_counter()
+            archive.read(clip_ids[upload], record["length"] // 2, record["length"])
+            read_timings.append(time.perf_counter() - start)
+
+        stats = archive.stats()
+        self.stdout.write(f"\n{audio_format}")
+        self.stdout.write(
+            f"  stored {stats['clips']} clips in {stats['segments']} segments, "
+            f"{stats['bytes_per_clip'] / 1024:.1f} KB per clip "
+            f"({stats['bytes_per_second'] / 1024:.1f} KB/s of audio, "
+            f"{stats['compression_vs_pcm16']:.1f}x smaller than PCM16), "
+            f"index {stats['index_bytes'] / len(archive):.0f} bytes per clip"
+        )
+        self.stdout.write(f"  write of a new clip {percentiles(new_timings)}")
+        if duplicate_timings:
+            self.stdout.write(
+                f"  repeated upload {percentiles(duplicate_timings)}, "
+                f"{stats['duplicates']} not stored again"
+            )
+        self.stdout.write(f"  range read of half a clip {percentiles(read_timings)}")
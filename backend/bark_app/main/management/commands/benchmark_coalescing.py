@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from main.audio import TARGET_SAMPLING_RATE
+from main.coalescing import ClipCoalescer
+from main.management.commands.benchmark_clip_archive import synthetic_bark
+from main.segmentation import MAX_WINDOWS_PER_EVENT
+
+
+class Command(BaseCommand):
+    help = (
+        "Send overlapping clips cut from synthetic recorder streams through the "
+        "clip coalescer and report forward passes avoided, audio deduplicated "
+        "and how well the merged audio matches the stream"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=8)
+        parser.add_argument(
+            "--clips", type=int, default=6, help="Clips per user per episode"
+        )
+        parser.add_argument("--episodes", type=int, default=5)
+        parser.add_argument("--clip-seconds", type=float, default=3.0)
+        parser.add_argument(
+            "--hop-seconds",
+            type=float,
+            default=1.0,
+            help="Time between the starts of consecutive clips of an episode",
+        )
+        parser.add_argument("--window", type=float, default=0.5)
+        parser.add_argument("--max-seconds", type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        clip_length = int(options["clip_seconds"] * TARGET_SAMPLING_RATE)
+        hop = int(options["hop_seconds"] * TARGET_SAMPLING_RATE)
+        stream_seconds = (
+            (options["clips"] - 1) * options["hop_seconds"] + options["clip_seconds"]
+        )
+
+        coalescer = ClipCoalescer(options["window"], options["max_seconds"])
+        scheduled = []
+        lock = threading.Lock()
+
+        def schedule(samples, clips):
+            # Stands in for the model, one batched pass per group
+            with lock:
+                scheduled.append((len(samples), len(clips)))
+            future = Future()
+            future.set_result([{"samples": len(samples)}] * len(clips))
+            return future
+
+        waiters = []
+        start = time.perf_counter()
+        for _ in range(options["episodes"]):
+            streams = [
+                synthetic_bark(rng, stream_seconds) for _ in range(options["users"])
+            ]
+            for index in range(options["clips"]):
+                for user, stream in enumerate(streams):
+                    clip = stream[index * hop : index * hop + clip_length]
+                    waiters.append(coalescer.submit((user, ""), clip, schedule))
+                # Clips of an episode arrive one hop apart, scaled down so the
+                # whole episode fits in one window
+                time.sleep(options["window"] / (2 * options["clips"]))
+            for waiter in waiters:
+                waiter.result()
+        elapsed = time.perf_counter() - start
+
+        stats = coalescer.stats()
+        submitted_seconds = len(waiters) * options["clip_seconds"]
+        merged_seconds = sum(samples for samples, _ in scheduled) / TARGET_SAMPLING_RATE
+        windows_without = len(waiters)
+        windows_with = sum(
+            min(int(np.ceil(samples / TARGET_SAMPLING_RATE)), MAX_WINDOWS_PER_EVENT)
+            for samples, _ in scheduled
+        )
+        episodes = options["episodes"] * options["users"]
+
+        self.stdout.write(
+            f"{stats['requests']} clips of {options['clip_seconds']:.1f}s from "
+            f"{episodes} episodes of {stream_seconds:.1f}s, window "
+            f"{options['window']:.2f}s, {elapsed:.2f}s wall time"
+        )
+        self.stdout.write(
+            f"  forward passes {stats['groups']} instead of {stats['requests']}, "
+            f"{stats['forward_passes_avoided']} avoided "
+            f"({100 * stats['forward_passes_avoided'] / stats['requests']:.0f}%)"
+        )
+        self.stdout.write(
+            f"  audio scored {merged_seconds:.1f}s of {submitted_seconds:.1f}s "
+            f"submitted, {stats['deduplicated_seconds']:.1f}s deduplicated "
+            f"({100 * stats['deduplicated_seconds'] / submitted_seconds:.0f}%)"
+        )
+        self.stdout.write(
+            f"  merged audio per episode {merged_seconds / episodes:.2f}s "
+            f"(stream {stream_seconds:.2f}s)"
+        )
+        self.stdout.write(
+            f"  one-second windows scored {windows_with} instead of "
+            f"{windows_without}; every window of an episode is seen, not only "
+            f"the first second of each clip"
+        )
+
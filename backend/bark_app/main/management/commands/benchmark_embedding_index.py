@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from main.embeddings import EmbeddingIndex
+
+
+def percentiles(timings):
+    values = 1000 * np.asarray(timings)
+    return (
+        f"p50={np.percentile(values, 50):.2f}ms p95={np.percentile(values, 95):.2f}ms "
+        f"max={values.max():.2f}ms"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill an embedding index with synthetic barks from a few simulated dogs "
+        "and measure add and top-k search latency, clustering and deduplication"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=100000)
+        parser.add_argument("--dogs", type=int, default=5)
+        parser.add_argument("--dim", type=int, default=256)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument(
+            "--spread",
+            type=float,
+            default=0.3,
+            help="Noise around each dog's voice, relative to the voice vector",
+        )
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        dim = options["dim"]
+        voices = rng.standard_normal((options["dogs"], dim)).astype(np.float32)
+        voices /= np.linalg.norm(voices, axis=1, keepdims=True)
+        noise_scale = options["spread"] / np.sqrt(dim)
+
+        def bark(dog):
+            return voices[dog] + noise_scale * rng.standard_normal(dim).astype(np.float32)
+
+        index_dir = tempfile.mkdtemp(prefix="bark_embeddings_")
+        try:
+            index = EmbeddingIndex(f"{index_dir}/user")
+
+            dogs = rng.integers(options["dogs"], size=options["events"])
+            add_timings = []
+            clusters = []
+            start = time.perf_counter()
+            for dog in dogs:
+                vector = bark(dog)
+                added = time.perf_counter()
+                _, cluster, _ = index.add(vector)
+                add_timings.append(time.perf_counter() - added)
+                clusters.append(cluster)
+            self.stdout.write(
+                f"indexed {len(index)} barks in {time.perf_counter() - start:.1f}s, "
+                f"add {percentiles(add_timings)}"
+            )
+
+            # Clusters should not mix dogs
+            clusters = np.asarray(clusters)
+            pure = sum(
+                np.bincount(dogs[clusters == cluster]).max()
+                for cluster in np.unique(clusters)
+            )
+            self.stdout.write(
+                f"{len(np.unique(clusters))} clusters for {options['dogs']} dogs, "
+                f"purity {pure / len(dogs):.3f}"
+            )
+
+            search_timings = []
+            for _ in range(options["queries"]):
+                query = bark(rng.integers(options["dogs"]))
+                searched = time.perf_counter()
+                index.search(query, options["k"])
+                search_timings.append(time.perf_counter() - searched)
+            self.stdout.write(f"top-{options['k']} search {percentiles(search_timings)}")
+
+            # Re-sending near-identical copies of recent barks must not grow the
+            # index
+            size = len(index)
+            duplicates = 0
+            for row in rng.integers(size - 100, size, size=options["queries"]):
+                stored = np.asarray(index._vectors[row], dtype=np.float32)
+                copy = stored + 1e-3 * rng.standard_normal(dim).astype(np.float32)
+                duplicates += index.add(copy)[2] == row
+            self.stdout.write(
+                f"re-sent copies recognized: {duplicates}/{options['queries']}, "
+                f"index grew by {len(index) - size}"
+            )
+
+            self.stdout.write(
+                f"index files {index.nbytes / 2**20:.1f} MB, "
+                f"{index.nbytes / len(index):.0f} bytes per bark"
+            )
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
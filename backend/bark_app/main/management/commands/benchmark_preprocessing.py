@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from transformers import Wav2Vec2FeatureExtractor
+
+from main.inference import MODEL_INPUT_SAMPLES, preprocess_samples
+
+
+def feature_extractor_inputs(clips, feature_extractor):
+    """
+    The feature extractor call preprocess_samples replaces
+    """
+    return feature_extractor(
+        clips,
+        sampling_rate=16000,
+        return_tensors="pt",
+        padding=True,
+        truncation=True,
+        max_length=MODEL_INPUT_SAMPLES,
+    )
+
+
+def median_ms(preprocess, clips, feature_extractor, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        preprocess(clips, feature_extractor)
+        timings.append(time.perf_counter() - start)
+    return 1000 * np.median(timings)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time preprocess_samples against the Wav2Vec2 feature extractor (with "
+        "the settings of facebook/wav2vec2-base) on batches of clips and report "
+        "how far their input_values differ"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+        parser.add_argument("--seconds", type=float, default=3.0)
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        feature_extractor = Wav2Vec2FeatureExtractor()
+        samples = int(options["seconds"] * 16000)
+
+        self.stdout.write(
+            f"Median of {options['repeat']} runs, {options['seconds']:.1f}s clips"
+        )
+        self.stdout.write(
+            f"{'batch':>6}{'extractor ms':>14}{'float32 ms':>12}{'speedup':>9}"
+            f"{'max abs diff':>14}"
+        )
+        for batch_size in options["batch_sizes"]:
+            clips = [
+                (0.1 * rng.standard_normal(samples)).astype(np.float32)
+                for _ in range(batch_size)
+            ]
+            reference = median_ms(
+                feature_extractor_inputs, clips, feature_extractor, options["repeat"]
+            )
+            fast = median_ms(
+                preprocess_samples, clips, feature_extractor, options["repeat"]
+            )
+
+            expected = feature_extractor_inputs(clips, feature_extractor)
+            inputs = preprocess_samples(clips, feature_extractor)
+            difference = (
+                (inputs["input_values"] - expected["input_values"].float()).abs().max()
+            )
+            self.stdout.write(
+                f"{batch_size:>6}{reference:>14.3f}{fast:>12.3f}"
+                f"{reference / fast:>8.1f}x{difference.item():>14.2e}"
+            )
@@ -0,0 +1,120 @@
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+from django.core.management.base import BaseCommand
+
+from main.user_heads import UserHeadCache, save_user_head
+
+
+def percentiles(timings):
+    values = 1000 * np.asarray(timings)
+    return (
+        f"p50={np.percentile(values, 50):.3f}ms p95={np.percentile(values, 95):.3f}ms"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Score batches of backbone embeddings from many users through the user "
+        "head cache and report hit rate, head-load latency and the per-batch "
+        "cost of the heads. Like in serving, every batch is one user's."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=5000)
+        parser.add_argument(
+            "--with-head",
+            type=float,
+            default=0.5,
+            help="Fraction of users that have a fine-tuned head",
+        )
+        parser.add_argument(
+            "--budget-heads",
+            type=int,
+            default=500,
+            help="Cache budget, in heads",
+        )
+        parser.add_argument("--batches", type=int, default=2000)
+        parser.add_argument("--batch-size", type=int, default=16)
+        parser.add_argument("--dim", type=int, default=256)
+        parser.add_argument(
+            "--zipf", type=float, default=1.2, help="Skew of user activity"
+        )
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        dim = options["dim"]
+        head_dir = tempfile.mkdtemp(prefix="bark_user_heads_")
+        try:
+            users = rng.permutation(options["users"])
+            with_head = users[: int(options["with_head"] * len(users))]
+            for user_id in with_head.tolist():
+                save_user_head(
+                    user_id,
+                    torch.randn(2, dim),
+                    torch.randn(2),
+                    head_dir=head_dir,
+                )
+            head_bytes = (2 * dim + 2) * 4
+            cache = UserHeadCache(
+                head_dir, max_bytes=options["budget_heads"] * head_bytes
+            )
+            self.stdout.write(
+                f"{len(users)} users, {len(with_head)} with a head of "
+                f"{head_bytes} bytes, cache budget {options['budget_heads']} heads"
+            )
+            self.run(cache, users, with_head, rng, options)
+        finally:
+            shutil.rmtree(head_dir, ignore_errors=True)
+
+    def run(self, cache, users, with_head, rng, options):
+        batch_size = options["batch_size"]
+        logits = torch.randn(batch_size, 2)
+        embeddings = torch.randn(batch_size, options["dim"])
+
+        timings = []
+        personalized = 0
+        ranks = np.minimum(rng.zipf(options["zipf"], options["batches"]), len(users))
+        for user_id in users[ranks - 1].tolist():
+            start = time.perf_counter()
+            with torch.no_grad():
+                _, scored_by_head = cache.personalize(logits, embeddings, user_id)
+            timings.append(time.perf_counter() - start)
+            personalized += batch_size * scored_by_head
+
+        stats = cache.stats()
+        rows_total = options["batches"] * batch_size
+        self.stdout.write(
+            f"  {rows_total} rows in {options['batches']} batches of {batch_size}, "
+            f"{personalized} scored by a user head"
+        )
+        self.stdout.write(
+            f"  hit rate {stats['hit_rate']:.3f} ({stats['hits']} hits, "
+            f"{stats['misses']} loads, {stats['evictions']} evictions, "
+            f"{stats['without_head']} lookups of users without a head)"
+        )
+        self.stdout.write(
+            f"  head load p50={stats['load_ms_p50']:.3f}ms "
+            f"p95={stats['load_ms_p95']:.3f}ms, {stats['heads']} heads resident "
+            f"in {stats['bytes'] / 1024:.0f} KB"
+        )
+        self.stdout.write(f"  heads per batch {percentiles(timings)}")
+
+        # Cost of picking up a retrained head
+        user_id = int(with_head[0])
+        cache.get(user_id)
+        save_user_head(
+            user_id,
+            torch.randn(2, options["dim"]),
+            torch.randn(2),
+            head_dir=cache.head_dir,
+        )
+        start = time.perf_counter()
+        cache.get(user_id)
+        self.stdout.write(
+            f"  retrained head picked up in "
+            f"{1000 * (time.perf_counter() - start):.3f}ms"
+        )
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+
+ENDPOINTS = {
+    "async": "/main/ai/analyze/async/",
+    "sync": "/main/ai/analyze/",
+}
+
+
+def summarize(latencies):
+    if not latencies:
+        return "no samples"
+    values = 1000 * np.asarray(latencies)
+    return (
+        f"n={len(values)} p50={np.percentile(values, 50):.1f}ms "
+        f"p95={np.percentile(values, 95):.1f}ms max={values.max():.1f}ms"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent analyze requests in-process through the ASGI handler "
+        "and measure how responsive the token endpoint stays meanwhile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("audio_path", help="Clip posted to the analyze endpoint")
+        parser.add_argument("--username", required=True)
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--requests", type=int, default=32)
+        parser.add_argument("--probe-interval", type=float, default=0.05)
+        parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="async")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["audio_path"]):
+            raise CommandError(f"File not found: {options['audio_path']}")
+
+        asyncio.run(self.run(options))
+
+    async def obtain_tokens(self, client, options):
+        response = await client.post(
+            "/main/token/",
+            {"username": options["username"], "password": options["password"]},
+            content_type="application/json",
+        )
+        if response.status_code != 200:
+            raise CommandError(f"Could not obtain a token: {response.status_code}")
+        return response.json()
+
+    async def probe_auth(self, client, refresh, latencies, stop):
+        while not stop.is_set():
+            start = time.perf_counter()
+            await client.post(
+                "/main/token/refresh/",
+                {"refresh": refresh},
+                content_type="application/json",
+            )
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(self.probe_interval)
+
+    async def analyze(self, client, access, path, semaphore, latencies, statuses):
+        async with semaphore:
+            with open(self.audio_path, "rb") as f:
+                start = time.perf_counter()
+                response = await client.post(
+                    path,
+                    {"file": f},
+                    headers={"Authorization": f"Bearer {access}"},
+                )
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+    async def run(self, options):
+        self.audio_path = options["audio_path"]
+        self.probe_interval = options["probe_interval"]
+        client = AsyncClient()
+        tokens = await self.obtain_tokens(client, options)
+
+        # Baseline: the token endpoint on an idle server
+        idle = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(self.probe_auth(client, tokens["refresh"], idle, stop))
+        await asyncio.sleep(20 * self.probe_interval)
+        stop.set()
+        await probe
+
+        # The same probe while the analyze endpoint is saturated
+        loaded = []
+        analyze_latencies = []
+        statuses = []
+        stop = asyncio.Event()
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        probe = asyncio.create_task(
+            self.probe_auth(client, tokens["refresh"], loaded, stop)
+        )
+        started = time.perf_counter()
+        await asyncio.gather(
+            *[
+                self.analyze(
+                    client,
+                    tokens["access"],
+                    ENDPOINTS[options["endpoint"]],
+                    semaphore,
+                    analyze_latencies,
+                    statuses,
+                )
+                for _ in range(options["requests"])
+            ]
+        )
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe
+
+        errors = sum(1 for code in statuses if code != 200)
+        self.stdout.write(f"endpoint:            {ENDPOINTS[options['endpoint']]}")
+        self.stdout.write(
+            f"analyze requests:    {len(statuses)} in {elapsed:.2f}s, {errors} errors"
+        )
+        self.stdout.write(f"analyze latency:     {summarize(analyze_latencies)}")
+        self.stdout.write(f"token refresh idle:  {summarize(idle)}")
+        self.stdout.write(f"token refresh load:  {summarize(loaded)}")
@@ -0,0 +1,64 @@
+import csv
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.clip_archive import ClipArchive
+
+MANIFEST_FIELDS = (
+    "clip_id",
+    "segment",
+    "offset",
+    "length",
+    "label",
+    "kind",
+    "bark_probability",
+    "user_id",
+    "created_at",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a manifest of the clip archive for the training loader "
+        "(ai_model/audio_training_guide.py --clip-archive). Clips are read "
+        "straight from the segments, edit the label column to relabel them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--archive-dir", default=settings.AI_CLIP_ARCHIVE_DIR)
+        parser.add_argument(
+            "--output", help="Manifest path, manifest.csv in the archive by default"
+        )
+        parser.add_argument(
+            "--include-uncertain",
+            action="store_true",
+            help="Also export uncertain clips, labeled by their bark probability",
+        )
+
+    def handle(self, *args, **options):
+        archive_dir = options["archive_dir"]
+        if not os.path.exists(os.path.join(archive_dir, "index.bin")):
+            raise CommandError(f"No clip archive in {archive_dir}")
+        output = options["output"] or os.path.join(archive_dir, "manifest.csv")
+        root = os.path.dirname(os.path.abspath(output))
+
+        exported = 0
+        with open(output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+            writer.writeheader()
+            for record in ClipArchive(archive_dir).records():
+                if record["kind"] == "uncertain":
+                    if not options["include_uncertain"]:
+                        continue
+                    is_bark = record["bark_probability"] >= 0.5
+                else:
+                    is_bark = True
+
+                record["segment"] = os.path.relpath(record["segment"], root)
+                record["label"] = "bark" if is_bark else "no_bark"
+                writer.writerow({key: record[key] for key in MANIFEST_FIELDS})
+                exported += 1
+
+        self.stdout.write(f"Exported {exported} clips to {output}")
@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from main.admission import AdmissionController, Overloaded
+
+
+def busy_work(seconds):
+    # Simulated CPU-bound inference
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def percentiles(latencies):
+    if not latencies:
+        return "n=0"
+    values = 1000 * np.asarray(latencies)
+    return (
+        f"n={len(values)} p50={np.percentile(values, 50):.0f}ms "
+        f"p95={np.percentile(values, 95):.0f}ms p99={np.percentile(values, 99):.0f}ms "
+        f"max={values.max():.0f}ms"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Offer more simulated inference work than the workers can handle and "
+        "compare tail latency with and without admission control"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--service-time", type=float, default=0.1)
+        parser.add_argument(
+            "--overload",
+            type=float,
+            default=2.0,
+            help="Offered load as a multiple of the workers' capacity",
+        )
+        parser.add_argument("--duration", type=float, default=10.0)
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--max-queued", type=int, default=8)
+        parser.add_argument("--max-per-user", type=int, default=4)
+        parser.add_argument("--max-wait", type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        capacity = options["workers"] / options["service_time"]
+        rate = options["overload"] * capacity
+        self.stdout.write(
+            f"capacity {capacity:.1f} req/s, offering {rate:.1f} req/s "
+            f"for {options['duration']:.0f}s"
+        )
+
+        for label, controlled in [("without admission", False), ("with admission", True)]:
+            admitted, shed = self.run(options, rate, controlled)
+            self.stdout.write(f"{label}:")
+            self.stdout.write(f"  served: {percentiles(admitted)}")
+            self.stdout.write(f"  shed:   {percentiles(shed)}")
+
+    def run(self, options, rate, controlled):
+        executor = ThreadPoolExecutor(max_workers=options["workers"])
+        limit = 10**9
+        controller = AdmissionController(
+            executor,
+            workers=options["workers"],
+            max_queued=options["max_queued"] if controlled else limit,
+            max_per_user=options["max_per_user"] if controlled else limit,
+            max_estimated_wait=options["max_wait"] if controlled else float(limit),
+            initial_service_time=options["service_time"],
+        )
+
+        admitted = []
+        shed = []
+        lock = threading.Lock()
+        pending = []
+
+        def done(start, future):
+            with lock:
+                admitted.append(time.perf_counter() - start)
+
+        # Open loop: arrivals follow a Poisson process regardless of latency
+        random.seed(0)
+        deadline = time.perf_counter() + options["duration"]
+        next_arrival = time.perf_counter()
+        while next_arrival < deadline:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            start = time.perf_counter()
+            user_id = random.randrange(options["users"])
+            try:
+                future = controller.submit(user_id, busy_work, options["service_time"])
+            except Overloaded:
+                shed.append(time.perf_counter() - start)
+            else:
+                future.add_done_callback(lambda f, start=start: done(start, f))
+                pending.append(future)
+            next_arrival += random.expovariate(rate)
+
+        for future in pending:
+            future.result()
+        executor.shutdown()
+
+        return admitted, shed
@@ -0,0 +1,210 @@
+import os
+import tempfile
+import tracemalloc
+
+import librosa
+import numpy as np
+import soundfile as sf
+import torch
+from django.core.management.base import BaseCommand, CommandError
+from transformers import AutoFeatureExtractor
+
+from main.audio import TARGET_SAMPLING_RATE, decode_audio_file
+from main.inference import (
+    classify_batch,
+    input_buffer,
+    load_model,
+    preprocess_samples,
+)
+
+
+def legacy_stages(audio_path, feature_extractor):
+    """
+    The float64 decode -> downmix -> resample -> feature extractor path
+    """
+    state = {}
+
+    def read():
+        state["audio"], state["sampling_rate"] = sf.read(audio_path)
+
+    def mix():
+        if state["audio"].ndim > 1:
+            state["audio"] = state["audio"].mean(axis=1)
+
+    def resample():
+        if state["sampling_rate"] != TARGET_SAMPLING_RATE:
+            state["audio"] = librosa.resample(
+                state["audio"],
+                orig_sr=state["sampling_rate"],
+                target_sr=TARGET_SAMPLING_RATE,
+            )
+
+    def features():
+        state["inputs"] = feature_extractor(
+            state["audio"],
+            sampling_rate=TARGET_SAMPLING_RATE,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=16000,
+        )
+
+    return state, [
+        ("read", read),
+        ("downmix", mix),
+        ("resample", resample),
+        ("features", features),
+    ]
+
+
+def float32_stages(audio_path, feature_extractor):
+    """
+    The streaming float32 decoder and the reused input buffer
+    """
+    state = {}
+
+    def decode():
+        state["audio"] = decode_audio_file(audio_path)
+
+    def features():
+        state["inputs"] = preprocess_samples(state["audio"], feature_extractor)
+
+    return state, [("decode+mix+resample", decode), ("features", features)]
+
+
+def measure(build_stages, audio_path, feature_extractor):
+    """
+    Run the stages of one clip under tracemalloc
+
+    Returns the final state and, per stage, the traced peak above the memory
+    in use before the stage and the memory it left allocated.
+    """
+    state, stages = build_stages(audio_path, feature_extractor)
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    figures = []
+    try:
+        for name, stage in stages:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            stage()
+            current, peak = tracemalloc.get_traced_memory()
+            figures.append((name, peak - before, current - before, peak - start))
+    finally:
+        tracemalloc.stop()
+
+    return state, figures
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure traced allocations and peak memory per clip of the float64 "
+        "and float32 preprocessing paths and check that they agree"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--audio-path",
+            help="Clip to measure, a 44.1 kHz stereo WAV is generated by default",
+        )
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--with-model",
+            action="store_true",
+            help="Also compare the classifier's predictions on both paths",
+        )
+
+    def handle(self, *args, **options):
+        audio_path = options["audio_path"]
+        generated = None
+        if audio_path is None:
+            rng = np.random.default_rng(0)
+            frames = int(options["seconds"] * 44100)
+            handle, generated = tempfile.mkstemp(suffix=".wav")
+            os.close(handle)
+            sf.write(
+                generated,
+                0.1 * rng.standard_normal((frames, 2)),
+                44100,
+                subtype="PCM_16",
+            )
+            audio_path = generated
+        elif not os.path.exists(audio_path):
+            raise CommandError(f"File not found: {audio_path}")
+
+        try:
+            self.run(audio_path, options)
+        finally:
+            if generated is not None:
+                os.remove(generated)
+
+    def run(self, audio_path, options):
+        model = None
+        if options["with_model"]:
+            model, feature_extractor = load_model()
+        else:
+            feature_extractor = AutoFeatureExtractor.from_pretrained(
+                "facebook/wav2vec2-base"
+            )
+
+        info = sf.info(audio_path)
+        clip_bytes = 4 * int(info.duration * TARGET_SAMPLING_RATE)
+        self.stdout.write(
+            f"{os.path.basename(audio_path)}: {info.duration:.1f}s, {info.samplerate} Hz, "
+            f"{info.channels} channel(s); 16 kHz float32 clip = {clip_bytes / 1024:.0f} KB"
+        )
+
+        states = {}
+        paths = [("float64", legacy_stages), ("float32", float32_stages)]
+        for label, build_stages in paths:
+            # The first run warms up the reused buffers
+            runs = [
+                measure(build_stages, audio_path, feature_extractor)
+                for _ in range(options["repeat"] + 1)
+            ]
+            states[label] = runs[-1][0]
+
+            self.stdout.write(f"\n{label} path (median of {options['repeat']} runs)")
+            self.stdout.write(
+                f"  {'stage':<22}{'peak KB':>10}{'kept KB':>10}{'clip peak KB':>14}"
+            )
+            for index, (name, *_) in enumerate(runs[-1][1]):
+                peak, kept, total = np.median(
+                    [figures[index][1:] for _, figures in runs[1:]], axis=0
+                )
+                self.stdout.write(
+                    f"  {name:<22}{peak / 1024:>10.0f}{kept / 1024:>10.0f}{total / 1024:>14.0f}"
+                )
+            clip_peak = np.median(
+                [max(figure[3] for figure in figures) for _, figures in runs[1:]]
+            )
+            self.stdout.write(
+                f"  peak per clip {clip_peak / 1024:.0f} KB "
+                f"({clip_peak / clip_bytes:.1f}x the decoded clip)"
+            )
+
+        legacy = states["float64"]["inputs"]["input_values"]
+        current = states["float32"]["inputs"]["input_values"]
+        self.stdout.write(
+            "\nTensors allocated by torch are not traced: the float64 path copies "
+            "its features once more into the input tensor"
+        )
+        self.stdout.write(
+            f"float32 input tensor dtype {current.dtype}, backed by the reused "
+            f"input buffer: {current.data_ptr() == input_buffer(1, 1).ctypes.data}"
+        )
+        self.stdout.write(
+            "input_values max abs difference: "
+            f"{(legacy - current).abs().max().item():.2e}"
+        )
+
+        if model is not None:
+            # The float32 tensor lives in this thread's input buffer, so it is
+            # classified before anything else is preprocessed
+            new = classify_batch(model, {"input_values": current})[0]
+            old = classify_batch(model, {"input_values": legacy.to(torch.float32)})[0]
+            self.stdout.write(
+                f"prediction {old['prediction']} vs {new['prediction']}, bark probability "
+                f"{old['probabilities']['bark']:.6f} vs {new['probabilities']['bark']:.6f}"
+            )
@@ -0,0 +1,49 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from main.authentication import USER_CACHE, CachedJWTAuthentication
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare database queries and time per request of the default JWT "
+        "authentication and the cached one used by the analysis views"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", required=True)
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['username']}")
+
+        token = str(AccessToken.for_user(user))
+        request = RequestFactory().post(
+            "/main/ai/analyze/", HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+
+        USER_CACHE.clear()
+        for name, authentication in [
+            ("JWTAuthentication", JWTAuthentication()),
+            ("CachedJWTAuthentication", CachedJWTAuthentication()),
+        ]:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for _ in range(options["requests"]):
+                    authentication.authenticate(request)
+                elapsed = time.perf_counter() - start
+
+            self.stdout.write(
+                f"{name:<24} queries/request={len(queries) / options['requests']:.3f} "
+                f"time/request={1e6 * elapsed / options['requests']:.1f}us"
+            )
@@ -0,0 +1,257 @@
+import csv
+import hashlib
+import io
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+import soundfile as sf
+import torch
+import torch.nn.functional as F
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.embeddings import captured_embeddings, reset_captured_embeddings
+from main.audio import ALLOWED_AUDIO_EXTENSIONS
+from main.inference import load_audio_file, load_model, preprocess_samples
+from main.user_heads import save_user_head
+
+
+def read_manifest(manifest):
+    """
+    Labeled clips per user from an export_clip_archive manifest
+
+    Returns {user_id: [(clip_id, (segment, offset, length), label), ...]}.
+    """
+    root = os.path.dirname(os.path.abspath(manifest))
+    clips = defaultdict(list)
+    with open(manifest, newline="") as f:
+        for row in csv.DictReader(f):
+            user_id = int(row["user_id"])
+            if user_id < 0:
+                continue
+            is_bark = row["label"].strip().lower() in ("1", "bark", "true")
+            source = (
+                os.path.join(root, row["segment"]),
+                int(row["offset"]),
+                int(row["length"]),
+            )
+            clips[user_id].append((row["clip_id"], source, int(is_bark)))
+    return clips
+
+
+def index_negatives(negative_dir):
+    """
+    Recordings under negative_dir, all taken as no_bark
+    """
+    paths = []
+    for root, _, files in os.walk(negative_dir):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in ALLOWED_AUDIO_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def sample_negatives(paths, user_id, count):
+    """
+    A per-user sample of no_bark recordings, as (clip_id, path, 0) clips
+
+    The archive only keeps barks and uncertain clips, so without these a user
+    may have no confident negatives to train on. The sample is the same for
+    every retrain of a user.
+    """
+    rng = np.random.default_rng(user_id)
+    chosen = rng.choice(len(paths), size=min(count, len(paths)), replace=False)
+    clips = []
+    for index in sorted(chosen):
+        clip_id = hashlib.blake2b(paths[index].encode(), digest_size=16).hexdigest()
+        clips.append((clip_id, paths[index], 0))
+    return clips
+
+
+def load_clip(source):
+    if isinstance(source, str):
+        return load_audio_file(source)[0]
+    segment, offset, length = source
+    with open(segment, "rb") as f:
+        f.seek(offset)
+        samples, _ = sf.read(io.BytesIO(f.read(length)), dtype="float32")
+    return samples
+
+
+def backbone_features(model, feature_extractor, clips, batch_size=16):
+    """
+    Pooled backbone embeddings and global logits of decoded clips
+    """
+    embeddings, logits = [], []
+    with torch.no_grad():
+        for start in range(0, len(clips), batch_size):
+            inputs = preprocess_samples(
+                clips[start : start + batch_size], feature_extractor
+            )
+            reset_captured_embeddings()
+            logits.append(model(**inputs).logits)
+            embeddings.append(captured_embeddings().float())
+    return torch.cat(embeddings), torch.cat(logits)
+
+
+def is_holdout(clip_id, fraction):
+    """
+    Deterministic held-out split by content hash, stable across retrains
+    """
+    return int(clip_id[:8], 16) / 0x100000000 < fraction
+
+
+def train_head(classifier, embeddings, labels, epochs, learning_rate, anchor):
+    """
+    Fine-tune a copy of the global classifier on one user's embeddings
+
+    The weights are pulled towards the global ones, so a user with few clips
+    gets a head close to the shared model.
+    """
+    initial_weight = classifier.weight.detach().clone().float()
+    initial_bias = classifier.bias.detach().clone().float()
+    weight = initial_weight.clone().requires_grad_(True)
+    bias = initial_bias.clone().requires_grad_(True)
+    optimizer = torch.optim.AdamW([weight, bias], lr=learning_rate, weight_decay=0.0)
+
+    for _ in range(epochs):
+        logits = embeddings @ weight.T + bias
+        loss = F.cross_entropy(logits, labels) + anchor * (
+            (weight - initial_weight).pow(2).sum() + (bias - initial_bias).pow(2).sum()
+        )
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    return weight.detach(), bias.detach()
+
+
+def accuracy(logits, labels):
+    return float((logits.argmax(dim=-1) == labels).float().mean())
+
+
+class Command(BaseCommand):
+    help = (
+        "Fine-tune a classifier head per user on their labeled clips from a "
+        "clip archive manifest (see export_clip_archive), on top of the shared "
+        "frozen backbone. A head is only saved if it does at least as well as "
+        "the global model on the user's held-out clips. The archive only keeps "
+        "barks and uncertain clips, so no_bark recordings from --negative-dir "
+        "are sampled into every user's training set."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--manifest",
+            default=os.path.join(settings.AI_CLIP_ARCHIVE_DIR, "manifest.csv"),
+        )
+        parser.add_argument("--user-id", type=int, nargs="+")
+        parser.add_argument("--head-dir", default=settings.AI_USER_HEAD_DIR)
+        parser.add_argument(
+            "--negative-dir",
+            help="Recordings without barks, e.g. the no_bark folder of the "
+            "training data",
+        )
+        parser.add_argument(
+            "--negatives-per-user",
+            type=int,
+            help="no_bark recordings sampled per user (default: as many as "
+            "the user has barks)",
+        )
+        parser.add_argument(
+            "--min-clips",
+            type=int,
+            default=20,
+            help="Labeled clips of each class a user needs for a head",
+        )
+        parser.add_argument("--holdout", type=float, default=0.2)
+        parser.add_argument("--epochs", type=int, default=200)
+        parser.add_argument("--learning-rate", type=float, default=1e-2)
+        parser.add_argument(
+            "--anchor",
+            type=float,
+            default=1e-2,
+            help="Strength of the pull towards the global classifier's weights",
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["manifest"]):
+            raise CommandError(f"No manifest at {options['manifest']}")
+        clips_by_user = read_manifest(options["manifest"])
+        if options["user_id"]:
+            clips_by_user = {
+                user_id: clips_by_user.get(user_id, [])
+                for user_id in options["user_id"]
+            }
+
+        negatives = []
+        if options["negative_dir"]:
+            negatives = index_negatives(options["negative_dir"])
+            if not negatives:
+                raise CommandError(f"No recordings in {options['negative_dir']}")
+
+        model, feature_extractor = load_model()
+        self.stdout.write(
+            f"{'user':>8}{'clips':>7}{'barks':>7}{'held out':>9}"
+            f"{'global':>8}{'head':>8}{'train ms':>10}  saved"
+        )
+        for user_id, clips in sorted(clips_by_user.items()):
+            if negatives:
+                count = options["negatives_per_user"]
+                if count is None:
+                    count = sum(label for *_, label in clips)
+                clips = clips + sample_negatives(negatives, user_id, count)
+
+            labels = torch.tensor([label for *_, label in clips], dtype=torch.long)
+            barks = int(labels.sum())
+            if min(barks, len(clips) - barks) < options["min_clips"]:
+                self.stdout.write(
+                    f"{user_id:>8}{len(clips):>7}{barks:>7}  too few clips of a class"
+                )
+                continue
+
+            samples = [load_clip(source) for _, source, _ in clips]
+            embeddings, global_logits = backbone_features(
+                model, feature_extractor, samples
+            )
+            holdout = torch.tensor(
+                [is_holdout(clip_id, options["holdout"]) for clip_id, *_ in clips]
+            )
+            train = ~holdout
+            if not holdout.any() or holdout.all():
+                # Too few clips to split, train and judge on all of them
+                train = holdout = torch.ones(len(clips), dtype=torch.bool)
+
+            start = time.perf_counter()
+            weight, bias = train_head(
+                model.classifier,
+                embeddings[train],
+                labels[train],
+                options["epochs"],
+                options["learning_rate"],
+                options["anchor"],
+            )
+            train_ms = 1000 * (time.perf_counter() - start)
+
+            global_accuracy = accuracy(global_logits[holdout], labels[holdout])
+            head_accuracy = accuracy(
+                embeddings[holdout] @ weight.T + bias, labels[holdout]
+            )
+            saved = head_accuracy >= global_accuracy
+            if saved:
+                save_user_head(
+                    user_id,
+                    weight,
+                    bias,
+                    head_dir=options["head_dir"],
+                    clips=len(clips),
+                    global_accuracy=global_accuracy,
+                    head_accuracy=head_accuracy,
+                )
+            self.stdout.write(
+                f"{user_id:>8}{len(clips):>7}{barks:>7}{int(holdout.sum()):>9}"
+                f"{global_accuracy:>8.3f}{head_accuracy:>8.3f}{train_ms:>10.1f}  "
+                f"{'yes' if saved else 'no'}"
+            )
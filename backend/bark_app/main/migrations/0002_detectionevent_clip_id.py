@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="detectionevent",
+            name="clip_id",
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
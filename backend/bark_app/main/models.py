@@ -1,3 +1,31 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class DetectionEvent(models.Model):
+    """
+    Result of analyzing one uploaded clip
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="detection_events",
+    )
+    prediction = models.CharField(max_length=16)
+    confidence = models.FloatField()
+    bark_probability = models.FloatField()
+    filename = models.CharField(max_length=255, blank=True)
+    file_size = models.BigIntegerField(default=0)
+    # Archived clip of the detection, see main.clip_archive
+    clip_id = models.CharField(max_length=32, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="main_event_user_created_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.prediction} ({self.confidence:.2f}) at {self.created_at}"
@@ -0,0 +1,279 @@
+"""
+On-demand profiling of analysis requests
+
+A staff user can ask for a single analyze request to be profiled by sending an
+``X-Profile: 1`` header or a ``profile=1`` query parameter. The request then
+runs under cProfile, and its inference under the torch profiler as well. The
+wall time of every phase, the slowest Python functions and the slowest torch
+operators are returned with the response and stored under the request ID
+(``X-Request-ID`` when the client sends one), so a slow clip can be looked at
+later through ai/profiles/<request_id>/.
+
+Profiles are kept as a JSON summary and the raw cProfile stats (loadable with
+pstats or snakeviz) in AI_PROFILE_DIR; only the newest AI_PROFILE_MAX_STORED
+are kept.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import torch
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PARAM = "profile"
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+# Client supplied request IDs end up in file names
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Fields of every stored profile listed by ai/profiles/
+PROFILE_LIST_FIELDS = ("request_id", "path", "created_at", "total_ms")
+
+# Only one torch profiler session can run in a process at a time
+_TORCH_PROFILER_LOCK = threading.Lock()
+
+
+def profiling_requested(request):
+    """
+    Whether a staff user asked for this request to be profiled
+    """
+    if not request.user.is_staff:
+        return False
+    value = request.headers.get("X-Profile") or request.GET.get(PROFILE_PARAM, "")
+    return value.lower() in TRUE_VALUES
+
+
+def request_id_for(request):
+    request_id = request.headers.get("X-Request-ID", "")
+    if REQUEST_ID_PATTERN.match(request_id):
+        return request_id
+    return uuid.uuid4().hex
+
+
+def start_profile(request):
+    """
+    Return a RequestProfile if the request should be profiled, else None
+    """
+    if not profiling_requested(request):
+        return None
+    return RequestProfile(request_id_for(request), request.path)
+
+
+def phase(profile, name):
+    """
+    Profile a block as one phase of the request, if it is being profiled
+    """
+    if profile is None:
+        return nullcontext()
+    return profile.phase(name)
+
+
+def profile_path(request_id, extension):
+    if not REQUEST_ID_PATTERN.match(request_id):
+        raise FileNotFoundError(request_id)
+    return os.path.join(settings.AI_PROFILE_DIR, f"{request_id}.{extension}")
+
+
+class RequestProfile:
+    """
+    cProfile and torch profiler figures collected over the phases of a request
+
+    Phases may run on different threads one after another (the upload is
+    decoded on the request thread, inference on the executor), they all add to
+    the same cProfile stats.
+    """
+
+    def __init__(self, request_id, path="", top=None):
+        self.request_id = request_id
+        self.path = path
+        self.top = top or settings.AI_PROFILE_TOP_FUNCTIONS
+        self.created_at = datetime.now()
+        self.phases = []
+        self.operators = None
+        self.notes = []
+        self._profiler = cProfile.Profile()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name, torch_operators=False):
+        start = time.perf_counter()
+        self._profiler.enable()
+        try:
+            if torch_operators:
+                with self._torch_profile():
+                    yield
+            else:
+                yield
+        finally:
+            self._profiler.disable()
+            self.phases.append(
+                {"name": name, "ms": 1000 * (time.perf_counter() - start)}
+            )
+
+    @contextmanager
+    def _torch_profile(self):
+        if not _TORCH_PROFILER_LOCK.acquire(blocking=False):
+            self.notes.append("torch profiler busy with another request")
+            yield
+            return
+        try:
+            with torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU]
+            ) as profiler:
+                yield
+            self.operators = profiler.key_averages()
+        finally:
+            _TORCH_PROFILER_LOCK.release()
+
+    def wrap(self, name, fn):
+        """
+        Return fn profiled as a phase, to be queued on the inference executor
+
+        The time the call spends waiting in the queue is recorded as well.
+        """
+        submitted = time.perf_counter()
+
+        def profiled(*args, **kwargs):
+            self.phases.append(
+                {"name": "queued", "ms": 1000 * (time.perf_counter() - submitted)}
+            )
+            with self.phase(name, torch_operators=True):
+                return fn(*args, **kwargs)
+
+        return profiled
+
+    def function_rows(self, stats, sort_index):
+        rows = []
+        for (filename, line, function), (_, calls, self_time, total_time, _) in (
+            stats.stats.items()
+        ):
+            rows.append(
+                {
+                    "function": f"{os.path.basename(filename)}:{line}({function})",
+                    "calls": calls,
+                    "self_ms": 1000 * self_time,
+                    "cumulative_ms": 1000 * total_time,
+                }
+            )
+        rows.sort(key=lambda row: row[sort_index], reverse=True)
+        return rows[: self.top]
+
+    def operator_rows(self):
+        if self.operators is None:
+            return []
+        rows = [
+            {
+                "operator": event.key,
+                "calls": event.count,
+                "self_cpu_ms": event.self_cpu_time_total / 1000,
+                "cpu_ms": event.cpu_time_total / 1000,
+            }
+            for event in self.operators
+        ]
+        rows.sort(key=lambda row: row["self_cpu_ms"], reverse=True)
+        return rows[: self.top]
+
+    def summary(self, error=None):
+        stats = pstats.Stats(self._profiler)
+        summary = {
+            "request_id": self.request_id,
+            "path": self.path,
+            "created_at": self.created_at.isoformat(),
+            "total_ms": 1000 * (time.perf_counter() - self._start),
+            "phases": self.phases,
+            "functions_by_cumulative": self.function_rows(stats, "cumulative_ms"),
+            "functions_by_self": self.function_rows(stats, "self_ms"),
+            "operators": self.operator_rows(),
+            "notes": self.notes,
+        }
+        if error is not None:
+            summary["error"] = error
+        return summary
+
+    def save(self, error=None):
+        """
+        Store the summary and raw stats under the request ID and return the
+        summary
+        """
+        summary = self.summary(error)
+        try:
+            os.makedirs(settings.AI_PROFILE_DIR, exist_ok=True)
+            self._profiler.dump_stats(profile_path(self.request_id, "prof"))
+            with open(profile_path(self.request_id, "json"), "w") as f:
+                json.dump(summary, f)
+            prune_profiles()
+        except OSError as e:
+            logger.error(f"Could not store profile {self.request_id}: {e}")
+
+        logger.info(
+            f"Profiled {self.path} as {self.request_id}: {summary['total_ms']:.0f}ms"
+        )
+        return summary
+
+
+def prune_profiles(keep=None):
+    """
+    Delete all but the newest ``keep`` stored profiles
+    """
+    keep = settings.AI_PROFILE_MAX_STORED if keep is None else keep
+    summaries = sorted(
+        (
+            entry
+            for entry in os.scandir(settings.AI_PROFILE_DIR)
+            if entry.name.endswith(".json")
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in summaries[keep:]:
+        request_id = entry.name[: -len(".json")]
+        for extension in ("json", "prof"):
+            try:
+                os.remove(profile_path(request_id, extension))
+            except FileNotFoundError:
+                pass
+
+
+def load_profile(request_id):
+    """
+    Return the stored summary of a profiled request
+
+    Raises FileNotFoundError for unknown request IDs.
+    """
+    with open(profile_path(request_id, "json")) as f:
+        return json.load(f)
+
+
+def list_profiles():
+    """
+    Request ID, path, time and duration of the stored profiles, newest first
+    """
+    try:
+        entries = [
+            entry
+            for entry in os.scandir(settings.AI_PROFILE_DIR)
+            if entry.name.endswith(".json")
+        ]
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries:
+        try:
+            summary = load_profile(entry.name[: -len(".json")])
+        except (OSError, ValueError):
+            continue
+        profiles.append({key: summary.get(key) for key in PROFILE_LIST_FIELDS})
+    return profiles
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import DetectionConsumer
+
+websocket_urlpatterns = [
+    path("ws/detections/", DetectionConsumer.as_asgi()),
+]
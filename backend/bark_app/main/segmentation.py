@@ -0,0 +1,168 @@
+"""
+Onset segmentation of long recordings
+
+A frame energy envelope is computed for the whole recording with vectorized
+NumPy operations. Regions that rise clearly above the estimated noise floor
+become candidate sound events, so the classifier only has to look at a small
+fraction of an hours-long recording.
+"""
+
+import numpy as np
+
+# 25 ms frames with a 10 ms hop at 16 kHz
+FRAME_LENGTH = 400
+HOP_LENGTH = 160
+
+# An event starts this far above the noise floor and lasts while the
+# envelope stays above the (lower) release level
+ONSET_THRESHOLD_DB = 12.0
+RELEASE_THRESHOLD_DB = 6.0
+
+# Envelope level that is always treated as silence, whatever the noise floor
+ABSOLUTE_FLOOR_DB = -60.0
+
+MIN_EVENT_SECONDS = 0.08
+MERGE_GAP_SECONDS = 0.25
+EVENT_PADDING_SECONDS = 0.1
+
+# The classifier looks at one second of audio at a time
+WINDOW_SECONDS = 1.0
+MAX_WINDOWS_PER_EVENT = 10
+
+
+def energy_envelope(samples, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH):
+    """
+    Return the per-frame energy of a mono signal in dB
+    """
+    if len(samples) < frame_length:
+        samples = np.pad(samples, (0, frame_length - len(samples)))
+
+    # Strided view over the signal, no frame copies are made
+    frames = np.lib.stride_tricks.sliding_window_view(samples, frame_length)[
+        ::hop_length
+    ]
+    energy = np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / frame_length
+
+    return 10.0 * np.log10(energy + 1e-10)
+
+
+def _runs(mask):
+    """
+    Return (starts, ends) of the runs of True in a boolean array
+    """
+    edges = np.diff(mask.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts, ends
+
+
+def detect_events(
+    samples,
+    sampling_rate=16000,
+    onset_threshold_db=ONSET_THRESHOLD_DB,
+    release_threshold_db=RELEASE_THRESHOLD_DB,
+    min_event_seconds=MIN_EVENT_SECONDS,
+    merge_gap_seconds=MERGE_GAP_SECONDS,
+    padding_seconds=EVENT_PADDING_SECONDS,
+):
+    """
+    Find candidate sound events in a long recording
+
+    Returns an (n, 2) array of [start, end) sample indices.
+    """
+    envelope = energy_envelope(samples)
+    if len(envelope) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    # Robust noise floor estimate from the quieter part of the recording
+    noise_floor = np.percentile(envelope, 20)
+    onset_level = max(noise_floor + onset_threshold_db, ABSOLUTE_FLOOR_DB)
+    release_level = max(noise_floor + release_threshold_db, ABSOLUTE_FLOOR_DB)
+
+    # Hysteresis: keep the regions above the release level that contain at
+    # least one frame above the onset level
+    starts, ends = _runs(envelope > release_level)
+    if len(starts) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    # Frames between runs are below the release level, so they cannot raise
+    # the maximum of the span that reduceat takes for each run
+    peaks = np.maximum.reduceat(envelope, starts)
+    keep = peaks > onset_level
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    frames_per_second = sampling_rate / HOP_LENGTH
+
+    # Merge events separated by short gaps
+    gaps = starts[1:] - ends[:-1]
+    split = np.flatnonzero(gaps > merge_gap_seconds * frames_per_second)
+    starts = starts[np.concatenate(([0], split + 1))]
+    ends = ends[np.concatenate((split, [len(ends) - 1]))]
+
+    # Drop clicks that are too short to be a bark
+    keep = (ends - starts) >= min_event_seconds * frames_per_second
+    starts, ends = starts[keep], ends[keep]
+
+    padding = int(padding_seconds * sampling_rate)
+    start_samples = np.maximum(starts * HOP_LENGTH - padding, 0)
+    end_samples = np.minimum(
+        (ends - 1) * HOP_LENGTH + FRAME_LENGTH + padding, len(samples)
+    )
+
+    return np.stack([start_samples, end_samples], axis=1).astype(np.int64)
+
+
+def window_offsets(events, total, window, max_windows_per_event=MAX_WINDOWS_PER_EVENT):
+    """
+    Start of every classifier window of ``window`` samples for the events
+
+    Returns (offsets, owners), where owners maps each window to its event.
+    """
+    offsets = []
+    owners = []
+    for index, (start, end) in enumerate(events):
+        length = end - start
+        if length <= window:
+            centre = (start + end) // 2
+            window_starts = [centre - window // 2]
+        else:
+            count = min(int(np.ceil(length / window)), max_windows_per_event)
+            window_starts = np.linspace(start, end - window, count).astype(np.int64)
+        for window_start in window_starts:
+            offsets.append(min(max(int(window_start), 0), total - window))
+            owners.append(index)
+
+    return np.asarray(offsets, dtype=np.int64), np.asarray(owners, dtype=np.int64)
+
+
+def event_windows(
+    samples,
+    events,
+    sampling_rate=16000,
+    window_seconds=WINDOW_SECONDS,
+    max_windows_per_event=MAX_WINDOWS_PER_EVENT,
+):
+    """
+    Cut classifier windows out of the recording for every event
+
+    Short events are centred in a full window of surrounding audio, long
+    events are covered by consecutive windows. Every window has the same
+    length (unless the recording itself is shorter), so they can be scored in
+    a single batch without padding.
+
+    Returns (windows, owners), where owners maps each window to its event.
+    """
+    window = min(int(window_seconds * sampling_rate), len(samples))
+    offsets, owners = window_offsets(
+        events, len(samples), window, max_windows_per_event
+    )
+
+    if not len(offsets):
+        return np.empty((0, window), dtype=np.float32), owners
+
+    # Views into the original signal, gathered in one copy
+    strided = np.lib.stride_tricks.sliding_window_view(samples, window)
+    windows = strided[offsets]
+
+    return windows, owners
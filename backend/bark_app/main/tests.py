@@ -1,3 +1,1159 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import librosa
+import numpy as np
+import soundfile as sf
+import torch
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from transformers import (
+    Wav2Vec2Config,
+    Wav2Vec2FeatureExtractor,
+    Wav2Vec2ForSequenceClassification,
+)
+
+from . import clip_archive, coalescing, embeddings, inference, user_heads, views
+from .admission import AdmissionController, Overloaded
+from .authentication import USER_CACHE, CachedJWTAuthentication
+from .audio import AudioDecodeError, AudioLimitExceeded, decode_audio_bytes
+from .channel_layers import SOCKET_SUFFIX, LocalSocketChannelLayer
+from .coalescing import ClipCoalescer
+from .embeddings import BARK_INDEX_FIELDS, capture_pooled_embeddings
+from .event_log import BufferedEventWriter
+from .live import publish_detection
+from .management.commands.train_user_heads import sample_negatives
+from .models import DetectionEvent
+from .views import parse_byte_range
+from .routing import websocket_urlpatterns
+from .segmentation import MAX_WINDOWS_PER_EVENT, detect_events, event_windows
+from .user_heads import UserHeadCache, save_user_head
+
+
+def tiny_model():
+    """
+    Randomly initialized wav2vec2 classifier small enough to run in tests
+    """
+    config = Wav2Vec2Config(
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        conv_dim=(32,) * 7,
+        num_labels=2,
+        id2label={0: "no_bark", 1: "bark"},
+        label2id={"no_bark": 0, "bark": 1},
+    )
+    torch.manual_seed(0)
+    model = Wav2Vec2ForSequenceClassification(config).eval()
+    capture_pooled_embeddings(model)
+    return model
+
+
+class ShortInputStudent(torch.nn.Module):
+    """
+    Stand-in for the exported student CNN, which likewise cannot score input
+    much shorter than a second
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv1d(1, 2, kernel_size=4000, stride=1000)
+
+    def forward(self, input_values):
+        return self.conv(input_values.unsqueeze(1)).mean(dim=-1)
+
+
+def noise(seconds, seed, level=0.3):
+    rng = np.random.default_rng(seed)
+    return (level * rng.standard_normal(int(16000 * seconds))).astype(np.float32)
+
+
+def wav_upload(samples, name="clip.wav"):
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, 16000, format="WAV", subtype="PCM_16")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="audio/wav")
+
+
+def encode(samples, sampling_rate, format, subtype):
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sampling_rate, format=format, subtype=subtype)
+    return buffer.getvalue()
+
+
+def chunked(data, chunk_size):
+    for start in range(0, len(data), chunk_size):
+        yield data[start : start + chunk_size]
+
+
+class TinyModelMixin:
+    """
+    Serve a tiny model instead of the trained one, with the analysis side
+    effects pointed at a temporary directory
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.work_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.work_dir, ignore_errors=True)
+        cls.enterClassContext(
+            mock.patch.multiple(
+                inference,
+                MODEL=tiny_model(),
+                FEATURE_EXTRACTOR=Wav2Vec2FeatureExtractor(),
+            )
+        )
+        cls.enterClassContext(
+            override_settings(
+                AI_EMBEDDING_INDEX_DIR=cls.work_dir,
+                AI_COALESCE_WINDOW=0,
+                AI_CLIP_ARCHIVE_ENABLED=False,
+                AI_USER_HEADS_ENABLED=False,
+            )
+        )
+        cls.enterClassContext(
+            mock.patch.object(
+                embeddings,
+                "EMBEDDING_INDEXES",
+                embeddings.EmbeddingIndexRegistry(cls.work_dir),
+            )
+        )
+        cls.enterClassContext(mock.patch("main.views.EVENT_LOG"))
+
+
+class StreamingAudioDecoderTests(SimpleTestCase):
+    FORMATS = [
+        ("WAV", "PCM_16", ".wav"),
+        ("WAV", "PCM_24", ".wav"),
+        ("WAV", "FLOAT", ".wav"),
+        ("FLAC", "PCM_16", ".flac"),
+        ("OGG", "VORBIS", ".ogg"),
+    ]
+
+    def reference(self, data, sampling_rate):
+        samples, _ = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+        samples = samples.mean(axis=1)
+        if sampling_rate != 16000:
+            samples = librosa.resample(
+                samples, orig_sr=sampling_rate, target_sr=16000, res_type="soxr_hq"
+            )
+        return samples
+
+    def test_matches_soundfile_and_librosa(self):
+        rng = np.random.default_rng(20)
+        for format, subtype, extension in self.FORMATS:
+            for sampling_rate in (16000, 44100):
+                for channels in (1, 2):
+                    samples = 0.3 * rng.standard_normal(
+                        (int(0.6 * sampling_rate), channels)
+                    )
+                    data = encode(samples, sampling_rate, format, subtype)
+                    expected = self.reference(data, sampling_rate)
+                    # Small chunks split the headers at arbitrary points
+                    for chunk_size in (3, 37, 4096):
+                        with self.subTest(
+                            subtype=subtype,
+                            sampling_rate=sampling_rate,
+                            channels=channels,
+                            chunk_size=chunk_size,
+                        ):
+                            decoded = decode_audio_bytes(
+                                chunked(data, chunk_size), extension
+                            )
+                            self.assertEqual(decoded.dtype, np.float32)
+                            np.testing.assert_allclose(decoded, expected, atol=1e-6)
+
+    def test_truncated_header(self):
+        data = encode(noise(1, 21), 16000, "WAV", "PCM_16")
+        for extension, length in ((".wav", 30), (".flac", 30), (".wav", 0)):
+            with self.subTest(extension=extension, length=length):
+                with self.assertRaises(AudioDecodeError):
+                    decode_audio_bytes(chunked(data[:length], 7), extension)
+
+    def test_truncated_data(self):
+        data = encode(noise(1, 22), 16000, "WAV", "PCM_16")
+        # Half a frame at the end is dropped, like soundfile does
+        truncated = data[: len(data) - 4001]
+        decoded = decode_audio_bytes(chunked(truncated, 4096), ".wav")
+        expected, _ = sf.read(io.BytesIO(truncated), dtype="float32")
+        np.testing.assert_array_equal(decoded, expected)
+
+    def test_duration_limit(self):
+        for format, subtype, extension in self.FORMATS:
+            data = encode(noise(3, 23), 16000, format, subtype)
+            with self.subTest(subtype=subtype):
+                with self.assertRaises(AudioLimitExceeded):
+                    decode_audio_bytes(chunked(data, 4096), extension, max_duration=2)
+                decoded = decode_audio_bytes(
+                    chunked(data, 4096), extension, max_duration=3
+                )
+                self.assertEqual(len(decoded), 3 * 16000)
+
+
+@override_settings(AUDIO_UPLOAD_MAX_BYTES=64 * 1024, AUDIO_MAX_DURATION_SECONDS=2)
+class UploadLimitTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", password="secret")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, name, data):
+        upload = SimpleUploadedFile(name, data, content_type="application/octet-stream")
+        return self.client.post("/main/ai/analyze/", {"file": upload})
+
+    def test_oversize_upload(self):
+        # A second of 48 kHz stereo float32 is 384 KB
+        samples = np.stack([noise(3, 24)] * 2, axis=1)
+        data = encode(samples, 48000, "WAV", "FLOAT")
+        response = self.post("clip.wav", data)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("size", response.json()["error"])
+
+    def test_too_long_upload(self):
+        data = encode(noise(3, 25, level=0.01), 8000, "FLAC", "PCM_16")
+        self.assertLess(len(data), 64 * 1024)
+        response = self.post("clip.flac", data)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("duration", response.json()["error"])
+
+    def test_truncated_upload(self):
+        data = encode(noise(1, 26), 16000, "WAV", "PCM_16")
+        response = self.post("clip.wav", data[:30])
+        self.assertEqual(response.status_code, 400)
+
+
+class SegmentationTests(SimpleTestCase):
+    def recording(self, seconds, bursts, seed=30):
+        """
+        Quiet background noise with loud noise bursts at (start, end) seconds
+        """
+        samples = noise(seconds, seed, level=0.01)
+        rng = np.random.default_rng(seed + 1)
+        for start, end in bursts:
+            start, end = int(start * 16000), int(end * 16000)
+            samples[start:end] += 0.5 * rng.standard_normal(end - start)
+        return samples
+
+    def test_silence(self):
+        silence = np.zeros(5 * 16000, dtype=np.float32)
+        self.assertEqual(detect_events(silence).shape, (0, 2))
+        self.assertEqual(detect_events(self.recording(5, [])).shape, (0, 2))
+
+    def test_single_burst(self):
+        events = detect_events(self.recording(5, [(2.0, 2.3)]))
+        self.assertEqual(events.shape, (1, 2))
+        start, end = events[0] / 16000
+        # Padded by EVENT_PADDING_SECONDS plus at most a frame on either side
+        self.assertTrue(1.85 <= start <= 2.0, start)
+        self.assertTrue(2.3 <= end <= 2.45, end)
+
+    def test_click_is_dropped(self):
+        self.assertEqual(detect_events(self.recording(5, [(2.0, 2.02)])).shape, (0, 2))
+
+    def test_adjacent_events_merge(self):
+        events = detect_events(self.recording(5, [(2.0, 2.3), (2.45, 2.7)]))
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0, 0] <= 2.0 * 16000 and events[0, 1] >= 2.7 * 16000)
+
+        events = detect_events(self.recording(5, [(1.0, 1.3), (3.0, 3.3)]))
+        self.assertEqual(len(events), 2)
+
+    def test_events_at_the_edges(self):
+        samples = self.recording(5, [(0.0, 0.2), (4.8, 5.0)])
+        events = detect_events(samples)
+        self.assertEqual(events[0, 0], 0)
+        self.assertEqual(events[-1, 1], len(samples))
+
+        windows, owners = event_windows(samples, events)
+        self.assertEqual(windows.shape, (2, 16000))
+        self.assertEqual(owners.tolist(), [0, 1])
+        # Windows are moved inside the recording rather than cut short
+        np.testing.assert_array_equal(windows[0], samples[:16000])
+        np.testing.assert_array_equal(windows[1], samples[-16000:])
+
+    def test_event_windows(self):
+        samples = self.recording(60, [])
+        events = np.array([[32000, 36000], [48000, 96000], [160000, 800000]])
+        windows, owners = event_windows(samples, events)
+
+        self.assertEqual(windows.shape[1], 16000)
+        counts = np.bincount(owners).tolist()
+        self.assertEqual(counts, [1, 3, MAX_WINDOWS_PER_EVENT])
+        # A short event is centred in its window
+        np.testing.assert_array_equal(windows[0], samples[26000:42000])
+        # A long one is covered from its start to its end
+        np.testing.assert_array_equal(windows[1], samples[48000:64000])
+        np.testing.assert_array_equal(windows[3], samples[80000:96000])
+
+    def test_recording_shorter_than_a_window(self):
+        samples = self.recording(0.5, [(0.1, 0.3)])
+        windows, owners = event_windows(samples, detect_events(samples))
+        self.assertEqual(windows.shape, (1, len(samples)))
+        self.assertEqual(owners.tolist(), [0])
+
+        windows, owners = event_windows(samples, np.empty((0, 2), dtype=np.int64))
+        self.assertEqual(windows.shape, (0, len(samples)))
+
+
+class BenchmarkAudioFormatsTests(TinyModelMixin, SimpleTestCase):
+    def test_runs_with_model(self):
+        path = os.path.join(self.work_dir, "reference.wav")
+        sf.write(path, noise(1, 35), 16000)
+        output = io.StringIO()
+        call_command(
+            "benchmark_audio_formats",
+            path,
+            "--repeat",
+            "1",
+            "--with-model",
+            stdout=output,
+        )
+
+        rows = {line.split()[0]: line for line in output.getvalue().splitlines()[1:]}
+        self.assertEqual(rows.keys(), {".wav", ".flac", ".ogg", ".opus", ".webm"})
+        # The variants soundfile encodes were scored, relative to the WAV one
+        self.assertIn("(+0.0000)", rows[".wav"])
+        for extension in (".flac", ".ogg", ".opus"):
+            self.assertIn("(", rows[extension])
+
+
+class AsyncAnalyzeTests(TinyModelMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", password="secret")
+
+    def setUp(self):
+        self.headers = {
+            "Authorization": f"Bearer {RefreshToken.for_user(self.user).access_token}"
+        }
+
+    async def test_event_loop_stays_responsive_during_inference(self):
+        analyze_samples = coalescing.analyze_samples
+        inference_seconds = 0.3
+
+        def slow_analyze_samples(*args, **kwargs):
+            time.sleep(inference_seconds)
+            return analyze_samples(*args, **kwargs)
+
+        lags = []
+        done = asyncio.Event()
+
+        async def ticker():
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+
+        async def post(seed):
+            return await self.async_client.post(
+                "/main/ai/analyze/async/",
+                {"file": wav_upload(noise(1, seed))},
+                headers=self.headers,
+            )
+
+        with mock.patch.object(coalescing, "analyze_samples", slow_analyze_samples):
+            ticks = asyncio.create_task(ticker())
+            responses = await asyncio.gather(*[post(seed) for seed in range(4)])
+            done.set()
+            await ticks
+
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        for response in responses:
+            self.assertIn(response.json()["prediction"], ("bark", "no_bark"))
+        # Inference blocking the loop would stall it for inference_seconds
+        self.assertLess(max(lags), inference_seconds / 2)
+
+    async def test_response_matches_sync_view(self):
+        response = await self.async_client.post(
+            "/main/ai/analyze/async/",
+            {"file": wav_upload(noise(1, 11))},
+            headers=self.headers,
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+        sync_response = await asyncio.to_thread(
+            client.post, "/main/ai/analyze/", {"file": wav_upload(noise(1, 12))}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sync_response.status_code, 200)
+        # Only barks carry the embedding index fields
+        fields = response.json().keys() - set(BARK_INDEX_FIELDS)
+        sync_fields = sync_response.json().keys() - set(BARK_INDEX_FIELDS)
+        self.assertEqual(fields, sync_fields)
+
+    async def test_rejects_missing_token(self):
+        response = await self.async_client.post(
+            "/main/ai/analyze/async/", {"file": wav_upload(noise(1, 10))}
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", password="secret")
+
+    def setUp(self):
+        USER_CACHE.clear()
+        self.addCleanup(USER_CACHE.clear)
+        self.authentication = CachedJWTAuthentication()
+
+    def validated_token(self):
+        return self.authentication.get_validated_token(
+            str(AccessToken.for_user(self.user))
+        )
+
+    def test_cached_user_skips_query(self):
+        token = self.validated_token()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authentication.get_user(token), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authentication.get_user(token), self.user)
+
+    def test_deactivated_user_is_invalidated(self):
+        token = self.validated_token()
+        self.authentication.get_user(token)
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertIsNone(USER_CACHE.get(str(self.user.pk)))
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.get_user(token)
+
+    def test_deleted_user_is_invalidated(self):
+        token = self.validated_token()
+        self.authentication.get_user(token)
+
+        User.objects.filter(pk=self.user.pk).delete()
+
+        self.assertIsNone(USER_CACHE.get(str(self.user.pk)))
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.get_user(token)
+
+    def test_cache_is_bypassed_with_revocation_check(self):
+        with mock.patch.object(api_settings, "CHECK_REVOKE_TOKEN", True):
+            token = self.validated_token()
+            for _ in range(2):
+                with self.assertNumQueries(1):
+                    self.assertEqual(self.authentication.get_user(token), self.user)
+
+        self.assertIsNone(USER_CACHE.get(str(self.user.pk)))
+
+
+class BufferedEventWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("owner", password="secret")
+        self.writer = BufferedEventWriter(
+            batch_size=10, flush_interval=60, max_buffer=100
+        )
+        # Flushed by the test instead of the writer thread
+        self.writer._start = lambda: None
+
+    def record(self, count, confidence=0.9):
+        result = {
+            "prediction": "bark",
+            "confidence": confidence,
+            "probabilities": {"bark": 0.9, "no_bark": 0.1},
+        }
+        for _ in range(count):
+            self.writer.record(self.user.pk, result, "clip.wav", 1000)
+
+    def test_flush_writes_batch(self):
+        self.record(25)
+        self.writer.flush()
+        self.assertEqual(DetectionEvent.objects.count(), 25)
+        self.assertEqual(self.writer.stats()["buffer_depth"], 0)
+
+    def test_rejected_row_is_dropped_alone(self):
+        self.record(3)
+        self.record(1, confidence=None)
+        self.record(3)
+        self.writer.flush()
+
+        self.assertEqual(DetectionEvent.objects.count(), 6)
+        stats = self.writer.stats()
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["written"], 6)
+        self.assertEqual(stats["buffer_depth"], 0)
+
+    def test_events_are_kept_while_database_is_unavailable(self):
+        self.record(5)
+        with mock.patch.object(
+            DetectionEvent.objects, "bulk_create", side_effect=OperationalError
+        ):
+            self.writer.flush()
+        self.assertEqual(self.writer.stats()["buffer_depth"], 5)
+
+        self.writer.flush()
+        self.assertEqual(DetectionEvent.objects.count(), 5)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def controller(self, workers=1, **limits):
+        executor = ThreadPoolExecutor(max_workers=workers)
+        self.addCleanup(executor.shutdown)
+        limits = dict(
+            dict(max_queued=10, max_per_user=10, max_estimated_wait=60.0), **limits
+        )
+        return AdmissionController(executor, workers=workers, **limits)
+
+    def blocked(self, controller, user_id, count):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        for _ in range(count):
+            controller.submit(user_id, release.wait)
+        return release
+
+    def test_sheds_user_over_limit(self):
+        controller = self.controller(workers=3, max_per_user=2)
+        self.blocked(controller, 1, 2)
+
+        with self.assertRaises(Overloaded) as shed:
+            controller.submit(1, time.sleep, 0)
+        self.assertEqual(shed.exception.status_code, 429)
+        self.assertGreaterEqual(shed.exception.retry_after, 1)
+        # Other users are still admitted
+        controller.submit(2, time.sleep, 0).result()
+
+    def test_sheds_when_queue_is_full(self):
+        controller = self.controller(max_queued=2)
+        self.blocked(controller, 1, 3)
+
+        with self.assertRaises(Overloaded) as shed:
+            controller.submit(2, time.sleep, 0)
+        self.assertEqual(shed.exception.status_code, 503)
+        self.assertEqual(controller.stats()["shed_overload"], 1)
+
+    def test_sheds_when_estimated_wait_is_too_long(self):
+        controller = self.controller(max_estimated_wait=1.0)
+        controller.service_time = 2.0
+        self.blocked(controller, 1, 1)
+
+        with self.assertRaises(Overloaded) as shed:
+            controller.submit(2, time.sleep, 0)
+        self.assertEqual(shed.exception.status_code, 503)
+        self.assertEqual(shed.exception.retry_after, 2)
+
+    def test_served_latency_stays_bounded_under_overload(self):
+        workers, service_time = 2, 0.05
+        controller = self.controller(workers=workers, max_queued=4)
+        controller.service_time = service_time
+
+        latencies = []
+        futures = []
+        shed = 0
+        for request in range(40):
+            start = time.perf_counter()
+            try:
+                future = controller.submit(request % 10, time.sleep, service_time)
+            except Overloaded:
+                shed += 1
+                continue
+            future.add_done_callback(
+                lambda _, start=start: latencies.append(time.perf_counter() - start)
+            )
+            futures.append(future)
+        for future in futures:
+            future.result()
+
+        self.assertGreater(shed, 0)
+        self.assertEqual(len(latencies) + shed, 40)
+        # Without admission the last of 40 requests would wait 20 service times
+        self.assertLess(max(latencies), 8 * service_time)
+        stats = controller.stats()
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["users_in_flight"], 0)
+
+
+class OverloadedResponseTests(TinyModelMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", password="secret")
+
+    def test_shed_request_gets_retry_after(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        controller = AdmissionController(
+            executor, workers=1, max_queued=0, max_per_user=0, max_estimated_wait=1.0
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with mock.patch.object(
+            coalescing, "get_admission_controller", return_value=controller
+        ):
+            response = client.post(
+                "/main/ai/analyze/", {"file": wav_upload(noise(1, 20))}
+            )
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(response.json()["retry_after"], 1)
+
+
+class LocalSocketChannelLayerTests(SimpleTestCase):
+    """
+    Layers sharing a socket directory stand in for separate worker processes
+    """
+
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.socket_dir, ignore_errors=True)
+
+    def layers(self, count):
+        return [
+            LocalSocketChannelLayer(socket_dir=self.socket_dir) for _ in range(count)
+        ]
+
+    async def close(self, layers):
+        for layer in layers:
+            await layer.flush()
+
+    async def test_group_send_reaches_members_in_every_process(self):
+        layers = self.layers(3)
+        channels = []
+        for layer in layers:
+            channel = await layer.new_channel()
+            await layer.group_add("detections_1", channel)
+            channels.append(channel)
+
+        await layers[0].group_send("detections_1", {"type": "detection.event"})
+
+        for layer, channel in zip(layers, channels):
+            message = await asyncio.wait_for(layer.receive(channel), timeout=2)
+            self.assertEqual(message["type"], "detection.event")
+        self.assertEqual(layers[0].stats()["sent"], 3)
+        await self.close(layers)
+
+    async def test_group_send_skips_other_groups(self):
+        sender, receiver = self.layers(2)
+        await sender.new_channel()
+        channel = await receiver.new_channel()
+        await receiver.group_add("detections_2", channel)
+
+        await sender.group_send("detections_1", {"type": "detection.event"})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(receiver.receive(channel), timeout=0.2)
+        await self.close([sender, receiver])
+
+    async def test_send_to_channel_of_another_process(self):
+        sender, receiver = self.layers(2)
+        channel = await receiver.new_channel()
+
+        await sender.send(channel, {"type": "hello", "value": 1})
+
+        message = await asyncio.wait_for(receiver.receive(channel), timeout=2)
+        self.assertEqual(message, {"type": "hello", "value": 1})
+        await self.close([sender, receiver])
+
+    async def test_socket_of_dead_process_is_removed(self):
+        (layer,) = self.layers(1)
+        await layer.new_channel()
+        stale = os.path.join(self.socket_dir, "dead" + SOCKET_SUFFIX)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as dead:
+            dead.bind(stale)
+
+        await layer.group_send("detections_1", {"type": "detection.event"})
+
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(layer.stats()["peers"], 1)
+        await self.close([layer])
+
+
+class DetectionConsumerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", password="secret")
+
+    def setUp(self):
+        socket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, socket_dir, ignore_errors=True)
+        layers = override_settings(
+            CHANNEL_LAYERS={
+                "default": {
+                    "BACKEND": "main.channel_layers.LocalSocketChannelLayer",
+                    "CONFIG": {"socket_dir": socket_dir},
+                }
+            }
+        )
+        layers.enable()
+        self.addCleanup(layers.disable)
+
+    def communicator(self, token):
+        return WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/detections/?token={token}"
+        )
+
+    async def test_dashboard_receives_published_detection(self):
+        token = RefreshToken.for_user(self.user).access_token
+        communicator = self.communicator(token)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        result = {
+            "prediction": "bark",
+            "confidence": 0.97,
+            "probabilities": {"bark": 0.97, "no_bark": 0.03},
+        }
+        await publish_detection(
+            self.user.pk, result, "clip.wav", "2025-01-01T00:00:00"
+        )
+
+        event = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(event["prediction"], "bark")
+        self.assertEqual(event["filename"], "clip.wav")
+        await communicator.disconnect()
+        await get_channel_layer().flush()
+
+    async def test_rejects_invalid_token(self):
+        communicator = self.communicator("not-a-token")
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+
+class FixedExitHeads(torch.nn.Module):
+    """
+    Stand-in for the exported early-exit heads, with one head after layer 1
+    that gives fixed logits per row
+    """
+
+    exit_layers = [1]
+
+    def __init__(self, logits):
+        super().__init__()
+        self.logits = logits
+
+    def forward(self, hidden_states, index):
+        return self.logits[: len(hidden_states)]
+
+
+class EarlyExitTests(TinyModelMixin, SimpleTestCase):
+    def setUp(self):
+        clips = [noise(1, 80 + row) for row in range(3)]
+        self.inputs = inference.preprocess_samples(clips, inference.FEATURE_EXTRACTOR)
+        with torch.no_grad():
+            self.expected = torch.softmax(inference.MODEL(**self.inputs).logits, dim=-1)
+        # Confident no_bark, unsure, confident bark
+        self.heads = FixedExitHeads(
+            torch.tensor([[4.0, -4.0], [0.0, 0.0], [-5.0, 5.0]])
+        )
+
+    def classify(self, threshold):
+        return inference.classify_batch_early_exit(
+            inference.MODEL, self.heads, self.inputs, threshold
+        )
+
+    def assert_matches_full_model(self, result, row):
+        probabilities = result["probabilities"]
+        torch.testing.assert_close(
+            torch.tensor([probabilities["no_bark"], probabilities["bark"]]),
+            self.expected[row],
+            rtol=1e-4,
+            atol=1e-5,
+        )
+
+    def test_confident_rows_exit_early(self):
+        layer_rows = []
+        run_encoder_layer = inference.run_encoder_layer
+
+        def counting_run_encoder_layer(model, number, hidden_states):
+            layer_rows.append((number, len(hidden_states)))
+            return run_encoder_layer(model, number, hidden_states)
+
+        with mock.patch.object(
+            inference, "run_encoder_layer", counting_run_encoder_layer
+        ):
+            results = self.classify(0.9)
+
+        self.assertEqual([result["exit_layer"] for result in results], [1, 2, 1])
+        self.assertEqual(results[0]["prediction"], "no_bark")
+        self.assertEqual(results[2]["prediction"], "bark")
+        self.assertEqual(results[0]["model"], "early_exit")
+        # Only the unsure row went through the last layer
+        self.assertEqual(layer_rows, [(1, 3), (2, 1)])
+        self.assertEqual(results[1]["model"], "teacher")
+        self.assert_matches_full_model(results[1], 1)
+
+    def test_threshold_of_one_gives_full_model_output(self):
+        results = self.classify(1.0)
+        for row, result in enumerate(results):
+            self.assertEqual(result["exit_layer"], 2)
+            self.assertEqual(result["model"], "teacher")
+            self.assert_matches_full_model(result, row)
+
+
+@override_settings(AI_SERVING_BACKEND="student")
+class StudentServingTests(TinyModelMixin, SimpleTestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.student = torch.jit.script(ShortInputStudent().eval())
+        patcher = mock.patch.object(inference, "STUDENT_MODEL", self.student)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_short_clip_is_padded_to_model_input(self):
+        clip = noise(0.1, 30)
+        inputs = inference.preprocess_samples(clip, inference.FEATURE_EXTRACTOR)
+        padded = torch.zeros(1, inference.MODEL_INPUT_SAMPLES)
+        padded[:, : len(clip)] = inputs["input_values"]
+
+        (result,) = inference.classify_batch_with_student(self.student, inputs)
+
+        with torch.no_grad():
+            expected = torch.softmax(self.student(padded), dim=-1)[0, 1].item()
+        self.assertAlmostEqual(result["probabilities"]["bark"], expected, places=5)
+
+    def test_analyze_short_clip(self):
+        result = inference.analyze_samples(noise(0.1, 31))
+        self.assertEqual(result["model"], "student")
+
+
+class PreprocessSamplesTests(SimpleTestCase):
+    def reference(self, clips, feature_extractor):
+        return feature_extractor(
+            clips,
+            sampling_rate=16000,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=inference.MODEL_INPUT_SAMPLES,
+        )
+
+    def assert_matches_feature_extractor(self, clips, feature_extractor):
+        expected = self.reference(clips, feature_extractor)
+        inputs = inference.preprocess_samples(clips, feature_extractor)
+
+        self.assertEqual(inputs["input_values"].dtype, torch.float32)
+        torch.testing.assert_close(
+            inputs["input_values"],
+            expected["input_values"].float(),
+            rtol=1e-4,
+            atol=1e-4,
+        )
+        if feature_extractor.return_attention_mask:
+            torch.testing.assert_close(
+                inputs["attention_mask"].long(), expected["attention_mask"].long()
+            )
+
+    def test_single_clip(self):
+        for seconds in (0.25, 1, 3):
+            with self.subTest(seconds=seconds):
+                self.assert_matches_feature_extractor(
+                    noise(seconds, 40), Wav2Vec2FeatureExtractor()
+                )
+
+    def test_batch_of_mixed_lengths(self):
+        clips = [noise(seconds, 41 + i) for i, seconds in enumerate((0.3, 0.8, 2))]
+        self.assert_matches_feature_extractor(clips, Wav2Vec2FeatureExtractor())
+        self.assert_matches_feature_extractor(
+            clips[:2], Wav2Vec2FeatureExtractor(return_attention_mask=True)
+        )
+
+    def test_batch_of_long_clips(self):
+        # Truncated to the first second of every clip
+        clips = [noise(3, 50 + i) for i in range(8)]
+        self.assert_matches_feature_extractor(clips, Wav2Vec2FeatureExtractor())
+
+    def test_benchmark_command(self):
+        output = io.StringIO()
+        call_command(
+            "benchmark_preprocessing",
+            "--batch-sizes",
+            "2",
+            "--repeat",
+            "1",
+            stdout=output,
+        )
+        row = output.getvalue().splitlines()[-1].split()
+        self.assertEqual(row[0], "2")
+        self.assertLess(float(row[-1]), 1e-4)
+
+
+class BarkIndexTests(TinyModelMixin, SimpleTestCase):
+    def setUp(self):
+        # Every clip is a bark with the tiny model's classifier biased
+        classifier = inference.MODEL.classifier
+        bias = classifier.bias.detach().clone()
+        with torch.no_grad():
+            classifier.bias.copy_(torch.tensor([-100.0, 100.0]))
+        self.addCleanup(lambda: classifier.bias.data.copy_(bias))
+
+    def test_bark_is_indexed(self):
+        result = inference.analyze_samples(noise(1, 60), user_id=1)
+        self.assertEqual(result["prediction"], "bark")
+        for field in BARK_INDEX_FIELDS:
+            self.assertIn(field, result)
+
+    def test_index_failure_keeps_result(self):
+        for error in (OSError("disk full"), ValueError("Expected a 256-d embedding")):
+            with self.subTest(error=error), mock.patch.object(
+                inference, "index_bark", side_effect=error
+            ):
+                result = inference.analyze_samples(noise(1, 61), user_id=1)
+            self.assertEqual(result["prediction"], "bark")
+            for field in BARK_INDEX_FIELDS:
+                self.assertNotIn(field, result)
+
+    def test_coalesced_barks_are_indexed_and_cached(self):
+        self.enterContext(
+            mock.patch.object(
+                coalescing,
+                "CLIP_COALESCER",
+                ClipCoalescer(window=0.2, max_seconds=10),
+            )
+        )
+        self.enterContext(override_settings(AI_COALESCE_WINDOW=0.2))
+        stream = noise(5, 62)
+        clips = [stream[start : start + 3 * 16000] for start in (0, 16000, 32000)]
+        keys = [inference.cheap_result(clip)[1] for clip in clips]
+        with mock.patch.object(
+            inference, "index_bark", wraps=inference.index_bark
+        ) as index_bark:
+            futures = [
+                coalescing.submit_analysis(7, clip, cache_key=key)
+                for clip, key in zip(clips, keys)
+            ]
+            results = [future.result(timeout=30) for future in futures]
+
+        self.assertEqual([result["coalesced"] for result in results], [3, 3, 3])
+        for result in results:
+            for field in BARK_INDEX_FIELDS:
+                self.assertIn(field, result)
+        # Every clip is indexed on its own, from the windows that cover it
+        pooled = [call.args[1] for call in index_bark.call_args_list]
+        self.assertEqual(len(pooled), 3)
+        for first, second in itertools.combinations(pooled, 2):
+            self.assertFalse(np.array_equal(first, second))
+        for clip in clips:
+            cached, _ = inference.cheap_result(clip)
+            self.assertTrue(cached["cached"])
+            self.assertEqual(cached["prediction"], "bark")
+
+
+class ParseByteRangeTests(SimpleTestCase):
+    def test_valid_ranges(self):
+        cases = {
+            "bytes=0-99": (0, 100),
+            "bytes=10-": (10, 1000),
+            "bytes=900-5000": (900, 1000),
+            "bytes=-100": (900, 1000),
+            "bytes=-5000": (0, 1000),
+            "bytes=5-5": (5, 6),
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(parse_byte_range(header, 1000), expected)
+
+    def test_invalid_ranges_are_ignored(self):
+        invalid = (
+            None,
+            "",
+            "bytes=5-3",
+            "bytes=-",
+            "bytes=a-b",
+            "bytes=--3",
+            "bytes=0-1,5-9",
+            "items=0-9",
+        )
+        for header in invalid:
+            with self.subTest(header=header):
+                self.assertIsNone(parse_byte_range(header, 1000))
+
+    def test_unsatisfiable_ranges(self):
+        for header in ("bytes=1000-", "bytes=2000-3000", "bytes=-0"):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                parse_byte_range(header, 1000)
+
+
+class ArchivedClipTests(TinyModelMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", password="secret")
+
+    def setUp(self):
+        # Every clip is a bark, and so archived
+        classifier = inference.MODEL.classifier
+        bias = classifier.bias.detach().clone()
+        with torch.no_grad():
+            classifier.bias.copy_(torch.tensor([-100.0, 100.0]))
+        self.addCleanup(lambda: classifier.bias.data.copy_(bias))
+
+        archive_dir = tempfile.mkdtemp(dir=self.work_dir)
+        self.enterContext(override_settings(AI_CLIP_ARCHIVE_ENABLED=True))
+        self.archive = clip_archive.ClipArchive(archive_dir)
+        self.enterContext(mock.patch.object(clip_archive, "CLIP_ARCHIVE", self.archive))
+
+    def test_clip_id_is_returned_and_logged(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post("/main/ai/analyze/", {"file": wav_upload(noise(1, 70))})
+
+        self.assertEqual(response.status_code, 200)
+        clip_id = response.json()["clip_id"]
+        self.assertIsNotNone(self.archive.lookup(bytes.fromhex(clip_id)))
+
+        result = views.EVENT_LOG.record.call_args.args[1]
+        self.assertEqual(result["clip_id"], clip_id)
+        writer = BufferedEventWriter(batch_size=10, flush_interval=60, max_buffer=10)
+        writer._start = lambda: None
+        writer.record(self.user.pk, result, "clip.wav", 1000)
+        writer.flush()
+        self.assertEqual(DetectionEvent.objects.get().clip_id, clip_id)
+
+    def test_cached_result_has_no_clip_id(self):
+        samples = noise(1, 71)
+        _, cache_key = inference.cheap_result(samples)
+        result = inference.analyze_samples(samples, cache_key=cache_key, user_id=1)
+        self.assertIn("clip_id", result)
+        # The cache key only covers the first second, other clips may share it
+        cached, _ = inference.cheap_result(samples)
+        self.assertNotIn("clip_id", cached)
+
+
+class ClipCoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.coalescer = ClipCoalescer(window=0.2, max_seconds=10)
+        self.scheduled = []
+
+    def schedule(self, samples, clips):
+        self.scheduled.append((len(samples), len(clips)))
+        future = Future()
+        future.set_result(
+            [
+                {"samples": len(samples), "clips": len(clips), "clip": clip}
+                for clip in clips
+            ]
+        )
+        return future
+
+    def test_overlapping_clips_are_scored_once(self):
+        stream = noise(5, 70)
+        starts = (0, 16000, 32000)
+        clips = [stream[start : start + 3 * 16000] for start in starts]
+        futures = [
+            self.coalescer.submit("dev", clip, self.schedule, cache_key=index)
+            for index, clip in enumerate(clips)
+        ]
+
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual(self.scheduled, [(len(stream), 3)])
+        # Every request gets the result of its own clip in the merged audio
+        self.assertEqual(
+            [result["clip"] for result in results],
+            [(start, start + 3 * 16000, index) for index, start in enumerate(starts)],
+        )
+
+    def test_clip_without_overlap_gets_its_own_result(self):
+        loud = self.coalescer.submit("dev", noise(2, 71), self.schedule)
+        quiet = self.coalescer.submit("dev", noise(2, 72, level=0.01), self.schedule)
+
+        self.assertEqual(loud.result(timeout=5)["clips"], 1)
+        self.assertEqual(quiet.result(timeout=5)["clips"], 1)
+        self.assertEqual(sorted(self.scheduled), [(32000, 1), (32000, 1)])
+        self.assertEqual(self.coalescer.stats()["forward_passes_avoided"], 0)
+
+    def test_overlap_search_does_not_block_other_recorders(self):
+        searching = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow_overlap(group, clip):
+            searching.set()
+            release.wait(5)
+            return 0
+
+        stream = noise(4, 73)
+        self.coalescer.submit("slow", stream[: 2 * 16000], self.schedule)
+        with mock.patch("main.coalescing.ClipGroup.overlap", slow_overlap):
+            thread = threading.Thread(
+                target=self.coalescer.submit,
+                args=("slow", stream[16000:], self.schedule),
+            )
+            thread.start()
+            self.assertTrue(searching.wait(5))
+
+            start = time.perf_counter()
+            other = self.coalescer.submit("other", noise(1, 74), self.schedule)
+            self.assertLess(time.perf_counter() - start, 1)
+            release.set()
+            thread.join()
+
+        self.assertEqual(other.result(timeout=5)["clips"], 1)
+
+
+class UserHeadTests(TinyModelMixin, SimpleTestCase):
+    def setUp(self):
+        self.enterContext(override_settings(AI_USER_HEADS_ENABLED=True))
+        self.enterContext(
+            mock.patch.object(
+                user_heads, "USER_HEADS", UserHeadCache(head_dir=self.work_dir)
+            )
+        )
+        # User 3's head calls everything a bark
+        save_user_head(
+            3,
+            torch.zeros(2, 256),
+            torch.tensor([-100.0, 100.0]),
+            head_dir=self.work_dir,
+        )
+
+    def test_head_scores_its_users_batches(self):
+        samples = noise(1, 90)
+        result = inference.analyze_samples(samples, user_id=3)
+        self.assertEqual(result["prediction"], "bark")
+        self.assertTrue(result["personalized"])
+
+        for user_id in (4, None):
+            with self.subTest(user_id=user_id):
+                result = inference.analyze_samples(samples, user_id=user_id)
+                self.assertNotIn("personalized", result)
+
+    def test_head_scores_every_window_of_a_recording(self):
+        samples = noise(6, 91, level=0.01)
+        samples[16000:40000] += noise(1.5, 92)
+        samples[64000:72000] += noise(0.5, 93)
+        events, results, windows_scored = inference.analyze_recording(
+            samples, user_id=3
+        )
+        self.assertEqual(len(events), 2)
+        self.assertGreater(windows_scored, 2)
+        self.assertTrue(all(result["personalized"] for result in results))
+
+
+class SampleNegativesTests(SimpleTestCase):
+    def test_sample_is_stable_per_user(self):
+        paths = [f"no_bark/{index}.wav" for index in range(50)]
+
+        clips = sample_negatives(paths, user_id=7, count=10)
+
+        self.assertEqual(clips, sample_negatives(paths, user_id=7, count=10))
+        self.assertNotEqual(clips, sample_negatives(paths, user_id=8, count=10))
+        self.assertEqual(len({path for _, path, _ in clips}), 10)
+        self.assertTrue(all(label == 0 for *_, label in clips))
+        self.assertEqual(len(sample_negatives(paths, user_id=7, count=500)), 50)
@@ -0,0 +1,160 @@
+import os
+import logging
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from .audio import (
+    ALLOWED_AUDIO_EXTENSIONS,
+    AudioDecodeError,
+    AudioLimitExceeded,
+    create_decoder,
+)
+
+logger = logging.getLogger(__name__)
+
+AUDIO_FIELD_NAME = "file"
+
+
+class UploadRejected(Exception):
+    """
+    Raised when an audio upload is missing, unsupported or undecodable
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class DecodedAudioUpload:
+    """
+    Uploaded audio file that has already been decoded to mono float32 samples
+    """
+
+    def __init__(self, name, size, content_type, samples, sampling_rate, error=None):
+        self.name = name
+        self.size = size
+        self.content_type = content_type
+        self.samples = samples
+        self.sampling_rate = sampling_rate
+        self.error = error
+
+    def __repr__(self):
+        decoded = "failed" if self.samples is None else f"{len(self.samples)} samples"
+        return f"<DecodedAudioUpload: {self.name} ({decoded})>"
+
+
+class StreamingAudioUploadHandler(FileUploadHandler):
+    """
+    Upload handler that decodes the audio field while it is being received
+
+    Nothing but the decoded target-rate signal is kept, and the size and
+    duration limits are enforced as soon as they are exceeded. Once an upload
+    is rejected the remaining bytes are read and discarded, so the view can
+    still answer with a proper error. The limits default to the single-clip
+    ones, AUDIO_MAX_DURATION_SECONDS and AUDIO_UPLOAD_MAX_BYTES.
+    """
+
+    chunk_size = 64 * 2**10
+
+    def __init__(self, request=None, max_duration=None, max_bytes=None):
+        super().__init__(request)
+        if max_duration is None:
+            max_duration = settings.AUDIO_MAX_DURATION_SECONDS
+        if max_bytes is None:
+            max_bytes = settings.AUDIO_UPLOAD_MAX_BYTES
+        self.max_duration = max_duration
+        self.max_bytes = max_bytes
+        self.decoder = None
+        self.error = None
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+
+        # Anything else is left to the default handlers
+        if field_name != AUDIO_FIELD_NAME:
+            return
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension not in ALLOWED_AUDIO_EXTENSIONS:
+            return
+
+        self.decoder = create_decoder(
+            extension,
+            max_duration=self.max_duration,
+            max_bytes=self.max_bytes,
+        )
+        self.error = None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.decoder is None:
+            return raw_data
+
+        if self.error is None:
+            try:
+                self.decoder.feed(raw_data)
+            except AudioDecodeError as e:
+                logger.warning(f"Rejecting upload {self.file_name}: {e}")
+                self.error = e
+                self.decoder.close()
+
+        return None
+
+    def file_complete(self, file_size):
+        if self.decoder is None:
+            return None
+
+        decoder = self.decoder
+        self.decoder = None
+
+        samples = None
+        if self.error is None:
+            try:
+                samples = decoder.finish()
+            except AudioDecodeError as e:
+                logger.warning(f"Could not decode upload {self.file_name}: {e}")
+                self.error = e
+            finally:
+                decoder.close()
+
+        return DecodedAudioUpload(
+            name=self.file_name,
+            size=file_size,
+            content_type=self.content_type,
+            samples=samples,
+            sampling_rate=decoder.target_sampling_rate,
+            error=self.error,
+        )
+
+    def upload_interrupted(self):
+        if self.decoder is not None:
+            self.decoder.close()
+            self.decoder = None
+
+
+def get_decoded_upload(files):
+    """
+    Return the decoded audio upload from request.FILES or raise UploadRejected
+    """
+    # Check if file is provided
+    if AUDIO_FIELD_NAME not in files:
+        raise UploadRejected("No audio file provided")
+
+    audio_file = files[AUDIO_FIELD_NAME]
+
+    # Validate file type
+    file_extension = os.path.splitext(audio_file.name)[1].lower()
+
+    if file_extension not in ALLOWED_AUDIO_EXTENSIONS:
+        raise UploadRejected(
+            f"Unsupported file format. Allowed: {', '.join(ALLOWED_AUDIO_EXTENSIONS)}"
+        )
+
+    if isinstance(audio_file.error, AudioLimitExceeded):
+        raise UploadRejected(str(audio_file.error), status_code=413)
+
+    if audio_file.error is not None:
+        raise UploadRejected("Could not decode audio file")
+
+    return audio_file
@@ -1,7 +1,42 @@
 from django.urls import path
-from .views import CreateUserView, RegisterView, AnalyzeAudioView
+from django.views.decorators.csrf import csrf_exempt
+from .views import (
+    CreateUserView,
+    RegisterView,
+    AnalyzeAudioView,
+    AsyncAnalyzeAudioView,
+    AnalysisStatsView,
+    ArchivedClipView,
+    BarkClustersView,
+    ProfileListView,
+    ProfileView,
+    SegmentAudioView,
+    SimilarBarksView,
+)
 
 urlpatterns = [
     path("ai/analyze/", AnalyzeAudioView.as_view(), name="analyze_audio"),
+    path(
+        "ai/analyze/async/",
+        csrf_exempt(AsyncAnalyzeAudioView.as_view()),
+        name="analyze_audio_async",
+    ),
+    path("ai/segment/", SegmentAudioView.as_view(), name="segment_audio"),
+    path("ai/stats/", AnalysisStatsView.as_view(), name="analysis_stats"),
+    path(
+        "ai/barks/<int:bark_id>/similar/",
+        SimilarBarksView.as_view(),
+        name="similar_barks",
+    ),
+    path("ai/barks/clusters/", BarkClustersView.as_view(), name="bark_clusters"),
+    path(
+        "ai/clips/<str:clip_id>/", ArchivedClipView.as_view(), name="archived_clip"
+    ),
+    path("ai/profiles/", ProfileListView.as_view(), name="analysis_profiles"),
+    path(
+        "ai/profiles/<str:request_id>/",
+        ProfileView.as_view(),
+        name="analysis_profile",
+    ),
     
 ]
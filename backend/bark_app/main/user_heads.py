@@ -0,0 +1,189 @@
+"""
+Per-user classifier heads on the shared wav2vec2 backbone
+
+Background noise differs a lot between homes, so one global classifier
+misfires in some of them. A user's head is a copy of the model's own final
+linear layer (the one on the pooled projector output the embedding index
+stores), fine-tuned on the user's labeled clips by the ``train_user_heads``
+command. The backbone stays shared and frozen: a batch runs it once, and is
+then scored by its user's head, or by the global classifier if the user has
+none.
+
+A batch always belongs to one user: it is a single clip, a coalesced group or
+the windows of a recording. Requests of different users are not batched
+together, admission control queues and coalesces them per user, so the heads
+are applied per batch rather than per row.
+
+Heads are loaded on demand into an LRU cache bounded by
+AI_USER_HEAD_CACHE_BYTES. A head that is retrained on disk is picked up on its
+user's next request.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import torch
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Fields a personalized result adds to the analysis response
+USER_HEAD_FIELDS = ("personalized",)
+
+# Recent head loads that latency percentiles are computed over
+LOAD_TIMINGS = 1000
+
+
+def head_path(user_id, head_dir=None):
+    return os.path.join(head_dir or settings.AI_USER_HEAD_DIR, f"user_{user_id}.pt")
+
+
+def save_user_head(user_id, weight, bias, head_dir=None, **metadata):
+    """
+    Write a user's head, replacing the previous one atomically
+    """
+    path = head_path(user_id, head_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    torch.save(
+        dict(
+            metadata,
+            weight=weight.detach().float().contiguous(),
+            bias=bias.detach().float().contiguous(),
+        ),
+        temporary,
+    )
+    os.replace(temporary, path)
+    return path
+
+
+class UserHead:
+    def __init__(self, weight, bias, mtime):
+        self.weight = weight
+        self.bias = bias
+        self.mtime = mtime
+        self.nbytes = weight.nbytes + bias.nbytes
+
+    def __call__(self, embeddings):
+        return embeddings @ self.weight.T + self.bias
+
+
+class UserHeadCache:
+    """
+    LRU cache of user heads within a memory budget
+    """
+
+    def __init__(self, head_dir=None, max_bytes=None):
+        self.head_dir = head_dir
+        self.max_bytes = (
+            settings.AI_USER_HEAD_CACHE_BYTES if max_bytes is None else max_bytes
+        )
+        self._heads = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.without_head = 0
+        self.evictions = 0
+        self._load_timings = deque(maxlen=LOAD_TIMINGS)
+
+    def get(self, user_id):
+        """
+        Return the user's head, or None if they have none
+        """
+        path = head_path(user_id, self.head_dir)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self.without_head += 1
+                self._drop(user_id)
+            return None
+
+        with self._lock:
+            head = self._heads.get(user_id)
+            if head is not None and head.mtime == mtime:
+                self._heads.move_to_end(user_id)
+                self.hits += 1
+                return head
+            self.misses += 1
+
+        # Loaded outside the lock, other users' lookups do not wait on disk
+        start = time.perf_counter()
+        try:
+            state = torch.load(path, map_location="cpu", weights_only=True)
+        except (OSError, RuntimeError) as e:
+            logger.error(f"Could not load head of user {user_id}: {e}")
+            return None
+        head = UserHead(state["weight"], state["bias"], mtime)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._load_timings.append(elapsed)
+            self._drop(user_id)
+            self._heads[user_id] = head
+            self._bytes += head.nbytes
+            # The head just loaded stays even if it alone exceeds the budget
+            while self._bytes > self.max_bytes and len(self._heads) > 1:
+                _, evicted = self._heads.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+        return head
+
+    def _drop(self, user_id):
+        head = self._heads.pop(user_id, None)
+        if head is not None:
+            self._bytes -= head.nbytes
+
+    def personalize(self, logits, embeddings, user_id):
+        """
+        Score a batch of one user's clips by that user's head
+
+        ``logits`` are the global classifier's for the batch and
+        ``embeddings`` the pooled backbone features it was applied to. Returns
+        the logits and whether the user's head scored them.
+        """
+        head = self.get(user_id)
+        if head is None:
+            return logits, False
+
+        return head(embeddings.float()), True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            timings = 1000 * np.asarray(self._load_timings)
+            return {
+                "heads": len(self._heads),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "without_head": self.without_head,
+                "evictions": self.evictions,
+                "load_ms_p50": float(np.percentile(timings, 50)) if len(timings) else None,
+                "load_ms_p95": float(np.percentile(timings, 95)) if len(timings) else None,
+            }
+
+
+USER_HEADS = None
+
+
+def get_user_heads():
+    """
+    Return the user head cache of this process, or None if heads are off
+    """
+    global USER_HEADS
+
+    if not settings.AI_USER_HEADS_ENABLED:
+        return None
+    if USER_HEADS is None:
+        USER_HEADS = UserHeadCache()
+
+    return USER_HEADS
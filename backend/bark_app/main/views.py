@@ -1,28 +1,50 @@
 from rest_framework import generics, status
 
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth.models import User
 
 
 from .serializers import UserSerializer, RegisterSerializer
-import os
-import tempfile
-import soundfile as sf
-import librosa
-import numpy as np
-import torch
-from transformers import AutoModelForAudioClassification, AutoFeatureExtractor
+from .authentication import CachedJWTAuthentication
+from .clip_archive import CLIP_ARCHIVE_FIELDS, get_clip_archive
+from .coalescing import COALESCED_FIELDS, get_clip_coalescer, submit_analysis
+from .embeddings import BARK_INDEX_FIELDS, EMBEDDING_INDEXES
+from .event_log import EVENT_LOG
+from .live import publish_detection, publish_detection_sync
+from .user_heads import USER_HEAD_FIELDS, get_user_heads
+from .upload_handlers import (
+    StreamingAudioUploadHandler,
+    UploadRejected,
+    get_decoded_upload,
+)
+from .admission import Overloaded
+from .profiling import list_profiles, load_profile, phase, profile_path, start_profile
+from .inference import (
+    CASCADE_STATS,
+    EXIT_STATS,
+    RESULT_CACHE,
+    analyze_recording,
+    analyze_samples,
+    cheap_result,
+    get_admission_controller,
+    get_segment_admission_controller,
+)
+import asyncio
+import re
+import threading
+import time
 from datetime import datetime
 import logging
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.http import FileResponse, HttpResponse, JsonResponse
 from django.conf import settings
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
 
 logger = logging.getLogger(__name__)
 
-# Global variables for model loading
-MODEL = None
-FEATURE_EXTRACTOR = None
-
 
 # Create your views here.
 class CreateUserView(generics.CreateAPIView):
@@ -37,192 +59,502 @@ class RegisterView(generics.CreateAPIView):
     permission_classes = [AllowAny]
 
 
-def load_model(model_path=None):
+def overloaded_response_data(error):
+    """
+    Return (body, headers) for a request shed by admission control
+    """
+    return (
+        {"error": error.message, "retry_after": error.retry_after},
+        {"Retry-After": str(error.retry_after)},
+    )
+
+
+def analysis_response_data(result, audio_file, timestamp):
+    """
+    Return the body answering an analyzed clip
+    """
+    response_data = {
+        "success": True,
+        "prediction": result["prediction"],
+        "confidence": result["confidence"],
+        "probabilities": result["probabilities"],
+        "timestamp": timestamp,
+        "filename": audio_file.name,
+        "file_size": audio_file.size,
+    }
+    # Barks added to the embedding index, clips scored together, clips
+    # scored by the user's own head and clips kept in the archive
+    fields = (
+        BARK_INDEX_FIELDS + COALESCED_FIELDS + USER_HEAD_FIELDS + CLIP_ARCHIVE_FIELDS
+    )
+    response_data.update({key: result[key] for key in fields if key in result})
+
+    return response_data
+
+
+class StreamingAudioUploadMixin:
     """
-    Load the trained model and feature extractor
+    Decodes the "file" upload while it is received and validates the result
     """
-    global MODEL, FEATURE_EXTRACTOR
 
-    if MODEL is None or FEATURE_EXTRACTOR is None:
+    def get_upload_handler(self, request):
+        return StreamingAudioUploadHandler(request)
+
+    def initial(self, request, *args, **kwargs):
+        # Decode the upload while it is received instead of buffering it
+        request.upload_handlers.insert(0, self.get_upload_handler(request))
+        super().initial(request, *args, **kwargs)
+
+    def get_audio_upload(self, request):
+        """
+        Return (audio_file, None) or (None, error_response)
+        """
         try:
-            # Use Django settings for model path
-            if model_path is None:
-                model_path = settings.AI_MODEL_ROOT
+            return get_decoded_upload(request.FILES), None
+        except UploadRejected as e:
+            return None, Response({"error": e.message}, status=e.status_code)
 
-            logger.info(f"Loading model from {model_path}...")
 
-            # Check if model directory exists
-            if not os.path.exists(model_path):
-                raise FileNotFoundError(f"Model directory not found: {model_path}")
+class AnalyzeAudioView(StreamingAudioUploadMixin, generics.GenericAPIView):
+    """
+    Class-based view for analyzing audio files for bark detection
+    """
 
-            # Load the model from local path
-            MODEL = AutoModelForAudioClassification.from_pretrained(
-                model_path, local_files_only=True
-            )
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
 
-            # Load the feature extractor from the original pre-trained model
-            FEATURE_EXTRACTOR = AutoFeatureExtractor.from_pretrained(
-                "facebook/wav2vec2-base"
-            )
+    def post(self, request, *args, **kwargs):
+        """
+        Analyze audio file for bark detection
+
+        Staff can have the request profiled, see main.profiling.
+        """
+        profile = start_profile(request)
 
-            # Set model to evaluation mode
-            MODEL.eval()
+        try:
+            with phase(profile, "upload"):
+                audio_file, error_response = self.get_audio_upload(request)
+            if error_response is not None:
+                return error_response
+
+            # Silent and already scored clips are answered without inference
+            with phase(profile, "cheap_result"):
+                result, cache_key = cheap_result(audio_file.samples, request.user.pk)
+            if profile is not None and result is not None and result.get("cached"):
+                # Profile the model rather than a cache lookup
+                result = None
+
+            if result is None:
+                try:
+                    if profile is not None:
+                        # Profiled requests are never coalesced with others
+                        future = get_admission_controller().submit(
+                            request.user.pk,
+                            profile.wrap("inference", analyze_samples),
+                            audio_file.samples,
+                            cache_key=cache_key,
+                            user_id=request.user.pk,
+                        )
+                    else:
+                        future = submit_analysis(
+                            request.user.pk,
+                            audio_file.samples,
+                            cache_key=cache_key,
+                            device=request.headers.get("X-Device-ID", ""),
+                        )
+
+                    # Make prediction
+                    result = future.result()
+                except Overloaded as e:
+                    body, headers = overloaded_response_data(e)
+                    return Response(body, status=e.status_code, headers=headers)
+
+            with phase(profile, "record"):
+                EVENT_LOG.record(
+                    request.user.pk, result, audio_file.name, audio_file.size
+                )
+                timestamp = datetime.now().isoformat()
+                publish_detection_sync(
+                    request.user.pk, result, audio_file.name, timestamp
+                )
+
+            response_data = analysis_response_data(result, audio_file, timestamp)
+
+            headers = None
+            if profile is not None:
+                response_data["profile"] = profile.save()
+                headers = {"X-Request-ID": profile.request_id}
+
+            return Response(response_data, status=status.HTTP_200_OK, headers=headers)
 
-            logger.info("Model loaded successfully")
         except Exception as e:
-            logger.error(f"Error loading model: {e}")
-            raise e
+            logger.error(f"Error in analyze_audio: {e}")
+            if profile is not None:
+                profile.save(error=str(e))
+            return Response(
+                {"error": "Internal server error during audio analysis"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+
+class SegmentAudioView(StreamingAudioUploadMixin, generics.GenericAPIView):
+    """
+    Find and classify the sound events of a long recording
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_upload_handler(self, request):
+        # Recordings are allowed to be longer than a single clip
+        return StreamingAudioUploadHandler(
+            request,
+            max_duration=settings.AUDIO_SEGMENT_MAX_DURATION_SECONDS,
+            max_bytes=settings.AUDIO_SEGMENT_MAX_BYTES,
+        )
 
-    return MODEL, FEATURE_EXTRACTOR
+    def post(self, request, *args, **kwargs):
+        """
+        Segment a recording into candidate events and classify each of them
+        """
+        try:
+            audio_file, error_response = self.get_audio_upload(request)
+            if error_response is not None:
+                return error_response
+
+            samples = audio_file.samples
+            sampling_rate = audio_file.sampling_rate
+
+            # Only the candidate events are sent through the classifier
+            try:
+                future = get_segment_admission_controller().submit(
+                    request.user.pk,
+                    analyze_recording,
+                    samples,
+                    sampling_rate,
+                    user_id=request.user.pk,
+                )
+            except Overloaded as e:
+                body, headers = overloaded_response_data(e)
+                return Response(body, status=e.status_code, headers=headers)
 
+            events, results, windows_scored = future.result()
+
+            response_data = {
+                "success": True,
+                "duration": len(samples) / sampling_rate,
+                "events": [
+                    {
+                        "start": start / sampling_rate,
+                        "end": end / sampling_rate,
+                        "prediction": result["prediction"],
+                        "confidence": result["confidence"],
+                        "probabilities": result["probabilities"],
+                    }
+                    for (start, end), result in zip(events.tolist(), results)
+                ],
+                "windows_scored": windows_scored,
+                "timestamp": datetime.now().isoformat(),
+                "filename": audio_file.name,
+                "file_size": audio_file.size,
+            }
+
+            return Response(response_data, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.error(f"Error in segment_audio: {e}")
+            return Response(
+                {"error": "Internal server error during audio segmentation"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
 
-def load_audio_file(audio_path, target_sampling_rate=16000):
+
+class SimilarBarksView(generics.GenericAPIView):
     """
-    Load audio file using soundfile and librosa
+    Past barks of the user that sound most like one of their stored barks
     """
-    try:
-        # Load audio using soundfile
-        audio_array, sampling_rate = sf.read(audio_path)
 
-        # Convert to mono if stereo
-        if len(audio_array.shape) > 1:
-            audio_array = audio_array.mean(axis=1)
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
 
-        # Resample if needed
-        if sampling_rate != target_sampling_rate:
-            audio_array = librosa.resample(
-                audio_array, orig_sr=sampling_rate, target_sr=target_sampling_rate
+    def get(self, request, bark_id, *args, **kwargs):
+        try:
+            k = min(max(int(request.query_params.get("k", 10)), 1), 100)
+        except ValueError:
+            return Response(
+                {"error": "k must be an integer"}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        return audio_array, target_sampling_rate
-    except Exception as e:
-        logger.error(f"Error loading audio file {audio_path}: {e}")
-        # Return silence if loading fails
-        return np.zeros(target_sampling_rate), target_sampling_rate
+        index = EMBEDDING_INDEXES.get(request.user.pk)
+        start = time.perf_counter()
+        try:
+            bark = index.describe(bark_id)
+            similar = index.similar_to(bark_id, k)
+        except IndexError:
+            return Response(
+                {"error": "Bark not found"}, status=status.HTTP_404_NOT_FOUND
+            )
 
+        return Response(
+            {
+                "bark": bark,
+                "similar": similar,
+                "indexed": len(index),
+                "search_ms": 1000 * (time.perf_counter() - start),
+            },
+            status=status.HTTP_200_OK,
+        )
 
-def preprocess_audio(audio_path, feature_extractor, target_sampling_rate=16000):
+
+class BarkClustersView(generics.GenericAPIView):
     """
-    Preprocess a single audio file for inference
+    Clusters of similar-sounding barks of the user, roughly one per dog
     """
-    # Load and resample audio
-    audio_array, sr = load_audio_file(audio_path, target_sampling_rate)
 
-    # Extract features
-    inputs = feature_extractor(
-        audio_array,
-        sampling_rate=target_sampling_rate,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
-        max_length=16000,
-    )
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        index = EMBEDDING_INDEXES.get(request.user.pk)
+        return Response(
+            {"clusters": index.clusters(), "indexed": len(index)},
+            status=status.HTTP_200_OK,
+        )
 
-    return inputs
 
+class AnalysisStatsView(generics.GenericAPIView):
+    """
+    Operational figures of the analysis path
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        channel_layer = get_channel_layer()
+        clip_archive = get_clip_archive()
+        coalescer = get_clip_coalescer()
+        user_heads = get_user_heads()
+        return Response(
+            {
+                "event_log": EVENT_LOG.stats(),
+                "admission": get_admission_controller().stats(),
+                "segment_admission": get_segment_admission_controller().stats(),
+                "result_cache": {"hits": RESULT_CACHE.hits, "misses": RESULT_CACHE.misses},
+                "serving": {
+                    "backend": settings.AI_SERVING_BACKEND,
+                    "student": CASCADE_STATS["student"],
+                    "escalated": CASCADE_STATS["escalated"],
+                    "exit_layers": dict(sorted(EXIT_STATS.items())),
+                },
+                "clip_archive": clip_archive.stats() if clip_archive else None,
+                "coalescing": coalescer.stats() if coalescer else None,
+                "user_heads": user_heads.stats() if user_heads else None,
+                "channel_layer": channel_layer.stats()
+                if hasattr(channel_layer, "stats")
+                else None,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+def parse_byte_range(header, length):
+    """
+    Return (start, end) of a single "bytes=" Range header, end exclusive
 
-def use_model(model, feature_extractor, audio_path):
+    Returns None for a header that does not apply or is not a valid range, so
+    the whole body is sent. Raises ValueError for a valid range that lies
+    outside the body.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = int(last) + 1 if last else length
+        if last and end <= start:
+            # The last byte comes before the first one
+            return None
+    else:
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError(header)
+        start, end = max(length - suffix, 0), length
+    if start >= length:
+        raise ValueError(header)
+    return start, min(end, length)
+
+
+class ArchivedClipView(generics.GenericAPIView):
     """
-    Predict whether an audio file contains a bark
+    Encoded audio of an archived clip, with support for Range requests
     """
-    # Preprocess the audio
-    inputs = preprocess_audio(audio_path, feature_extractor)
 
-    # Make prediction
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        probabilities = torch.softmax(logits, dim=-1)
-        predicted_class = int(torch.argmax(logits, dim=-1).item())
-        confidence = probabilities[0][predicted_class].item()
+    permission_classes = [IsAdminUser]
 
-    # Map class index to label
-    class_labels = ["no_bark", "bark"]
-    predicted_label = class_labels[predicted_class]
+    def get(self, request, clip_id, *args, **kwargs):
+        archive = get_clip_archive()
+        try:
+            record = archive.lookup(bytes.fromhex(clip_id)) if archive else None
+        except ValueError:
+            record = None
+        if record is None:
+            return Response(
+                {"error": "Clip not found"}, status=status.HTTP_404_NOT_FOUND
+            )
 
-    return {
-        "prediction": predicted_label,
-        "confidence": confidence,
-        "class": predicted_class,
-        "probabilities": {
-            "no_bark": probabilities[0][0].item(),
-            "bark": probabilities[0][1].item(),
-        },
-    }
+        length = record["length"]
+        try:
+            byte_range = parse_byte_range(request.headers.get("Range"), length)
+        except ValueError:
+            return HttpResponse(
+                status=416, headers={"Content-Range": f"bytes */{length}"}
+            )
 
+        start, end = byte_range or (0, length)
+        response = HttpResponse(
+            archive.read(clip_id, start, end),
+            content_type=record["content_type"],
+            status=206 if byte_range else 200,
+        )
+        response["Accept-Ranges"] = "bytes"
+        response["Content-Length"] = str(end - start)
+        if byte_range:
+            response["Content-Range"] = f"bytes {start}-{end - 1}/{length}"
+        return response
 
-class AnalyzeAudioView(generics.GenericAPIView):
+
+class ProfileListView(generics.GenericAPIView):
     """
-    Class-based view for analyzing audio files for bark detection
+    Stored profiles of analysis requests, newest first
     """
 
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAdminUser]
 
-    def post(self, request, *args, **kwargs):
-        """
-        Analyze audio file for bark detection
-        """
-        print("🔍 Request FILES:", request.FILES)
-        print("🔍 Request DATA:", request.data)
+    def get(self, request, *args, **kwargs):
+        return Response({"profiles": list_profiles()}, status=status.HTTP_200_OK)
 
+
+class ProfileView(generics.GenericAPIView):
+    """
+    Profile of one analysis request, ?download=1 returns the raw cProfile stats
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, request_id, *args, **kwargs):
         try:
-            # Check if file is provided
-            if "file" not in request.FILES:
-                return Response(
-                    {"error": "No audio file provided"},
-                    status=status.HTTP_400_BAD_REQUEST,
+            if request.query_params.get("download"):
+                return FileResponse(
+                    open(profile_path(request_id, "prof"), "rb"),
+                    as_attachment=True,
+                    filename=f"{request_id}.prof",
                 )
+            return Response(load_profile(request_id), status=status.HTTP_200_OK)
+        except FileNotFoundError:
+            return Response(
+                {"error": "Profile not found"}, status=status.HTTP_404_NOT_FOUND
+            )
 
-            audio_file = request.FILES["file"]
 
-            # Validate file type
-            allowed_extensions = [".wav", ".mp3", ".m4a", ".flac"]
-            file_extension = os.path.splitext(audio_file.name)[1].lower()
+async def authenticate_jwt(request):
+    """
+    Authenticate a plain Django request with the JWT bearer token
+
+    The token is validated inline and the user is usually served from the
+    local cache; only on a cache miss is the database queried, through
+    sync_to_async so the event loop is not blocked.
+    """
+    authentication = CachedJWTAuthentication()
+    try:
+        header = authentication.get_header(request)
+        if header is None:
+            return None
+        raw_token = authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = authentication.get_validated_token(raw_token)
+        user = authentication.get_cached_user(validated_token)
+        if user is None:
+            user = await sync_to_async(authentication.get_user)(validated_token)
+    except AuthenticationFailed:
+        return None
+
+    return user
 
-            if file_extension not in allowed_extensions:
-                return Response(
-                    {
-                        "error": f"Unsupported file format. Allowed: {', '.join(allowed_extensions)}"
-                    },
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
 
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(
-                delete=False, suffix=file_extension
-            ) as tmp:
-                temp_path = tmp.name
-                for chunk in audio_file.chunks():
-                    tmp.write(chunk)
+class AsyncAnalyzeAudioView(View):
+    """
+    Native async variant of AnalyzeAudioView
+
+    Upload parsing and inference run on worker threads, so the ASGI event loop
+    (and the sync thread that serves every other view) stays free while a clip
+    is analyzed. If the client disconnects, the pending work is cancelled.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        user = await authenticate_jwt(request)
+        if user is None or not user.is_active:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided or are invalid."},
+                status=401,
+            )
+
+        # Decode the upload while it is parsed, off the event loop
+        request.upload_handlers.insert(0, StreamingAudioUploadHandler(request))
+        try:
+            files = await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+            audio_file = get_decoded_upload(files)
+        except UploadRejected as e:
+            return JsonResponse({"error": e.message}, status=e.status_code)
+
+        # Silent and already scored clips are answered without inference
+        result, cache_key = cheap_result(audio_file.samples, user.pk)
 
+        cancelled = threading.Event()
+        future = None
+        if result is None:
             try:
-                # Load model
-                model, feature_extractor = load_model()
-
-                # Make prediction
-                result = use_model(model, feature_extractor, temp_path)
-
-                # Prepare response
-                response_data = {
-                    "success": True,
-                    "prediction": result["prediction"],
-                    "confidence": result["confidence"],
-                    "probabilities": result["probabilities"],
-                    "timestamp": datetime.now().isoformat(),
-                    "filename": audio_file.name,
-                    "file_size": audio_file.size,
-                }
-
-                return Response(response_data, status=status.HTTP_200_OK)
-
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
+                future = asyncio.wrap_future(
+                    submit_analysis(
+                        user.pk,
+                        audio_file.samples,
+                        cache_key=cache_key,
+                        cancelled=cancelled,
+                        device=request.headers.get("X-Device-ID", ""),
+                    )
+                )
+            except Overloaded as e:
+                body, headers = overloaded_response_data(e)
+                return JsonResponse(body, status=e.status_code, headers=headers)
 
+        try:
+            if future is not None:
+                result = await future
+        except asyncio.CancelledError:
+            # The client went away: skip the work if it has not started yet,
+            # otherwise stop it at the next checkpoint. A coalesced clip only
+            # stops waiting, the others of its group still need the result.
+            cancelled.set()
+            future.cancel()
+            logger.info(f"Analysis of {audio_file.name} cancelled by client disconnect")
+            raise
+        except Overloaded as e:
+            # Coalesced clips are shed when their group is scheduled
+            body, headers = overloaded_response_data(e)
+            return JsonResponse(body, status=e.status_code, headers=headers)
         except Exception as e:
-            logger.error(f"Error in analyze_audio: {e}")
-            return Response(
+            logger.error(f"Error in analyze_audio_async: {e}")
+            return JsonResponse(
                 {"error": "Internal server error during audio analysis"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                status=500,
             )
+
+        EVENT_LOG.record(user.pk, result, audio_file.name, audio_file.size)
+        timestamp = datetime.now().isoformat()
+        await publish_detection(user.pk, result, audio_file.name, timestamp)
+
+        return JsonResponse(
+            analysis_response_data(result, audio_file, timestamp), status=200
+        )